@@ -31,9 +31,19 @@ EDI Discord bot
 # (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
 # SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
+import time
+
+# Process start, to measure cold start
+START = time.perf_counter()
+
+# Messages cached in memory-budget mode (None disables the cache, channels still track their last message)
+BUDGET_MAX_MESSAGES = None
+
 from argparse import ArgumentParser, RawTextHelpFormatter
-from plexapi.server import PlexServer
 from discord.ext import commands
+from cogs.backends import PlexBackends
+from cogs.catalog import CATALOG_FILE
+from cogs import tracing, logs
 import discord
 import logging
 import cogs
@@ -43,41 +53,118 @@ class EDI(commands.Bot):
 
     Attributes
         See commands.Bot
+        started (float) : Time taken by the bot to connect after the process started (in seconds)
     """
     def __init__(self, *args, **kwargs):
         """Bot init"""
         super().__init__(*args, **kwargs)
-        self.plex = None
+        self.started = None
+        self.plex_backends = None
+        self.catalog_path = None
+        self.catalog_refresh = False
+        self.before_invoke(tracing.before_command)
+        self.after_invoke(tracing.after_command)
+        self.trace_http()
+
+    def trace_http(self):
+        """Records every Discord API request in the trace of the code making it"""
+        request = self.http.request
 
-    def init_plex(self, base_url, token):
+        async def traced(route, **kwargs):
+            with tracing.span(f'discord.{route.method}', route=route.path):
+                return await request(route, **kwargs)
+
+        self.http.request = traced
+
+    def init_plex(self, base_urls, token):
         """Initialize Plex context
+        The Plex servers are connected on first use (see plex)
 
         Parameters
-            base_url (str) : Base URL of the Plex server to connect to
+            base_urls (list) : Base URLs of the Plex servers to connect to, the primary first then its read-only replicas
             token (str) : Plex account token
         """
-        self.plex = PlexServer(base_url, token)
+        self.plex_backends = PlexBackends(base_urls, token)
+
+    def init_catalog(self, path, refresh=False):
+        """Initialize the catalog snapshot shared by the bot processes
+
+        Parameters
+            path (str) : Path to the snapshot
+            refresh (bool) [optional] : True if this process writes the snapshot (Default is False)
+        """
+        self.catalog_path = path
+        self.catalog_refresh = refresh
+
+    @property
+    def plex(self):
+        """Plex server for requests that are not routed between backends, the primary while it is up
+        (blocking, call from an executor). Read queries go through plex_backends"""
+        return self.plex_backends.server() if self.plex_backends is not None else None
+
+    def connect_plex(self):
+        """Connects the Plex servers (blocking)"""
+        for backend in self.plex_backends.backends:
+            try:
+                logging.info(f"Connected to Plex server: {backend.server.friendlyName} ({backend.url})")
+            except Exception as exc:
+                backend.failed(exc)
+                logging.error(f"Can not connect to Plex server {backend.url}: {exc}")
 
     async def on_ready(self):
         """Coroutine called when the Bot is UP"""
-        logging.info(f"Bot is UP: {self.user.name}:{self.user.id}")
+        if self.started is None:
+            self.started = time.perf_counter() - START
+            logging.info(f"Bot is UP: {self.user.name}:{self.user.id} (cold start: {self.started:.2f}s)")
+            # Connect Plex in the background rather than on the first command
+            self.loop.run_in_executor(None, self.connect_plex)
+            self.plex_backends.start(self.loop)
+        else:
+            logging.info(f"Bot is UP: {self.user.name}:{self.user.id}")
 
 if __name__ == "__main__":
-    # Set logging
-    logging.basicConfig(level=logging.INFO, format="[%(asctime)s] (%(levelname)s) %(message)s")
-
     # Parse arguments
     parser = ArgumentParser(description="EDI discord bot", formatter_class=RawTextHelpFormatter)
     parser.add_argument('plex_base_url', help="Base URL of the Plex server to connect to")
     parser.add_argument('plex_token', help="Plex account token")
     parser.add_argument('discord_token', help="Discord bot token")
+    parser.add_argument('--plex-replica', action='append', default=[], metavar='BASE_URL',
+                        help="Base URL of a read-only replica of the Plex server (can be repeated)")
+    parser.add_argument('--catalog', nargs='?', const=CATALOG_FILE, metavar='PATH',
+                        help=f"Serves lookups from the catalog snapshot shared by the bot processes (Default path is {CATALOG_FILE})")
+    parser.add_argument('--catalog-refresh', action='store_true', help="Writes the catalog snapshot, a single bot process should refresh it")
+    parser.add_argument('--memory-budget', action='store_true', help="Enables only the gateway intents the cogs need, disables the message cache\n"
+                                                                    "and only caches members in voice channels, without chunking guilds")
+    parser.add_argument('--log-file', default=logs.LOG_FILE, help=f"Path of the rotating JSON log file, empty to only log to the console (Default is {logs.LOG_FILE})")
+    parser.add_argument('--traces', default=tracing.TRACE_FILE, help=f"Path of the rotating trace file (Default is {tracing.TRACE_FILE})")
+    parser.add_argument('--trace-sample', type=float, default=tracing.TRACE_SAMPLE_RATE,
+                        help=f"Share of the traces faster than {tracing.TRACE_SLOW:g}s kept, slower ones are always kept (Default is {tracing.TRACE_SAMPLE_RATE})")
     args = parser.parse_args()
 
+    # Set logging (records are written by a background thread)
+    listener = logs.configure(args.log_file)
+
+    # Set tracing
+    tracing.configure(args.traces, sample=args.trace_sample)
+
+    # Trim gateway intents and Discord caches to what the cogs use
+    options = {}
+    if args.memory_budget:
+        intents = cogs.intents()
+        member_cache = discord.MemberCacheFlags.none()
+        member_cache.voice = intents.voice_states
+        options = dict(intents=intents, max_messages=BUDGET_MAX_MESSAGES, member_cache_flags=member_cache, chunk_guilds_at_startup=False)
+
     # Start bot
-    bot = EDI(command_prefix='!', activity=discord.Game(name='!help'))
-    bot.init_plex(args.plex_base_url, args.plex_token)
-    bot.add_cog(cogs.CogErrHandler(bot))
-    bot.add_cog(cogs.CogBasic(bot))
-    bot.add_cog(cogs.CogVoice(bot))
-    bot.add_cog(cogs.CogPlexServer(bot))
-    bot.run(args.discord_token)
+    bot = EDI(command_prefix='!', activity=discord.Game(name='!help'), **options)
+    bot.init_plex([args.plex_base_url, *args.plex_replica], args.plex_token)
+    if args.catalog or args.catalog_refresh:
+        bot.init_catalog(args.catalog or CATALOG_FILE, args.catalog_refresh)
+    for extension in cogs.EXTENSIONS:
+        bot.load_extension(extension)
+    logging.info(f"Extensions loaded in {time.perf_counter() - START:.2f}s")
+    try:
+        bot.run(args.discord_token)
+    finally:
+        tracing.tracer.close()
+        listener.stop()
@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+"""
+EDI benchmark runner
+
+Usage: python3 -m bench [-o results.json] [-c previous.json] [options]
+"""
+#
+# Copyright (c) 2022, Marc GIANNETTI <mgtti.pro@gmail.com>
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+#  - Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+#
+#  - Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+#  - Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON
+# ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+from argparse import ArgumentParser, RawTextHelpFormatter
+from .runner import Bench
+from .soak import Soak
+import asyncio
+import logging
+import json
+import sys
+
+def compare(results, baseline):
+    """Prints latency deltas against a previous run
+
+    Parameters
+        results (dict) : Results of this run
+        baseline (dict) : Results of a previous run
+    """
+    print(f"{'command':<10}{'p50 (ms)':>22}{'p99 (ms)':>22}")
+    for name, stats in results['commands'].items():
+        old = baseline.get('commands', {}).get(name)
+        if not old or not stats.get('n'):
+            continue
+        cols = []
+        for key in ('p50', 'p99'):
+            delta = (stats[key] - old[key]) / old[key] * 100 if old[key] else 0.0
+            cols.append(f"{old[key]:.1f} -> {stats[key]:.1f} ({delta:+.0f}%)")
+        print(f"{name:<10}{cols[0]:>22}{cols[1]:>22}")
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="[%(asctime)s] (%(levelname)s) %(message)s")
+
+    parser = ArgumentParser(prog='python3 -m bench', description="EDI benchmark against a stub Plex server", formatter_class=RawTextHelpFormatter)
+    parser.add_argument('-o', '--output', help="Path of the JSON file to write results to")
+    parser.add_argument('-c', '--compare', help="Path of a previous JSON result to compare with")
+    parser.add_argument('--albums', type=int, default=200, help="Number of albums per section (Default is 200)")
+    parser.add_argument('--tracks', type=int, default=12, help="Number of tracks per album (Default is 12)")
+    parser.add_argument('--track-seconds', type=float, default=5, help="Duration of generated tracks (Default is 5)")
+    parser.add_argument('--library', help="Directory of the generated library (Default is a temporary directory)")
+    parser.add_argument('--latency', type=float, default=0, help="Latency added to each Plex request in ms (Default is 0)")
+    parser.add_argument('--replicas', type=int, default=0, help="Number of read-only replica servers, the primary is stopped at the end to measure failover (Default is 0)")
+    parser.add_argument('--replica-latency', type=float, help="Latency added to each request of the replicas in ms (Default is --latency)")
+    parser.add_argument('--catalog', action='store_true', help="Serves lookups from a catalog snapshot written before the commands run")
+    parser.add_argument('--iterations', type=int, default=100, help="Number of invocations per command (Default is 100)")
+    parser.add_argument('--hot', type=int, default=0, help="Only pick albums among this number of popular ones (Default is all)")
+    parser.add_argument('--concurrency', type=int, default=1, help="Number of concurrent invocations (Default is 1)")
+    parser.add_argument('--streams', type=int, default=4, help="Number of concurrent audio streams (Default is 4)")
+    parser.add_argument('--stream-seconds', type=float, default=10, help="Duration of the audio streams benchmark (Default is 10)")
+    parser.add_argument('--stream-volume', type=float, help="Volume set once the audio streams started, between 0 and 100 (Default is unchanged)")
+    parser.add_argument('--crossfade', type=float, default=0, help="Crossfade between the tracks of the audio streams in seconds (Default is 0)")
+    parser.add_argument('--unthrottled', dest='realtime', action='store_false', help="Consume audio frames as fast as possible")
+    parser.add_argument('--startup', type=int, default=3, help="Number of cold starts measured, 0 to skip (Default is 3)")
+    parser.add_argument('--traces', help="Path of a trace file to record every command in (Default is no tracing)")
+    parser.add_argument('--memory', action='store_true', help="Trace memory growth of each phase (slower)")
+    parser.add_argument('--seed', type=int, default=0, help="Seed of the random generators (Default is 0)")
+    parser.add_argument('--soak', type=float, metavar='SECONDS', help="Runs a soak test of the given duration instead of the benchmark")
+    parser.add_argument('--guilds', type=int, default=50, help="Number of simulated guilds of the soak test (Default is 50)")
+    parser.add_argument('--tick', type=float, default=0.2, help="Delay between two actions of the soak test in seconds (Default is 0.2)")
+    parser.add_argument('--interval', type=float, default=30, help="Delay between two samples of the soak test in seconds (Default is 30)")
+    parser.add_argument('--warmup', type=float, default=0.2, help="Ratio of the soak test ignored for leak detection (Default is 0.2)")
+    args = parser.parse_args()
+
+    results = asyncio.run(Soak(args).run() if args.soak else Bench(args).run())
+    if args.soak:
+        print(json.dumps({key: results[key] for key in ('actions', 'final', 'leaks')}, indent=2))
+    else:
+        print(json.dumps(results, indent=2))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
+
+    if args.soak and results['leaks']:
+        logging.error(f"Resources growing without bound: {', '.join(results['leaks'])}")
+        sys.exit(1)
@@ -0,0 +1,434 @@
+# -*- coding: utf-8 -*-
+"""
+EDI benchmark of the Plex Server and voice commands
+"""
+#
+# Copyright (c) 2022, Marc GIANNETTI <mgtti.pro@gmail.com>
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+#  - Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+#
+#  - Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+#  - Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON
+# ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+from discord.ext.commands import CommandError
+from .startup import measure_startup
+from .stubs import StubLibrary, StubPlexServer, FakeBot, STUB_SECTIONS, WORDS
+from cogs import tracing
+import tracemalloc
+import platform
+import tempfile
+import asyncio
+import logging
+import random
+import shutil
+import time
+import sys
+import os
+
+try:
+    import resource
+except ImportError: # Windows
+    resource = None
+
+def percentiles(samples):
+    """Summarizes latency samples
+
+    Parameters
+        samples (list) : Latencies in seconds
+
+    Returns
+        A dict of latency statistics in ms
+    """
+    if not samples:
+        return {'n': 0}
+
+    ordered = sorted(samples)
+    def rank(p):
+        return round(ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))] * 1000, 3)
+
+    return {
+        'n': len(ordered),
+        'mean': round(sum(ordered) / len(ordered) * 1000, 3),
+        'p50': rank(50),
+        'p90': rank(90),
+        'p99': rank(99),
+        'max': round(ordered[-1] * 1000, 3),
+    }
+
+def max_rss():
+    """Gets the peak resident set size of the process in bytes if available"""
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == 'darwin' else rss * 1024
+
+class Bench:
+    """Benchmark of the Plex and voice cogs against a stub Plex server
+
+    Attributes
+        args (argparse.Namespace) : Benchmark options
+        results (dict) : Benchmark results
+    """
+    def __init__(self, args):
+        """Bench init"""
+        self.args = args
+        self.rnd = random.Random(args.seed)
+        self.results = {
+            'meta': {
+                'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'options': vars(args),
+            },
+            'commands': {},
+            'memory': {},
+        }
+        self.gid = 0
+
+    def setup(self, loop):
+        """Builds the stub library and servers, the bot and its cogs"""
+        from cogs.backends import PlexBackends
+        from cogs import CogVoice, CogPlexServer
+
+        args = self.args
+        self.root = args.library or tempfile.mkdtemp(prefix='edi-bench-')
+        if args.traces:
+            tracing.configure(args.traces, sample=1.0)
+        start = time.perf_counter()
+        self.library = StubLibrary(self.root, args.albums, args.tracks, args.track_seconds, args.seed)
+        self.results['meta']['library_build_s'] = round(time.perf_counter() - start, 3)
+
+        self.server = StubPlexServer(self.library, latency=args.latency / 1000)
+        self.server.start()
+        replica_latency = args.latency if args.replica_latency is None else args.replica_latency
+        self.replicas = [StubPlexServer(self.library, latency=replica_latency / 1000) for _ in range(args.replicas)]
+        for replica in self.replicas:
+            replica.start()
+
+        backends = PlexBackends([server.base_url for server in (self.server, *self.replicas)], 'bench')
+        backends.start(loop)
+        self.bot = FakeBot(backends, loop)
+        if args.catalog:
+            self.bot.catalog_path = os.path.join(self.root, 'catalog.bin')
+            self.bot.catalog_refresh = True
+        self.voice = CogVoice(self.bot)
+        self.bot.add_cog(self.voice)
+
+        self.plex = CogPlexServer(self.bot, partitions=self.library.partitions)
+        self.plex.loudness.path = os.path.join(self.root, 'loudness.json')
+        self.bot.add_cog(self.plex)
+
+    def teardown(self):
+        """Stops the stub server and removes the generated library"""
+        self.plex.cog_unload()
+        self.bot.plex_backends.stop()
+        self.bot.close()
+        self.server.stop()
+        for replica in self.replicas:
+            replica.stop()
+        if tracing.tracer is not None:
+            tracing.tracer.close()
+        if self.args.library is None:
+            shutil.rmtree(self.root, ignore_errors=True)
+
+    def context(self, realtime=None):
+        """Creates an invocation context in a new guild"""
+        self.gid += 1
+        return self.bot.context(self.gid, uid=self.gid, realtime=self.args.realtime if realtime is None else realtime)
+
+    def random_album(self):
+        """Picks a random (section, album title), among the popular ones if requested"""
+        keys = list(self.library.albums)
+        if self.args.hot:
+            keys = keys[:self.args.hot]
+        album = self.library.albums[self.rnd.choice(keys)]
+        return (list(STUB_SECTIONS)[album.section - 1], album.title)
+
+    def arguments(self, name):
+        """Generates random arguments for a command"""
+        section = self.rnd.choice(list(STUB_SECTIONS))
+        if name == 'list':
+            pages = max(1, -(-self.args.albums // 20))
+            return (section, str(self.rnd.randint(1, pages)))
+        if name == 'search':
+            return (section, self.rnd.choice(WORDS))
+        return self.random_album()
+
+    async def drain(self, ctx):
+        """Leaves the voice channel of a guild, releasing its player"""
+        await self.voice.cleanup(ctx.guild)
+
+    async def command(self, name, label=None):
+        """Measures latency of a Plex command
+
+        Parameters
+            name (str) : Name of the Plex subcommand
+            label (str) [optional] : Name of the results (Default is the name of the subcommand)
+        """
+        command = getattr(self.plex, name)
+        samples = []
+        errors = 0
+        tracks = 0
+
+        async def invoke(ctx, *args):
+            nonlocal errors
+            start = time.perf_counter()
+            root = tracing.start(f'!plex {name}')
+            error = None
+            try:
+                await command.callback(self.plex, ctx, *args)
+            except CommandError as exc:
+                errors += 1
+                error = type(exc).__name__
+            tracing.finish(root, error=error)
+            samples.append(time.perf_counter() - start)
+
+        mem = self.memory_start()
+        start = time.perf_counter()
+        for _ in range(0, self.args.iterations, self.args.concurrency):
+            batch = [(self.context(realtime=False), self.arguments(name)) for _ in range(self.args.concurrency)]
+            await asyncio.gather(*(invoke(ctx, *args) for ctx, args in batch))
+
+            if name == 'play':
+                for ctx, _ in batch:
+                    tracks += self.args.tracks
+                    await self.drain(ctx)
+        elapsed = time.perf_counter() - start
+
+        self.results['commands'][label or name] = dict(percentiles(samples), errors=errors)
+        self.results['memory'][label or name] = self.memory_stop(mem)
+        if name == 'play':
+            self.results['enqueue'] = {
+                'tracks': tracks,
+                'seconds': round(elapsed, 3),
+                'tracks_per_s': round(tracks / elapsed, 1) if elapsed else None,
+            }
+
+    async def catalog(self):
+        """Waits for the first catalog snapshot, then lookups are served from it"""
+        refresher = self.plex.refresher
+        while not refresher.refreshes:
+            await asyncio.sleep(0.05)
+
+        snapshot = self.plex.catalog.snapshot()
+        self.results['catalog'] = {
+            'albums': snapshot.albums,
+            'tracks': snapshot.tracks,
+            'size': snapshot.size,
+            'refresh_s': round(refresher.duration, 3),
+        }
+
+    async def failover(self):
+        """Measures Plex commands once the primary server fails, served by the replicas"""
+        backends = self.bot.plex_backends
+        before = backends.failovers
+        self.server.status = 503
+        self.plex.cache.clear()
+        self.plex.embeds.clear()
+        for name in ('list', 'search', 'info'):
+            await self.command(name, label=f'{name} (failover)')
+
+        self.results['failover'] = {
+            'failovers': backends.failovers - before,
+            'primary': backends.primary.state,
+        }
+
+    async def streams(self):
+        """Measures CPU per audio stream by playing several albums at once"""
+        nb = self.args.streams
+        ctxs = [self.context() for _ in range(nb)]
+
+        mem = self.memory_start()
+        for ctx in ctxs:
+            section, album = self.random_album()
+            self.voice.get_player(ctx).crossfade = self.args.crossfade
+            await self.plex.play.callback(self.plex, ctx, section, album)
+
+        # Changed volumes are applied to each frame
+        if self.args.stream_volume is not None:
+            await asyncio.sleep(0.1)
+            for ctx in ctxs:
+                await self.voice.change_volume.callback(self.voice, ctx, self.args.stream_volume)
+
+        cpu = time.process_time()
+        children = os.times()
+        start = time.perf_counter()
+        await asyncio.sleep(self.args.stream_seconds)
+        elapsed = time.perf_counter() - start
+
+        vcs = [ctx.guild.voice_client for ctx in ctxs]
+        jitter = [self.voice.players[ctx.guild.id].jitter for ctx in ctxs]
+        for ctx, vc in zip(ctxs, vcs):
+            await self.drain(ctx)
+            vc.join(5)
+
+        cpu = time.process_time() - cpu
+        children = (os.times().children_user - children.children_user) + (os.times().children_system - children.children_system)
+        consumed = sum(vc.frames for vc in vcs)
+
+        self.results['streams'] = {
+            'late_frames': sum(stats.late for stats in jitter),
+            'underruns': sum(stats.underruns for stats in jitter),
+            'streams': nb,
+            'seconds': round(elapsed, 3),
+            'realtime': self.args.realtime,
+            'frames': consumed,
+            'frames_per_s_per_stream': round(consumed / elapsed / nb, 1),
+            'cpu_per_stream_s': round(cpu / nb, 4),
+            'cpu_per_stream_pct': round(cpu / nb / elapsed * 100, 2),
+            'reader_cpu_per_stream_s': round(sum(vc.cpu for vc in vcs) / nb, 4),
+            'ffmpeg_cpu_per_stream_s': round(children / nb, 4),
+        }
+        self.results['memory']['streams'] = self.memory_stop(mem)
+
+    async def replies(self):
+        """Measures reply latency and messages sent while spamming voice commands in one guild"""
+        voice = self.voice
+        outbox = voice.outbox
+        ctx = self.context()
+        await self.plex.play.callback(self.plex, ctx, *self.random_album())
+
+        before = (outbox.posted, outbox.coalesced)
+        outbox.waits.clear()
+        start = time.perf_counter()
+        for i in range(self.args.iterations):
+            action = ('skip', 'pause', 'resume', 'volume')[i % 4]
+            if action == 'volume':
+                await voice.change_volume.callback(voice, ctx, self.rnd.randint(1, 100))
+            else:
+                await getattr(voice, action).callback(voice, ctx)
+            await asyncio.sleep(0)
+        await self.drain(ctx)
+        await outbox.join()
+        elapsed = time.perf_counter() - start
+
+        self.results['replies'] = dict(
+            percentiles(list(outbox.waits)),
+            commands=self.args.iterations,
+            posted=outbox.posted - before[0],
+            coalesced=outbox.coalesced - before[1],
+            sent=ctx.channel.sent,
+            edited=ctx.channel.edited,
+            seconds=round(elapsed, 3),
+        )
+
+    async def radio(self):
+        """Measures CPU per listener of a radio station shared by several guilds"""
+        nb = self.args.streams
+        ctxs = [self.context() for _ in range(nb)]
+        section, album = self.random_album()
+
+        cpu = time.process_time()
+        children = os.times()
+        start = time.perf_counter()
+        for ctx in ctxs:
+            await self.plex.radio.callback(self.plex, ctx, section, album)
+        await asyncio.sleep(self.args.stream_seconds)
+        elapsed = time.perf_counter() - start
+
+        vcs = [ctx.guild.voice_client for ctx in ctxs]
+        for ctx, vc in zip(ctxs, vcs):
+            await self.drain(ctx)
+            vc.join(5)
+        for station in self.plex.stations.values():
+            station.thread.join(5)
+
+        cpu = time.process_time() - cpu
+        children = (os.times().children_user - children.children_user) + (os.times().children_system - children.children_system)
+        consumed = sum(vc.frames for vc in vcs)
+
+        self.results['radio'] = {
+            'listeners': nb,
+            'seconds': round(elapsed, 3),
+            'frames': consumed,
+            'frames_per_s_per_listener': round(consumed / elapsed / nb, 1),
+            'cpu_per_listener_s': round(cpu / nb, 4),
+            'reader_cpu_per_listener_s': round(sum(vc.cpu for vc in vcs) / nb, 4),
+            'ffmpeg_cpu_s': round(children, 4),
+        }
+
+    def memory_start(self):
+        """Starts measuring memory growth of a phase"""
+        if not self.args.memory:
+            return None
+        tracemalloc.start()
+        return tracemalloc.take_snapshot()
+
+    def memory_stop(self, before):
+        """Stops measuring memory growth of a phase
+
+        Returns
+            A dict of memory statistics in bytes
+        """
+        if before is None:
+            return {'max_rss': max_rss()}
+
+        after = tracemalloc.take_snapshot()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        growth = sum(stat.size_diff for stat in after.compare_to(before, 'filename'))
+        return {'growth': growth, 'peak': peak, 'max_rss': max_rss()}
+
+    async def run(self):
+        """Runs every benchmark phase"""
+        if self.args.startup:
+            self.results['startup'] = measure_startup(self.args.startup)
+
+        self.setup(asyncio.get_running_loop())
+        has_ffmpeg = shutil.which('ffmpeg') is not None
+        try:
+            if self.args.catalog:
+                await self.catalog()
+
+            for name in ('list', 'search', 'info'):
+                await self.command(name)
+
+            if has_ffmpeg:
+                await self.command('play')
+                await self.streams()
+                await self.replies()
+                await self.radio()
+            else:
+                logging.warning("ffmpeg was not found, skipping play and audio stream benchmarks")
+
+            # Last, as it takes the primary server down
+            if self.replicas:
+                await self.failover()
+        finally:
+            self.results['plex_requests'] = self.server.requests + sum(replica.requests for replica in self.replicas)
+            self.results['plex_backends'] = [{
+                'url': backend.url,
+                'primary': backend.primary,
+                'state': backend.state,
+                'latency_ms': None if backend.latency is None else round(backend.latency * 1000, 2),
+                'probe_ms': None if backend.probe is None else round(backend.probe * 1000, 2),
+                'requests': backend.requests,
+                'errors': backend.errors,
+            } for backend in self.bot.plex_backends.backends]
+            self.results['plex_coalesced'] = self.plex.flights.coalesced
+            if self.plex.catalog is not None and 'catalog' in self.results:
+                self.results['catalog'].update(hits=self.plex.catalog.hits, misses=self.plex.catalog.misses)
+            self.teardown()
+
+        return self.results
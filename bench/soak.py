@@ -0,0 +1,271 @@
+# -*- coding: utf-8 -*-
+"""
+EDI soak test tracking leaked processes, file descriptors, tasks and memory
+"""
+#
+# Copyright (c) 2022, Marc GIANNETTI <mgtti.pro@gmail.com>
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+#  - Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+#
+#  - Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+#  - Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON
+# ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+from .runner import Bench
+from .stubs import FakeVoiceClient
+import tracemalloc
+import threading
+import asyncio
+import logging
+import time
+import sys
+import os
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+# Absolute growth tolerated for each metric before it is considered a leak
+LEAK_TOLERANCE = {
+    'children': 2,
+    'fds': 8,
+    'tasks': 8,
+    'heap': 4 * 1024 * 1024,
+    'rss': 32 * 1024 * 1024,
+}
+
+# Difference tolerated between the resources held before the soak and once everything is released
+RELEASE_TOLERANCE = {
+    'fds': 4,
+    'tasks': 2,
+    'threads': 2,
+}
+
+def count_children():
+    """Counts the child processes of the bot (ffmpeg)
+
+    Returns
+        Number of child processes as an int if available else None
+    """
+    if psutil is not None:
+        return len(psutil.Process().children(recursive=True))
+
+    if not os.path.isdir('/proc'):
+        return None
+
+    pid = str(os.getpid())
+    count = 0
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/stat') as f:
+                # The process name can contain spaces, the parent PID comes right after it
+                if f.read().rsplit(')', 1)[1].split()[1] == pid:
+                    count += 1
+        except (OSError, IndexError):
+            pass
+    return count
+
+def count_fds():
+    """Counts the open file descriptors (or handles on Windows) of the bot
+
+    Returns
+        Number of open file descriptors as an int if available else None
+    """
+    if psutil is not None:
+        proc = psutil.Process()
+        return proc.num_handles() if sys.platform == 'win32' else proc.num_fds()
+
+    for path in ('/proc/self/fd', '/dev/fd'):
+        if os.path.isdir(path):
+            return len(os.listdir(path)) - 1 # listdir's own descriptor
+    return None
+
+def count_threads():
+    """Counts the threads of the bot, but the workers of the default executor (they are kept for reuse)
+
+    Returns
+        Number of threads as an int
+    """
+    return sum(1 for thread in threading.enumerate() if not thread.name.startswith('asyncio_'))
+
+def current_rss():
+    """Gets the current resident set size of the bot
+
+    Returns
+        RSS in bytes as an int if available else None
+    """
+    if psutil is not None:
+        return psutil.Process().memory_info().rss
+
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except OSError:
+        return None
+
+def find_leaks(samples, windows=4):
+    """Finds metrics growing without bound
+
+    Samples are split in consecutive windows and the minimum of each window is kept, so that
+    the load of the moment is filtered out. A metric leaks if its minimum strictly increases
+    from one window to the next and the total growth exceeds its tolerance.
+
+    Parameters
+        samples (list) : Samples taken after warmup
+        windows (int) : Number of windows to split samples in
+
+    Returns
+        A dict of growth by leaking metric
+    """
+    leaks = {}
+    size = len(samples) // windows
+    if size == 0:
+        return leaks
+
+    for metric, tolerance in LEAK_TOLERANCE.items():
+        values = [sample[metric] for sample in samples]
+        if None in values:
+            continue
+
+        mins = [min(values[i*size:(i+1)*size]) for i in range(windows)]
+        growth = mins[-1] - mins[0]
+        if all(a < b for a, b in zip(mins, mins[1:])) and growth > tolerance:
+            leaks[metric] = growth
+
+    return leaks
+
+class Soak(Bench):
+    """Long-running simulation of guilds joining, queueing, skipping, clearing and leaving
+
+    The bot resources (child processes, open files, asyncio tasks, heap and RSS) are sampled
+    at regular intervals and the soak fails if any of them grows without bound.
+
+    Attributes
+        See Bench
+    """
+    ACTIONS = ('play', 'play', 'skip', 'skip', 'clear', 'stop', 'leave', 'idle', 'idle', 'idle')
+
+    def sample(self, start):
+        """Samples the bot resources
+
+        Parameters
+            start (float) : Start time of the soak
+
+        Returns
+            A dict of resource usage
+        """
+        return {
+            'time': round(time.perf_counter() - start, 1),
+            'children': count_children(),
+            'fds': count_fds(),
+            'tasks': len(asyncio.all_tasks()),
+            'threads': count_threads(),
+            'heap': tracemalloc.get_traced_memory()[0],
+            'rss': current_rss(),
+            'players': len(self.voice.players),
+        }
+
+    async def act(self, ctx):
+        """Performs a random user action in a guild
+
+        Parameters
+            ctx (FakeContext) : Invocation context in the guild
+        """
+        voice = self.voice
+        action = self.rnd.choice(self.ACTIONS)
+        vc = ctx.guild.voice_client
+
+        if vc is None:
+            # Join then queue an album
+            ctx.guild.voice_client = FakeVoiceClient(ctx.guild, self.args.realtime)
+            action = 'play'
+
+        if action == 'play':
+            await self.plex.play.callback(self.plex, ctx, *self.random_album())
+        elif action == 'skip' and (vc.is_playing() or vc.is_paused()):
+            await voice.skip.callback(voice, ctx)
+        elif action == 'clear':
+            await voice.clear.callback(voice, ctx)
+        elif action == 'stop' and (vc.is_playing() or vc.is_paused()):
+            await voice.stop.callback(voice, ctx)
+        elif action == 'leave':
+            await voice.leave.callback(voice, ctx)
+
+        self.actions[action] = self.actions.get(action, 0) + 1
+
+    async def run(self):
+        """Runs the soak"""
+        args = self.args
+        self.setup(asyncio.get_running_loop())
+        self.actions = {}
+        ctxs = [self.context() for _ in range(args.guilds)]
+
+        tracemalloc.start()
+        start = time.perf_counter()
+        baseline = self.sample(start)
+        samples = []
+        next_sample = start
+        try:
+            while time.perf_counter() - start < args.soak:
+                await self.act(self.rnd.choice(ctxs))
+                await asyncio.sleep(args.tick)
+
+                if time.perf_counter() >= next_sample:
+                    samples.append(self.sample(start))
+                    next_sample += args.interval
+                    logging.info(f"Soak sample: {samples[-1]}")
+
+            # Every guild leaves, nothing should survive this
+            for ctx in ctxs:
+                if ctx.guild.voice_client is not None:
+                    await self.voice.leave.callback(self.voice, ctx)
+            await asyncio.sleep(args.interval)
+            final = self.sample(start)
+        finally:
+            tracemalloc.stop()
+            self.teardown()
+
+        # Once the cogs are unloaded, what they held must be released
+        await asyncio.sleep(args.interval)
+        released = self.sample(start)
+
+        warm = [sample for sample in samples if sample['time'] >= args.soak * args.warmup]
+        leaks = find_leaks(warm)
+        if final['children']:
+            leaks['orphan_children'] = final['children']
+        for metric, tolerance in RELEASE_TOLERANCE.items():
+            if baseline[metric] is not None and released[metric] is not None and released[metric] - baseline[metric] > tolerance:
+                leaks[f'unreleased_{metric}'] = released[metric] - baseline[metric]
+
+        self.results.update({
+            'actions': self.actions,
+            'samples': samples,
+            'baseline': baseline,
+            'final': final,
+            'released': released,
+            'leaks': leaks,
+        })
+        return self.results
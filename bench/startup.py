@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+"""
+EDI cold start measurement
+"""
+#
+# Copyright (c) 2022, Marc GIANNETTI <mgtti.pro@gmail.com>
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+#  - Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+#
+#  - Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+#  - Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON
+# ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import subprocess
+import json
+import sys
+import os
+
+# Dependencies that should not be imported before their first use
+HEAVY_MODULES = ('plexapi', 'colorthief', 'PIL')
+
+# Run in a fresh interpreter: imports EDI then loads every extension without connecting
+STARTUP_SCRIPT = """
+import time
+start = time.perf_counter()
+from unittest import mock
+import json
+import sys
+import EDI
+imported = time.perf_counter()
+bot = EDI.EDI(command_prefix='!')
+with mock.patch('platform.system', return_value='Darwin'):
+    for extension in EDI.cogs.EXTENSIONS:
+        bot.load_extension(extension)
+loaded = time.perf_counter()
+print(json.dumps({
+    'import_s': imported - start,
+    'extensions_s': loaded - imported,
+    'modules': [name for name in %r if name in sys.modules],
+}))
+""" % (HEAVY_MODULES,)
+
+def measure_startup(runs):
+    """Measures the cold start of the bot up to the Discord connection
+
+    Parameters
+        runs (int) : Number of fresh interpreters to start
+
+    Returns
+        A dict of startup statistics (best of the runs) in ms
+    """
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    samples = []
+    for _ in range(runs):
+        out = subprocess.run([sys.executable, '-c', STARTUP_SCRIPT], cwd=root, capture_output=True, text=True, check=True)
+        samples.append(json.loads(out.stdout.splitlines()[-1]))
+
+    return {
+        'runs': runs,
+        'import_ms': round(min(s['import_s'] for s in samples) * 1000, 1),
+        'extensions_ms': round(min(s['extensions_s'] for s in samples) * 1000, 1),
+        'heavy_modules': samples[-1]['modules'],
+    }
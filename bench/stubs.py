@@ -0,0 +1,653 @@
+# -*- coding: utf-8 -*-
+"""
+EDI benchmark stubs (fake Plex server, voice client and bot)
+"""
+#
+# Copyright (c) 2022, Marc GIANNETTI <mgtti.pro@gmail.com>
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+#  - Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+#
+#  - Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+#  - Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON
+# ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs
+from xml.sax.saxutils import quoteattr
+import threading
+import asyncio
+import struct
+import random
+import wave
+import math
+import time
+import zlib
+import os
+
+# Sections served by the stub server (same titles as cogs.plex.Sections)
+STUB_SECTIONS = {
+    'animes' : 'Animes Music',
+    'audios' : 'Audio Series',
+    'games'  : 'Games Music',
+    'movies' : 'Movies Music',
+    'music'  : 'Music',
+    'shows'  : 'TV Shows Music',
+}
+
+# Words used to build synthetic album titles
+WORDS = ['Abyss', 'Blade', 'Crystal', 'Dawn', 'Echo', 'Frontier', 'Glory', 'Horizon',
+         'Iron', 'Journey', 'Kingdom', 'Legend', 'Mirage', 'Nova', 'Origin', 'Phantom',
+         'Quest', 'Requiem', 'Shadow', 'Tempest', 'Umbra', 'Vortex', 'Wander', 'Zenith']
+
+# PCM format of generated tracks (same as what discord expects)
+SAMPLE_RATE = 48000
+CHANNELS = 2
+
+# Size of a 20ms PCM frame in bytes
+FRAME_SIZE = 3840
+
+def write_wav(path, seconds, freq):
+    """Writes a sine wave in a WAV file
+
+    Parameters
+        path (str) : Path of the file to write
+        seconds (float) : Duration of the track
+        freq (float) : Frequency of the sine wave
+    """
+    period = [int(12000 * math.sin(2 * math.pi * freq * i / SAMPLE_RATE)) for i in range(SAMPLE_RATE // 10)]
+    chunk = b''.join(struct.pack('<hh', s, s) for s in period)
+
+    with wave.open(path, 'wb') as w:
+        w.setnchannels(CHANNELS)
+        w.setsampwidth(2)
+        w.setframerate(SAMPLE_RATE)
+        for _ in range(int(seconds * 10)):
+            w.writeframes(chunk)
+
+def write_png(path, color, size=32):
+    """Writes a plain colored PNG image
+
+    Parameters
+        path (str) : Path of the file to write
+        color (tuple) : RGB color of the image
+        size (int) : Width and height of the image
+    """
+    def chunk(tag, data):
+        return struct.pack('>I', len(data)) + tag + data + struct.pack('>I', zlib.crc32(tag + data) & 0xffffffff)
+
+    raw = b''.join(b'\x00' + bytes(color) * size for _ in range(size))
+    with open(path, 'wb') as f:
+        f.write(b'\x89PNG\r\n\x1a\n')
+        f.write(chunk(b'IHDR', struct.pack('>IIBBBBB', size, size, 8, 2, 0, 0, 0)))
+        f.write(chunk(b'IDAT', zlib.compress(raw)))
+        f.write(chunk(b'IEND', b''))
+
+class StubAlbum:
+    """Synthetic album served by the stub server
+
+    Attributes
+        key (int) : Album ratingKey
+        artist_key (int) : Artist ratingKey
+        section (int) : Section key
+        title (str) : Album title
+        artist (str) : Artist name
+        tracks (list) : List of (ratingKey, title, duration in ms, Plex file) tuples
+        updated_at (int) : Last update timestamp
+    """
+    def __init__(self, key, artist_key, section, title, artist, tracks, updated_at):
+        """StubAlbum init"""
+        self.key = key
+        self.artist_key = artist_key
+        self.section = section
+        self.title = title
+        self.artist = artist
+        self.tracks = tracks
+        self.updated_at = updated_at
+
+class StubLibrary:
+    """Synthetic Plex library mirrored on the filesystem
+
+    Every album is a directory containing a cover and the tracks of the album.
+    All tracks of a section share the same generated audio file on disk to keep the
+    library cheap to build, whatever its size.
+
+    Attributes
+        root (str) : Root directory of the mounted partitions
+        albums (dict) : Albums by ratingKey
+        sections (dict) : Album ratingKeys by section key
+        artists (dict) : Albums by artist ratingKey
+        tracks (dict) : (album, track) tuples by track ratingKey
+        partitions (dict) : Mounted partition by section name (see cogs.plex.Sections)
+    """
+    def __init__(self, root, nb_albums, nb_tracks, track_seconds, seed=0):
+        """StubLibrary init
+
+        Parameters
+            root (str) : Root directory of the mounted partitions
+            nb_albums (int) : Number of albums per section
+            nb_tracks (int) : Number of tracks per album
+            track_seconds (float) : Duration of each track
+            seed (int) : Seed of the album titles generator
+        """
+        rnd = random.Random(seed)
+        now = int(time.time())
+        key = 1000
+
+        self.root = root
+        self.albums = {}
+        self.sections = {}
+        self.partitions = {}
+
+        for s_key, (name, title) in enumerate(STUB_SECTIONS.items(), start=1):
+            part = os.path.join(root, name)
+            os.makedirs(part, exist_ok=True)
+            self.partitions[name] = part
+            self.sections[s_key] = []
+
+            # One audio file per section, hard linked or copied in every album
+            audio = os.path.join(part, 'track.wav')
+            if not os.path.isfile(audio):
+                write_wav(audio, track_seconds, 220 + 40 * s_key)
+
+            for index in range(nb_albums):
+                a_title = f"{' '.join(rnd.sample(WORDS, 2))} {index}"
+                a_dir = os.path.join(part, a_title)
+                os.makedirs(a_dir, exist_ok=True)
+
+                cover = os.path.join(a_dir, 'cover.png')
+                if not os.path.isfile(cover):
+                    write_png(cover, (rnd.randrange(256), rnd.randrange(256), rnd.randrange(256)))
+
+                tracks = []
+                for t_index in range(nb_tracks):
+                    t_path = os.path.join(a_dir, f'{t_index+1:02d}.wav')
+                    if not os.path.isfile(t_path):
+                        try:
+                            os.link(audio, t_path)
+                        except OSError:
+                            with open(audio, 'rb') as src, open(t_path, 'wb') as dst:
+                                dst.write(src.read())
+                    key += 1
+                    tracks.append((key, f'Track {t_index+1}', int(track_seconds * 1000), f'/data/{name}/{a_title}/{t_index+1:02d}.wav'))
+
+                key += 2
+                album = StubAlbum(key, key - 1, s_key, a_title, f'Artist {index % 50}', tracks, now)
+                self.albums[album.key] = album
+                self.sections[s_key].append(album.key)
+
+        self.artists = {album.artist_key: album for album in self.albums.values()}
+        self.tracks = {t[0]: (album, t) for album in self.albums.values() for t in album.tracks}
+
+    def touch(self, key, title=None):
+        """Marks an album as updated, as when it is retagged
+
+        Parameters
+            key (int) : Album ratingKey
+            title (str) : New title of the album if any
+        """
+        album = self.albums[key]
+        album.updated_at = int(time.time())
+        if title is not None:
+            album.title = title
+
+class StubPlexHandler(BaseHTTPRequestHandler):
+    """Answers the subset of the Plex HTTP API used by plexapi and EDI"""
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def log_message(self, *args):
+        """Silences request logging"""
+
+    def reply(self, body, status=200):
+        """Sends a XML MediaContainer
+
+        Parameters
+            body (str) : Inner XML of the MediaContainer or a full document
+            status (int) : HTTP status
+        """
+        data = body.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'text/xml;charset=utf-8')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        """Routes a GET request"""
+        server = self.server
+        url = urlsplit(self.path)
+        query = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        parts = [p for p in url.path.split('/') if p]
+
+        server.requests += 1
+        if server.latency:
+            time.sleep(server.latency)
+        if server.status is not None:
+            return self.reply('<MediaContainer size="0"/>', server.status)
+
+        try:
+            if not parts or parts == ['identity']:
+                body = self.identity()
+            elif parts == ['library']:
+                body = '<MediaContainer size="1"><Directory key="sections" title="Library Sections"/></MediaContainer>'
+            elif parts == ['library', 'sections']:
+                body = self.sections()
+            elif len(parts) == 4 and parts[:2] == ['library', 'sections'] and parts[3] in ('all', 'collections'):
+                body = self.search(int(parts[2]), parts[3], query)
+            elif len(parts) == 4 and parts[:2] == ['library', 'metadata'] and parts[3] == 'children':
+                body = self.children(int(parts[2]))
+            elif len(parts) == 3 and parts[:2] == ['library', 'metadata']:
+                body = self.metadata(int(parts[2]))
+            else:
+                return self.reply('<MediaContainer size="0"/>', 404)
+        except KeyError:
+            return self.reply('<MediaContainer size="0"/>', 404)
+
+        self.reply(body)
+
+    def identity(self):
+        """Server identity"""
+        return ('<MediaContainer size="0" friendlyName="EDI stub" machineIdentifier="edi-stub" '
+                'version="1.32.0.0" platform="Linux" myPlexSigninState="none"/>')
+
+    def sections(self):
+        """Library sections"""
+        items = ''.join(f'<Directory key="{key}" type="artist" title={quoteattr(title)} agent="tv.plex.agents.music" '
+                        f'scanner="Plex Music" language="en" uuid="stub-{key}" updatedAt="{int(time.time())}">'
+                        f'<Location id="{key}" path="/data/{name}"/></Directory>'
+                        for key, (name, title) in enumerate(STUB_SECTIONS.items(), start=1))
+        return f'<MediaContainer size="{len(STUB_SECTIONS)}">{items}</MediaContainer>'
+
+    def meta(self):
+        """Filtering metadata used by plexapi to validate sorts and filters"""
+        types = ''
+        for libtype, num in (('album', 9), ('track', 10)):
+            fields = ''.join(f'<Field key="{libtype}.{key}" title="{key}" type="{kind}"/>'
+                             for key, kind in (('title', 'string'), ('updatedAt', 'date'), ('addedAt', 'date')))
+            types += (f'<Type key="/library/sections/1/all?type={num}" type="{libtype}" title="{libtype}" active="1">'
+                      '<Sort key="titleSort" title="Title" defaultDirection="asc" descKey="titleSort:desc"/>'
+                      f'{fields}</Type>')
+        return (f'<Meta>{types}'
+                '<FieldType type="string"><Operator key="=" title="contains"/></FieldType>'
+                '<FieldType type="date"><Operator key="&gt;&gt;=" title="is after"/>'
+                '<Operator key="&lt;&lt;=" title="is before"/></FieldType></Meta>')
+
+    def search(self, section, kind, query):
+        """Albums (or tracks) of a section, filtered by title or update time and paginated"""
+        lib = self.server.library
+        if section not in lib.sections:
+            raise KeyError(section)
+
+        if 'includeMeta' in query or kind == 'collections':
+            size = 0
+            albums = []
+        else:
+            albums = [lib.albums[key] for key in lib.sections[section]]
+
+            title = query.get('title', query.get('album.title'))
+            if title:
+                albums = [a for a in albums if title.lower() in a.title.lower()]
+
+            for key, value in query.items():
+                if key.startswith(('updatedAt', 'album.updatedAt', 'track.updatedAt')):
+                    since = int(value.lstrip('>='))
+                    albums = [a for a in albums if a.updated_at >= since]
+
+            if 'sort' in query:
+                albums.sort(key=lambda a: a.title.lower())
+
+            if query.get('type') == '10':
+                albums = [(a, t) for a in albums for t in a.tracks]
+
+            if 'limit' in query:
+                albums = albums[:int(query['limit'])]
+
+            size = len(albums)
+            start = int(query.get('X-Plex-Container-Start', self.headers.get('X-Plex-Container-Start', 0)))
+            count = int(query.get('X-Plex-Container-Size', self.headers.get('X-Plex-Container-Size', size)))
+            albums = albums[start:start+count]
+
+        items = ''.join(self.track(*a) if isinstance(a, tuple) else self.album(a) for a in albums)
+        meta = self.meta() if 'includeMeta' in query else ''
+        return f'<MediaContainer size="{len(albums)}" totalSize="{size}" librarySectionID="{section}">{meta}{items}</MediaContainer>'
+
+    def album(self, a):
+        """XML of an album"""
+        return (f'<Directory ratingKey="{a.key}" key="/library/metadata/{a.key}/children" type="album" '
+                f'title={quoteattr(a.title)} titleSort={quoteattr(a.title)} parentTitle={quoteattr(a.artist)} '
+                f'parentRatingKey="{a.artist_key}" parentKey="/library/metadata/{a.artist_key}" '
+                f'librarySectionID="{a.section}" leafCount="{len(a.tracks)}" '
+                f'addedAt="{a.updated_at}" updatedAt="{a.updated_at}"/>')
+
+    def track(self, a, t):
+        """XML of a track"""
+        key, title, duration, file = t
+        return (f'<Track ratingKey="{key}" key="/library/metadata/{key}" type="track" title={quoteattr(title)} '
+                f'index="{a.tracks.index(t) + 1}" parentIndex="1" '
+                f'parentTitle={quoteattr(a.title)} parentRatingKey="{a.key}" grandparentTitle={quoteattr(a.artist)} '
+                f'librarySectionID="{a.section}" duration="{duration}" updatedAt="{a.updated_at}">'
+                f'<Media id="{key}" duration="{duration}" audioChannels="2" audioCodec="pcm" container="wav">'
+                f'<Part id="{key}" key="/library/parts/{key}/file.wav" duration="{duration}" file={quoteattr(file)} container="wav"/>'
+                '</Media></Track>')
+
+    def children(self, key):
+        """Tracks of an album"""
+        a = self.server.library.albums[key]
+        return f'<MediaContainer size="{len(a.tracks)}">{"".join(self.track(a, t) for t in a.tracks)}</MediaContainer>'
+
+    def metadata(self, key):
+        """Metadata of an album, artist or track"""
+        lib = self.server.library
+        if key in lib.albums:
+            return f'<MediaContainer size="1">{self.album(lib.albums[key])}</MediaContainer>'
+        if key in lib.tracks:
+            return f'<MediaContainer size="1">{self.track(*lib.tracks[key])}</MediaContainer>'
+
+        a = lib.artists[key]
+        return (f'<MediaContainer size="1"><Directory ratingKey="{key}" key="/library/metadata/{key}/children" '
+                f'type="artist" title={quoteattr(a.artist)} librarySectionID="{a.section}"/></MediaContainer>')
+
+class StubPlexServer(ThreadingHTTPServer):
+    """Local HTTP server mimicking a Plex server
+
+    Attributes
+        library (StubLibrary) : Library served
+        latency (float) : Artificial latency added to each request in seconds
+        status (int) : HTTP status every request fails with if set else None
+        requests (int) : Number of requests served
+    """
+    daemon_threads = True
+
+    def __init__(self, library, latency=0.0, port=0):
+        """StubPlexServer init"""
+        super().__init__(('127.0.0.1', port), StubPlexHandler)
+        self.library = library
+        self.latency = latency
+        self.status = None
+        self.requests = 0
+        self.thread = None
+
+    @property
+    def base_url(self):
+        """Base URL of the server"""
+        return f'http://127.0.0.1:{self.server_address[1]}'
+
+    def start(self):
+        """Serves requests in a background thread"""
+        self.thread = threading.Thread(target=self.serve_forever, name='stub-plex', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """Stops serving requests"""
+        self.shutdown()
+        self.server_close()
+
+class FakeVoiceClient:
+    """Voice client consuming audio frames like discord's AudioPlayer, without network
+
+    Attributes
+        guild (FakeGuild) : Guild of the voice client
+        realtime (bool) : Consume frames at real-time speed (20ms per frame) if True
+        source (discord.AudioSource) : Audio source played
+        frames (int) : Number of frames consumed
+        cpu (float) : CPU time spent by the consumer threads in seconds
+    """
+    DELAY = 0.02
+
+    def __init__(self, guild, realtime=True):
+        """FakeVoiceClient init"""
+        self.guild = guild
+        self.realtime = realtime
+        self.source = None
+        self.frames = 0
+        self.cpu = 0.0
+        self.channel = None
+        self._thread = None
+        self._end = threading.Event()
+        self._resumed = threading.Event()
+        self._resumed.set()
+
+    def play(self, source, *, after=None):
+        """Plays an audio source in a background thread"""
+        if self.is_playing():
+            raise RuntimeError('Already playing audio.')
+
+        self.source = source
+        self._end = threading.Event()
+        self._resumed.set()
+        self._thread = threading.Thread(target=self._run, args=(after, self._end), daemon=True)
+        self._thread.start()
+
+    def _run(self, after, end):
+        """Consumes frames until the end of the source"""
+        error = None
+        start = time.perf_counter()
+        cpu = time.thread_time()
+        loops = 0
+
+        try:
+            while not end.is_set():
+                if not self._resumed.is_set():
+                    self._resumed.wait(self.DELAY)
+                    continue
+
+                # The source can be swapped while playing (crossfades)
+                loops += 1
+                if not self.source.read():
+                    break
+                self.frames += 1
+
+                if self.realtime:
+                    time.sleep(max(0, start + self.DELAY * loops - time.perf_counter()))
+        except Exception as exc:
+            error = exc
+        finally:
+            end.set()
+            self.cpu += time.thread_time() - cpu
+            self.source.cleanup()
+            if after is not None:
+                after(error)
+
+    def is_playing(self):
+        """Returns True if audio is playing"""
+        return self._thread is not None and not self._end.is_set() and self._resumed.is_set()
+
+    def is_paused(self):
+        """Returns True if audio is paused"""
+        return self._thread is not None and not self._end.is_set() and not self._resumed.is_set()
+
+    def pause(self):
+        """Pauses audio"""
+        self._resumed.clear()
+
+    def resume(self):
+        """Resumes audio"""
+        self._resumed.set()
+
+    def stop(self):
+        """Stops audio"""
+        self._end.set()
+        self._resumed.set()
+
+    def join(self, timeout=None):
+        """Waits for the consumer thread to finish"""
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    async def move_to(self, channel):
+        """Moves to another voice channel"""
+        self.channel = channel
+
+    async def disconnect(self, *, force=False):
+        """Disconnects from voice"""
+        self.stop()
+        self.guild.voice_client = None
+
+class FakeUser:
+    """Minimal discord.Member"""
+    def __init__(self, uid):
+        """FakeUser init"""
+        self.id = uid
+        self.display_name = f'user{uid}'
+        self.mention = f'<@{uid}>'
+        self.avatar_url = ''
+        self.voice = None
+
+class FakeMessage:
+    """Minimal discord.Message"""
+    def __init__(self, channel, mid):
+        """FakeMessage init"""
+        self.channel = channel
+        self.id = mid
+
+    async def edit(self, *, content=None, embed=None, **kwargs):
+        """Edits the message"""
+        self.channel.edited += 1
+
+class FakeChannel:
+    """Text channel recording sent messages
+
+    Attributes
+        sent (int) : Number of messages sent
+        edited (int) : Number of messages edited
+        last_message_id (int) : ID of the last message sent if any
+    """
+    def __init__(self, cid):
+        """FakeChannel init"""
+        self.id = cid
+        self.name = f'channel{cid}'
+        self.sent = 0
+        self.edited = 0
+        self.last_message_id = None
+
+    async def send(self, content=None, *, embed=None, file=None, **kwargs):
+        """Sends a message"""
+        if file is not None:
+            file.close()
+        self.sent += 1
+        self.last_message_id = self.sent
+        return FakeMessage(self, self.sent)
+
+    async def trigger_typing(self):
+        """Triggers typing"""
+
+class FakeGuild:
+    """Minimal discord.Guild"""
+    def __init__(self, gid):
+        """FakeGuild init"""
+        self.id = gid
+        self.name = f'guild{gid}'
+        self.voice_client = None
+        self.system_channel = None
+        self.channels = []
+
+class FakeContext:
+    """Minimal commands.Context for direct command invocation
+
+    Attributes
+        bot (FakeBot) : Bot
+        guild (FakeGuild) : Guild of invocation
+        channel (FakeChannel) : Channel of invocation
+        author (FakeUser) : Author of invocation
+    """
+    def __init__(self, bot, guild, channel, author):
+        """FakeContext init"""
+        self.bot = bot
+        self.guild = guild
+        self.channel = channel
+        self.author = author
+        self.message = None
+        self.invoked_subcommand = None
+
+    @property
+    def voice_client(self):
+        """Voice client of the guild"""
+        return self.guild.voice_client
+
+    async def send(self, *args, **kwargs):
+        """Sends a message in the invocation channel"""
+        return await self.channel.send(*args, **kwargs)
+
+    async def trigger_typing(self):
+        """Triggers typing"""
+
+    async def invoke(self, command, *args, **kwargs):
+        """Invokes a command"""
+        return await command.callback(command.cog, self, *args, **kwargs)
+
+class FakeBot:
+    """Minimal EDI bot holding Plex backends and cogs without a Discord connection
+
+    Attributes
+        plex_backends (cogs.backends.PlexBackends) : Plex servers
+        loop (asyncio.AbstractEventLoop) : Event loop
+        catalog_path (str) : Path to the catalog snapshot if enabled else None
+        catalog_refresh (bool) : True if the bot writes the catalog snapshot
+    """
+    def __init__(self, plex_backends=None, loop=None):
+        """FakeBot init"""
+        self.plex_backends = plex_backends
+        self.catalog_path = None
+        self.catalog_refresh = False
+        self.loop = loop or asyncio.get_event_loop()
+        self.cogs = {}
+        self._closed = False
+
+    def add_cog(self, cog):
+        """Adds a cog"""
+        self.cogs[cog.qualified_name] = cog
+
+    def get_cog(self, name):
+        """Gets a cog by name"""
+        return self.cogs.get(name)
+
+    @property
+    def plex(self):
+        """Plex server for requests that are not routed between backends"""
+        return self.plex_backends.server() if self.plex_backends is not None else None
+
+    async def wait_until_ready(self):
+        """Bot is always ready"""
+
+    def is_closed(self):
+        """Returns True if the bot is closed"""
+        return self._closed
+
+    def close(self):
+        """Closes the bot, ending player loops"""
+        self._closed = True
+
+    def context(self, gid, uid=1, realtime=True):
+        """Creates an invocation context in a guild connected to a fake voice client
+
+        Parameters
+            gid (int) : Guild ID
+            uid (int) : Author ID
+            realtime (bool) : Voice client consumes audio at real-time speed if True
+
+        Returns
+            A FakeContext object
+        """
+        guild = FakeGuild(gid)
+        guild.voice_client = FakeVoiceClient(guild, realtime)
+        return FakeContext(self, guild, FakeChannel(gid), FakeUser(uid))
@@ -31,7 +31,45 @@ EDI cogs (collection of commands and listeners)
 # (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
 # SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
-from .err import CogErrHandler
-from .basic import CogBasic
-from .voice import CogVoice
-from .plex import CogPlexServer
+import importlib
+
+# Extensions loaded by the bot, in order
+EXTENSIONS = ('cogs.err', 'cogs.basic', 'cogs.voice', 'cogs.plex', 'cogs.admin')
+
+# Cogs exported by the package, imported on first access so that loading one extension
+# does not import the dependencies of the others
+COGS = {
+    'CogErrHandler': '.err',
+    'CogBasic': '.basic',
+    'CogVoice': '.voice',
+    'CogPlexServer': '.plex',
+    'CogAdmin': '.admin',
+}
+
+# Gateway intents needed by the bot whatever the extensions loaded (guild channels and commands)
+BASE_INTENTS = ('guilds', 'guild_messages', 'dm_messages')
+
+def intents(extensions=EXTENSIONS):
+    """Gets the gateway intents needed by extensions.
+    Each extension module declares the intents its cogs need in an INTENTS tuple of discord.Intents flag names
+
+    Parameters
+        extensions (tuple) [optional] : Names of the extensions (Default is all)
+
+    Returns
+        A discord.Intents object with only the needed intents enabled
+    """
+    import discord
+
+    flags = dict.fromkeys(BASE_INTENTS, True)
+    for extension in extensions:
+        flags.update(dict.fromkeys(getattr(importlib.import_module(extension), 'INTENTS', ()), True))
+    return discord.Intents(**flags)
+
+def __getattr__(name):
+    """Imports exported cogs lazily"""
+    try:
+        module = COGS[name]
+    except KeyError:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}") from None
+    return getattr(importlib.import_module(module, __name__), name)
@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+"""
+EDI admin commands
+"""
+#
+# Copyright (c) 2022, Marc GIANNETTI <mgtti.pro@gmail.com>
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+#  - Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+#
+#  - Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+#  - Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON
+# ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+from discord.ext import commands
+from . import memory
+import discord
+import logging
+import time
+import sys
+
+# Helper modules imported again when the extension using them is reloaded
+HELPERS = {
+    'cogs.plex': ('cogs.library', 'cogs.media', 'cogs.radio', 'cogs.staging', 'cogs.loudness', 'cogs.embeds', 'cogs.dsp', 'cogs.catalog'),
+    'cogs.voice': ('cogs.frames', 'cogs.buffer', 'cogs.outbox', 'cogs.dsp'),
+}
+
+class AdminInvalidExtension(commands.CommandError):
+    """Custom Exception class for admin invalid extension"""
+
+class AdminReloadFailed(commands.CommandError):
+    """Custom Exception class for admin reload failed"""
+
+class CogAdmin(commands.Cog, name='Admin'):
+    """Owner commands to maintain the bot without restarting it
+
+    Attributes
+        See commands.Cog
+    """
+    def __init__(self, bot):
+        """CogAdmin init"""
+        self.bot = bot
+
+    @commands.command(name='reload', hidden=True)
+    @commands.is_owner()
+    async def reload(self, ctx, cog: str):
+        """Reloads the extension of a cog (err, basic, voice, plex or admin)
+        Voice players and the audio being played are kept alive
+
+        Parameters
+            ctx (commands.Context) : Invocation context
+            cog (str) : Name of the extension to reload
+
+        Raises
+            AdminInvalidExtension: Extension is not loaded
+            AdminReloadFailed: Extension failed to reload, the previous one is kept
+        """
+        name = f'cogs.{cog.lower()}'
+        if name not in self.bot.extensions:
+            raise AdminInvalidExtension(f"`{cog}` is not a loaded extension {ctx.author.mention}")
+
+        start = time.perf_counter()
+        try:
+            for module in HELPERS.get(name, ()):
+                sys.modules.pop(module, None)
+            self.bot.reload_extension(name)
+
+            # The error handler imports the exceptions of the other extensions
+            if name != 'cogs.err':
+                self.bot.reload_extension('cogs.err')
+        except commands.ExtensionError as err:
+            logging.error(f"Extension {name} failed to reload", exc_info=err, extra={'extension': name})
+            raise AdminReloadFailed(f"`{cog}` failed to reload, the previous version is kept {ctx.author.mention}")
+
+        elapsed = (time.perf_counter() - start) * 1000
+        logging.info(f"Extension {name} reloaded in {elapsed:.0f} ms")
+        await ctx.send(f"`{cog}` reloaded in {elapsed:.0f} ms {ctx.author.mention}")
+
+    @commands.command(name='memory', hidden=True)
+    @commands.is_owner()
+    async def memory(self, ctx):
+        """Shows the memory held by the Discord caches and the caches of the cogs (estimated from samples)
+
+        Parameters
+            ctx (commands.Context) : Invocation context
+        """
+        caches = memory.report(self.bot)
+        rss = memory.current_rss()
+        intents = ', '.join(name for name, enabled in self.bot.intents if enabled)
+        max_messages = self.bot._connection.max_messages
+
+        embed = discord.Embed(title="Memory", description=f"RSS: {rss // 2**20 if rss else '?'} MB\n"
+                                                          f"Intents: {intents}\n"
+                                                          f"Message cache: {max_messages or 'disabled'}", color=discord.Color.blue())
+        for name, count, size in sorted(caches, key=lambda cache: cache[2], reverse=True)[:25]:
+            embed.add_field(name=name, value=f"{count} entries\n~{size / 1024:.0f} KB")
+        embed.set_footer(text=f"Requester: {ctx.author.display_name}")
+        await ctx.send(embed=embed)
+
+def setup(bot):
+    """Loads the extension
+
+    Parameters
+        bot (commands.Bot) : Bot to add the cog to
+    """
+    bot.add_cog(CogAdmin(bot))
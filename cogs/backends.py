@@ -0,0 +1,356 @@
+# -*- coding: utf-8 -*-
+"""
+EDI Plex backends routing and failover
+"""
+#
+# Copyright (c) 2022, Marc GIANNETTI <mgtti.pro@gmail.com>
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+#  - Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+#
+#  - Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+#  - Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON
+# ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+from . import tracing
+import threading
+import logging
+import asyncio
+import time
+
+# Delay between two health checks of the Plex backends (in seconds)
+PLEX_HEALTH_INTERVAL = 15
+
+# Endpoint requested by health checks
+HEALTH_PATH = '/identity'
+
+# Timeouts of health checks and of Plex requests (in seconds)
+PLEX_HEALTH_TIMEOUT = 2
+PLEX_TIMEOUT = 10
+
+# Connections kept open per backend
+PLEX_POOL_SIZE = 8
+
+# Consecutive failures opening the circuit breaker of a backend, and delay before it is tried again (in seconds)
+BREAKER_FAILURES = 3
+BREAKER_COOLDOWN = 30
+
+# Weight of the last response in the latency moving averages of a backend
+LATENCY_SMOOTHING = 0.2
+
+# Age after which the query latency of a backend is stale, its health check round trip ranking it instead (in seconds)
+LATENCY_MAX_AGE = 2 * PLEX_HEALTH_INTERVAL
+
+class BackendsUnavailable(Exception):
+    """Raised when every Plex backend failed or has its circuit breaker open"""
+
+def is_outage(exc):
+    """Checks if an error comes from the backend rather than from the request
+
+    Parameters
+        exc (Exception) : Error raised by a Plex query
+
+    Returns
+        True for transport errors (connection, timeout) and 5xx statuses
+    """
+    from requests import RequestException
+    if isinstance(exc, RequestException):
+        return True
+    # plexapi reports failed statuses as "(status) reason; url"
+    return str(exc).startswith('(5')
+
+def smooth(average, sample):
+    """Updates an exponential moving average
+
+    Parameters
+        average (float) : Moving average if any else None
+        sample (float) : New sample
+
+    Returns
+        The updated moving average as a float
+    """
+    return sample if average is None else average + LATENCY_SMOOTHING * (sample - average)
+
+class Backend:
+    """Plex server of a pool, with its own connection pool, latency estimate and circuit breaker.
+    The breaker opens after BREAKER_FAILURES consecutive failures: the backend is skipped for
+    BREAKER_COOLDOWN seconds, then a single request (or a health check) tries it again
+
+    Attributes
+        url (str) : Base URL of the server
+        primary (bool) : True for the primary server, False for a read-only replica
+        latency (float) : Moving average of the response time of successful queries in seconds if measured else None
+        probe (float) : Moving average of the health check round trip in seconds if measured else None
+        failures (int) : Number of consecutive failures
+        opened (float) : Monotonic time the breaker opened at if open else None
+        requests (int) : Number of calls served
+        errors (int) : Number of failures
+    """
+    def __init__(self, url, token, primary=False):
+        """Backend init"""
+        self.url = url.rstrip('/')
+        self.token = token
+        self.primary = primary
+        self.latency = None
+        self.measured = None
+        self.probe = None
+        self.failures = 0
+        self.opened = None
+        self.trial = False
+        self.requests = 0
+        self.errors = 0
+        self.lock = threading.Lock()
+        self._session = None
+        self._server = None
+
+    @property
+    def state(self):
+        """State of the circuit breaker ('closed', 'open' or 'half-open')"""
+        if self.opened is None:
+            return 'closed'
+        return 'half-open' if time.monotonic() - self.opened >= BREAKER_COOLDOWN else 'open'
+
+    @property
+    def session(self):
+        """HTTP session of the backend, keeping its own connections"""
+        if self._session is None:
+            with self.lock:
+                if self._session is None:
+                    import requests
+
+                    session = requests.Session()
+                    adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=PLEX_POOL_SIZE)
+                    session.mount('http://', adapter)
+                    session.mount('https://', adapter)
+                    session.hooks['response'].append(self.observe)
+                    self._session = session
+        return self._session
+
+    @property
+    def server(self):
+        """Plex server, connected on first use (blocking)"""
+        if self._server is None:
+            session = self.session
+            with self.lock:
+                if self._server is None:
+                    from plexapi.server import PlexServer
+                    self._server = PlexServer(self.url, self.token, session=session, timeout=PLEX_TIMEOUT)
+        return self._server
+
+    def observe(self, response, *args, **kwargs):
+        """Updates the latency moving average with a response (requests hook).
+        Errors, often answered faster, and health checks do not reflect the response time of queries
+
+        Parameters
+            response (requests.Response) : Response received
+        """
+        if not response.ok or response.request.path_url == HEALTH_PATH:
+            return
+
+        self.latency = smooth(self.latency, response.elapsed.total_seconds())
+        self.measured = time.monotonic()
+
+    def estimate(self):
+        """Estimates the response time of the backend: the latency of its queries while they are recent,
+        else the round trip of its health checks, so that backends no longer queried are ranked again
+
+        Returns
+            Response time in seconds as a float if measured else None
+        """
+        if self.latency is not None and time.monotonic() - self.measured < LATENCY_MAX_AGE:
+            return self.latency
+        return self.probe if self.probe is not None else self.latency
+
+    def acquire(self):
+        """Checks if a request can be sent to the backend.
+        Once the cooldown of an open breaker is over, a single request is let through to try it
+
+        Returns
+            True if the request can be sent
+        """
+        with self.lock:
+            if self.opened is None:
+                return True
+            if self.trial or time.monotonic() - self.opened < BREAKER_COOLDOWN:
+                return False
+            self.trial = True
+            return True
+
+    def release(self):
+        """Ends a request let through by acquire, so that a trial that neither succeeded nor failed can be tried again"""
+        with self.lock:
+            self.trial = False
+
+    def succeeded(self):
+        """Records a successful request, closing the breaker"""
+        with self.lock:
+            if self.opened is not None:
+                logging.info(f"Plex backend {self.url} is back up")
+            self.failures = 0
+            self.opened = None
+            self.trial = False
+
+    def failed(self, exc):
+        """Records a failed request, opening the breaker after BREAKER_FAILURES in a row
+
+        Parameters
+            exc (Exception) : Error raised
+        """
+        with self.lock:
+            self.errors += 1
+            self.failures += 1
+            self.trial = False
+            if self.opened is not None or self.failures >= BREAKER_FAILURES:
+                if self.opened is None:
+                    logging.warning(f"Plex backend {self.url} is down, retrying in {BREAKER_COOLDOWN}s: {exc}")
+                self.opened = time.monotonic()
+
+    def check(self):
+        """Checks the health of the backend (blocking)
+
+        Returns
+            True if the backend answered
+        """
+        from requests import RequestException
+
+        try:
+            response = self.session.get(f'{self.url}{HEALTH_PATH}', timeout=PLEX_HEALTH_TIMEOUT)
+            response.raise_for_status()
+        except RequestException as exc:
+            self.failed(exc)
+            return False
+
+        self.probe = smooth(self.probe, response.elapsed.total_seconds())
+        self.succeeded()
+        return True
+
+class PlexBackends:
+    """Routes Plex requests between a primary server and its read-only replicas.
+    Read queries go to the fastest backend whose breaker is closed and fail over to the next ones,
+    while health checks keep the breakers and the round trips of idle backends up to date
+
+    Attributes
+        backends (list) : Backend objects, primary first
+        failovers (int) : Number of calls served by another backend after a failure
+    """
+    def __init__(self, urls, token):
+        """PlexBackends init"""
+        self.backends = [Backend(url, token, primary=index == 0) for index, url in enumerate(urls)]
+        self.failovers = 0
+        self.task = None
+
+    @property
+    def primary(self):
+        """Primary backend"""
+        return self.backends[0]
+
+    def ranked(self):
+        """Sorts the backends by estimated response time (unmeasured ones last, the primary first on ties)
+
+        Returns
+            A list of Backend objects
+        """
+        def rank(backend):
+            estimate = backend.estimate()
+            return (estimate is None, estimate or 0.0, not backend.primary)
+
+        return sorted(self.backends, key=rank)
+
+    def server(self):
+        """Gets a server for requests that are not routed (library sections and notifications), the primary while it is up (blocking)
+
+        Returns
+            A plexapi.server.PlexServer object
+        """
+        for backend in self.backends:
+            if backend.opened is None:
+                return backend.server
+        return self.primary.server
+
+    def call(self, func, *args):
+        """Runs a read query against the fastest available backend, failing over to the next ones (blocking)
+
+        Parameters
+            func (callable) : Blocking function querying Plex, called with the server and the arguments
+            args (tuple) : Arguments of the function
+
+        Returns
+            The result of the function
+
+        Raises
+            BackendsUnavailable if every backend failed or is down
+        """
+        from requests import RequestException
+        from plexapi.exceptions import BadRequest
+
+        errors = []
+        for backend in self.ranked():
+            if not backend.acquire():
+                continue
+            try:
+                with tracing.span('plex.backend', url=backend.url, primary=backend.primary):
+                    res = func(backend.server, *args)
+            except (RequestException, BadRequest) as exc:
+                if not is_outage(exc):
+                    raise
+                backend.failed(exc)
+                errors.append(exc)
+                continue
+            else:
+                backend.succeeded()
+            finally:
+                # Errors of the query itself (4xx statuses, missing items) do not tell if a half-open backend is back up
+                backend.release()
+
+            backend.requests += 1
+            if errors:
+                self.failovers += 1
+            return res
+
+        raise BackendsUnavailable(f"No Plex backend available: {'; '.join(map(str, errors)) or 'every breaker is open'}")
+
+    def check(self):
+        """Checks the health of every backend (blocking)"""
+        for backend in self.backends:
+            backend.check()
+
+    async def run(self):
+        """Checks the health of the backends until stopped"""
+        loop = asyncio.get_running_loop()
+        while True:
+            await loop.run_in_executor(None, self.check)
+            await asyncio.sleep(PLEX_HEALTH_INTERVAL)
+
+    def start(self, loop):
+        """Starts the health checks in the background
+
+        Parameters
+            loop (asyncio.AbstractEventLoop) : Event loop
+        """
+        if self.task is None or self.task.done():
+            self.task = loop.create_task(self.run())
+
+    def stop(self):
+        """Stops the health checks"""
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
@@ -36,6 +36,9 @@ import discord
 import random
 import re
 
+# Gateway intents needed by the cog (on_member_join)
+INTENTS = ('members',)
+
 class CogBasic(commands.Cog, name='Basic'):
     """All basic commands and listeners
 
@@ -115,3 +118,11 @@ class CogBasic(commands.Cog, name='Basic'):
         algebra = '+'.join([f"({'+'.join(map(str, rolls))})" for rolls in res])
         total = sum([sum(rolls) for rolls in res])
         await ctx.send(f"{algebra}\n=`{total}`")
+
+def setup(bot):
+    """Loads the extension
+
+    Parameters
+        bot (commands.Bot) : Bot to add the cog to
+    """
+    bot.add_cog(CogBasic(bot))
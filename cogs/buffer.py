@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+"""
+EDI jitter buffer for the audio read path
+"""
+#
+# Copyright (c) 2022, Marc GIANNETTI <mgtti.pro@gmail.com>
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+#  - Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+#
+#  - Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+#  - Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON
+# ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+from collections import deque
+import threading
+import discord
+
+# Number of frames decoded ahead when a guild starts playing (20ms each)
+JITTER_DEPTH = 10
+
+# Limits the number of frames decoded ahead
+JITTER_MAX_DEPTH = 250
+
+# Number of frames played without underrun before the depth is reduced
+JITTER_STABLE_FRAMES = 3000
+
+# Delay a late frame is waited for before sending silence (in seconds)
+LATE_WAIT = 0.01
+
+# Delay the buffer is waited for to fill up when the track starts (in seconds)
+PREFILL_TIMEOUT = 2
+
+# 20ms PCM frame of silence
+SILENCE = b'\x00' * discord.opus.Encoder.FRAME_SIZE
+
+class JitterStats:
+    """Jitter buffer statistics of a guild, shared by the tracks it plays
+
+    Attributes
+        depth (int) : Number of frames decoded ahead, adapted to underruns
+        frames (int) : Number of frames played
+        late (int) : Number of frames that were not decoded in time but arrived shortly
+        underruns (int) : Number of frames replaced by silence
+    """
+    __slots__ = ('depth', 'frames', 'late', 'underruns')
+
+    def __init__(self, depth=JITTER_DEPTH):
+        """JitterStats init"""
+        self.depth = depth
+        self.frames = 0
+        self.late = 0
+        self.underruns = 0
+
+class BufferedAudio(discord.AudioSource):
+    """Audio source decoding frames ahead in a background reader so that stalls of ffmpeg
+    or of the storage do not stall discord's audio thread.
+    The depth doubles on each stall causing underruns and halves after JITTER_STABLE_FRAMES frames without any
+
+    Attributes
+        original (discord.AudioSource) : PCM source read ahead
+        stats (JitterStats) : Statistics of the guild
+        done (bool) : True once the source is read to the end
+        failed (bool) : True if reading the source failed, the track being truncated
+    """
+    def __init__(self, original, stats):
+        """BufferedAudio init"""
+        self.original = original
+        self.stats = stats
+        self.frames = deque()
+        self.cond = threading.Condition()
+        self.started = False
+        self.ended = False
+        self.closed = False
+        self.done = False
+        self.failed = False
+        self.stable = 1
+        self.thread = threading.Thread(target=self.fill, daemon=True)
+        self.thread.start()
+
+    def fill(self):
+        """Reads frames ahead until the end of the source (reader thread)"""
+        try:
+            while True:
+                with self.cond:
+                    self.cond.wait_for(lambda: len(self.frames) < self.stats.depth or self.closed)
+                    if self.closed:
+                        return
+
+                frame = self.original.read()
+                with self.cond:
+                    if not frame:
+                        return
+                    self.frames.append(frame)
+                    self.cond.notify_all()
+        except (OSError, ValueError):
+            # ffmpeg was killed while reading: what was read is played, but the track is not complete
+            with self.cond:
+                self.failed = True
+        finally:
+            with self.cond:
+                self.ended = True
+                self.cond.notify_all()
+
+    def wait_ready(self, timeout=PREFILL_TIMEOUT):
+        """Waits for the buffer to fill up before the source is played (blocking), so that its first read does not stall
+
+        Parameters
+            timeout (float) [optional] : Delay to wait for (in seconds)
+
+        Returns
+            True if the buffer is filled up or the source was read to the end
+        """
+        with self.cond:
+            return self.cond.wait_for(lambda: len(self.frames) >= self.stats.depth or self.ended, timeout)
+
+    def read(self):
+        """Reads the next frame
+
+        Returns
+            A PCM frame as bytes, silence on underrun, or b'' at the end of the source
+        """
+        stats = self.stats
+        with self.cond:
+            if not self.started:
+                self.started = True
+                self.cond.wait_for(lambda: len(self.frames) >= stats.depth or self.ended, PREFILL_TIMEOUT)
+            elif not self.frames and not self.ended:
+                if self.cond.wait_for(lambda: self.frames or self.ended, LATE_WAIT) and self.frames:
+                    stats.late += 1
+
+            if self.frames:
+                frame = self.frames.popleft()
+                self.cond.notify_all()
+                stats.frames += 1
+                self.stable += 1
+                if self.stable >= JITTER_STABLE_FRAMES and stats.depth > JITTER_DEPTH:
+                    stats.depth = max(JITTER_DEPTH, stats.depth // 2)
+                    self.stable = 0
+                return frame
+
+            if self.ended:
+                self.done = not self.failed
+                return b''
+
+            # Underrun: send silence and read further ahead (once per stall)
+            stats.underruns += 1
+            if self.stable:
+                stats.depth = min(JITTER_MAX_DEPTH, stats.depth * 2)
+                self.stable = 0
+            return SILENCE
+
+    def cleanup(self):
+        """Stops the reader and releases the original source.
+        Both the player and the voice client thread clean up, only the first call releases it"""
+        with self.cond:
+            if self.closed:
+                return
+            self.closed = True
+            self.cond.notify_all()
+        self.original.cleanup()
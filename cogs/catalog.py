@@ -0,0 +1,631 @@
+# -*- coding: utf-8 -*-
+"""
+EDI catalog snapshot shared by the bot processes
+"""
+#
+# Copyright (c) 2022, Marc GIANNETTI <mgtti.pro@gmail.com>
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+#  - Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+#
+#  - Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+#  - Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON
+# ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+from collections import namedtuple
+from . import tracing
+import unicodedata
+import asyncio
+import logging
+import struct
+import mmap
+import time
+import os
+
+# File naming the version of the catalog snapshot shared by the bot processes, versions are stored next to it (catalog.bin.<generation>)
+CATALOG_FILE = os.path.join(os.path.expanduser('~'), '.cache', 'edi', 'catalog.bin')
+
+# Delay between two refreshes of the snapshot, and between two checks for library changes (in seconds)
+CATALOG_REFRESH_INTERVAL = 900
+CATALOG_CHECK_INTERVAL = 30
+
+# Age after which a snapshot is ignored, its refresher being presumably down (in seconds)
+CATALOG_MAX_AGE = 3 * CATALOG_REFRESH_INTERVAL
+
+# Layout of a snapshot (little-endian): header | sections | albums | tracks | key index | strings
+# Strings are UTF-8 (offset, length) pairs relative to the strings, albums are stored by section in titleSort order,
+# tracks by album, and the key index holds the album numbers of each section sorted by lookup key
+MAGIC = b'EDICAT\x00\x01'
+HEADER = struct.Struct('<8sd9I')    # magic, creation time, number of sections/albums/tracks, offsets of the tables, file size
+SECTION = struct.Struct('<6I')      # title, first album, number of albums, lookup keys of its albums (newline separated)
+ALBUM = struct.Struct('<6IQqII')    # title, lookup key, artist, ratingKey, updatedAt, first track, number of tracks
+TRACK = struct.Struct('<4IQI')      # title, path relative to its partition, ratingKey, duration (in ms)
+INDEX = struct.Struct('<I')         # album number
+
+# Album and track of a snapshot, with the attributes of the plexapi objects the Plex cog uses
+CatalogAlbum = namedtuple('CatalogAlbum', ('title', 'parentTitle', 'ratingKey', 'updatedAt'))
+CatalogTrack = namedtuple('CatalogTrack', ('title', 'duration', 'ratingKey', 'path'))
+
+def fold(text):
+    """Folds a title or a keyword to a lookup key, ignoring case, accents, commas and spacing
+
+    Parameters
+        text (str) : Text to fold
+
+    Returns
+        Lookup key as a str
+    """
+    text = unicodedata.normalize('NFKD', text.replace(',', ''))
+    return ' '.join(''.join(c for c in text if not unicodedata.combining(c)).casefold().split())
+
+def relative_path(location):
+    """Resolves the location of a track on the Plex server to a path relative to its partition
+
+    Parameters
+        location (str) : Path of the track on the Plex server (/<mount>/<section>/...)
+
+    Returns
+        Path relative to the partition as a str
+    """
+    return location.split('/', 3)[3]
+
+def fetch_catalog(server, titles):
+    """Fetches the albums and tracks of library sections (blocking)
+
+    Parameters
+        server (plexapi.server.PlexServer) : Plex server routed to
+        titles (iterable) : Titles of the sections
+
+    Returns
+        A list of (section title, list of (CatalogAlbum, list of CatalogTrack)) tuples
+    """
+    from plexapi.exceptions import NotFound
+
+    sections = []
+    for title in titles:
+        try:
+            with tracing.span('plex.section', section=title):
+                s = server.library.section(title)
+        except NotFound:
+            continue
+
+        # Two requests per section, whatever the number of albums
+        with tracing.span('plex.search', libtype='album'):
+            albums = s.search(libtype='album', sort='titleSort')
+        with tracing.span('plex.search', libtype='track'):
+            tracks = s.search(libtype='track')
+
+        by_album = {}
+        for track in sorted(tracks, key=lambda t: (t.parentIndex or 0, t.index or 0)):
+            by_album.setdefault(int(track.parentRatingKey), []).append(
+                CatalogTrack(track.title, track.duration or 0, int(track.ratingKey), relative_path(track.media[0].parts[0].file)))
+
+        sections.append((title, [(CatalogAlbum(a.title, a.parentTitle or '', int(a.ratingKey), int(a.updatedAt.timestamp()) if a.updatedAt else 0),
+                                  by_album.get(int(a.ratingKey), [])) for a in albums]))
+    return sections
+
+def versions(path):
+    """Lists the versions of a snapshot (blocking)
+
+    Parameters
+        path (str) : Path to the pointer of the snapshot
+
+    Returns
+        A list of (generation, path to the version) tuples sorted by generation
+    """
+    directory, name = os.path.split(path)
+    found = []
+    for entry in os.listdir(directory or '.'):
+        prefix, _, generation = entry.rpartition('.')
+        if prefix == name and generation.isdigit():
+            found.append((int(generation), os.path.join(directory, entry)))
+    return sorted(found)
+
+def read_pointer(path):
+    """Gets the version of a snapshot its pointer names (blocking)
+
+    Parameters
+        path (str) : Path to the pointer of the snapshot
+
+    Returns
+        Path to the version as a str
+
+    Raises
+        OSError if the pointer can not be read
+        ValueError if it does not name a version
+    """
+    with open(path, 'rb') as f:
+        name = f.read(256).decode('utf-8')
+    prefix, _, generation = name.rpartition('.')
+    if prefix != os.path.basename(path) or not generation.isdigit():
+        raise ValueError(f"{path} does not name a catalog snapshot")
+    return os.path.join(os.path.dirname(path), name)
+
+def write(path, sections, created=None):
+    """Writes a new version of a snapshot, then swaps its pointer atomically: readers map either the old or the new version (blocking).
+    Versions are never replaced while mapped, which Windows forbids, and the ones before the previous version are removed
+
+    Parameters
+        path (str) : Path to the pointer of the snapshot
+        sections (list) : (section title, list of (CatalogAlbum, list of CatalogTrack)) tuples (see fetch_catalog)
+        created (float) [optional] : Creation time of the snapshot (Default is now)
+
+    Returns
+        Size of the snapshot in bytes
+    """
+    strings = bytearray()
+
+    def ref(text):
+        data = text.encode('utf-8')
+        strings.extend(data)
+        return (len(strings) - len(data), len(data))
+
+    section_records = []
+    album_records = []
+    track_records = []
+    index = []
+    for title, albums in sections:
+        first = len(album_records)
+
+        # Keys of a section are contiguous so that searches scan them at once
+        keys = [fold(album.title).encode('utf-8') for album, _ in albums]
+        keys_offset = len(strings)
+        key_offsets = []
+        for key in keys:
+            key_offsets.append(len(strings))
+            strings.extend(key + b'\n')
+        # The title is stored after the keys, outside of the region searches scan
+        keys_len = len(strings) - keys_offset
+        section_records.append((*ref(title), first, len(albums), keys_offset, keys_len))
+
+        for (album, tracks), key, key_offset in zip(albums, keys, key_offsets):
+            album_records.append((*ref(album.title), key_offset, len(key), *ref(album.parentTitle),
+                                  album.ratingKey, album.updatedAt, len(track_records), len(tracks)))
+            track_records.extend((*ref(track.title), *ref(track.path), track.ratingKey, track.duration) for track in tracks)
+        index.extend(sorted(range(first, len(album_records)), key=lambda number: keys[number - first]))
+
+    sections_offset = HEADER.size
+    albums_offset = sections_offset + SECTION.size * len(section_records)
+    tracks_offset = albums_offset + ALBUM.size * len(album_records)
+    index_offset = tracks_offset + TRACK.size * len(track_records)
+    strings_offset = index_offset + INDEX.size * len(index)
+    size = strings_offset + len(strings)
+
+    buf = bytearray(size)
+    HEADER.pack_into(buf, 0, MAGIC, time.time() if created is None else created, len(section_records), len(album_records), len(track_records),
+                     sections_offset, albums_offset, tracks_offset, index_offset, strings_offset, size)
+    for table, offset, records in ((SECTION, sections_offset, section_records), (ALBUM, albums_offset, album_records),
+                                   (TRACK, tracks_offset, track_records), (INDEX, index_offset, [(number,) for number in index])):
+        for position, record in enumerate(records):
+            table.pack_into(buf, offset + table.size * position, *record)
+    buf[strings_offset:] = strings
+
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    previous = versions(path)
+    version = f'{path}.{previous[-1][0] + 1 if previous else 1}'
+    tmp = f'{path}.{os.getpid()}.tmp'
+    try:
+        for name, data in ((version, buf), (tmp, os.path.basename(version).encode('utf-8'))):
+            with open(name, 'wb') as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(tmp, path)
+    except OSError:
+        for name in (tmp, version):
+            try:
+                os.remove(name)
+            except OSError:
+                pass
+        raise
+
+    # Readers may not have mapped the new version yet, and versions still mapped on Windows are removed by a later refresh
+    for _, name in previous[:-1]:
+        try:
+            os.remove(name)
+        except OSError:
+            pass
+    return size
+
+class Listing:
+    """Album titles of a section in titleSort order, read from a snapshot on access
+
+    Attributes
+        snapshot (Snapshot) : Snapshot the titles are read from
+        first (int) : Number of the first album of the section
+        count (int) : Number of albums in the section
+    """
+    __slots__ = ('snapshot', 'first', 'count')
+
+    def __init__(self, snapshot, first, count):
+        """Listing init"""
+        self.snapshot = snapshot
+        self.first = first
+        self.count = count
+
+    def __len__(self):
+        """Number of albums"""
+        return self.count
+
+    def __getitem__(self, item):
+        """Gets a title, or a list of titles from a slice"""
+        if isinstance(item, slice):
+            return [self.snapshot.title(self.first + position) for position in range(*item.indices(self.count))]
+        if item < 0:
+            item += self.count
+        if not 0 <= item < self.count:
+            raise IndexError(item)
+        return self.snapshot.title(self.first + item)
+
+class Snapshot:
+    """Catalog snapshot mapped read-only. Records are unpacked from the mapped buffer on lookup,
+    only the section titles are read when it is mapped
+
+    Attributes
+        path (str) : Path to the version mapped
+        created (float) : Creation time of the snapshot
+        albums (int) : Number of albums
+        tracks (int) : Number of tracks
+        size (int) : Size of the snapshot in bytes
+        sections (dict) : Section numbers by title
+
+    Raises
+        OSError if the file can not be mapped
+        ValueError if it is not a valid snapshot
+    """
+    def __init__(self, path):
+        """Snapshot init"""
+        self.path = path
+        with open(path, 'rb') as f:
+            st = os.fstat(f.fileno())
+            if st.st_size < HEADER.size:
+                raise ValueError(f"{path} is truncated")
+            self.buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        (magic, self.created, sections, self.albums, self.tracks, self.sections_offset, self.albums_offset,
+         self.tracks_offset, self.index_offset, self.strings_offset, self.size) = HEADER.unpack_from(self.buf)
+        if magic != MAGIC or self.size != len(self.buf):
+            raise ValueError(f"{path} is not a valid catalog snapshot")
+
+        self.sections = {self.string(*self.section_record(number)[:2]): number for number in range(sections)}
+        self.listings = {}
+
+    def string(self, offset, length):
+        """Decodes a string of the snapshot"""
+        start = self.strings_offset + offset
+        return self.buf[start:start + length].decode('utf-8')
+
+    def section_record(self, number):
+        """Unpacks the record of a section"""
+        return SECTION.unpack_from(self.buf, self.sections_offset + SECTION.size * number)
+
+    def album_record(self, number):
+        """Unpacks the record of an album"""
+        return ALBUM.unpack_from(self.buf, self.albums_offset + ALBUM.size * number)
+
+    def title(self, number):
+        """Gets the title of an album"""
+        return self.string(*ALBUM.unpack_from(self.buf, self.albums_offset + ALBUM.size * number)[:2])
+
+    def key(self, number):
+        """Gets the lookup key of an album as bytes"""
+        offset, length = ALBUM.unpack_from(self.buf, self.albums_offset + ALBUM.size * number)[2:4]
+        start = self.strings_offset + offset
+        return self.buf[start:start + length]
+
+    def album(self, number):
+        """Gets an album and its tracks
+
+        Parameters
+            number (int) : Number of the album
+
+        Returns
+            A tuple composed of the CatalogAlbum and its list of CatalogTrack
+        """
+        title, title_len, _, _, artist, artist_len, rating_key, updated_at, first, count = self.album_record(number)
+        tracks = []
+        for position in range(first, first + count):
+            title_off, title_length, path, path_len, track_key, duration = TRACK.unpack_from(self.buf, self.tracks_offset + TRACK.size * position)
+            tracks.append(CatalogTrack(self.string(title_off, title_length), duration, track_key, self.string(path, path_len)))
+        return (CatalogAlbum(self.string(title, title_len), self.string(artist, artist_len), rating_key, updated_at), tracks)
+
+    def listing(self, section):
+        """Gets the album titles of a section, the same Listing while the snapshot is mapped
+
+        Parameters
+            section (int) : Number of the section
+
+        Returns
+            A Listing object
+        """
+        listing = self.listings.get(section)
+        if listing is None:
+            first, count = self.section_record(section)[2:4]
+            listing = self.listings[section] = Listing(self, first, count)
+        return listing
+
+    def locate(self, lo, hi, offset):
+        """Finds the album whose lookup key holds an offset of the strings, by bisection
+
+        Parameters
+            lo (int) : Number of an album whose key starts at or before the offset
+            hi (int) : Number of the album after the last one of the section
+            offset (int) : Offset within the strings
+
+        Returns
+            Number of the album as an int
+        """
+        while hi - lo > 1:
+            mid = (lo + hi) // 2
+            if ALBUM.unpack_from(self.buf, self.albums_offset + ALBUM.size * mid)[2] <= offset:
+                lo = mid
+            else:
+                hi = mid
+        return lo
+
+    def search(self, section, keyword, limit):
+        """Searches the albums of a section whose title contains a keyword, scanning the mapped keys
+
+        Parameters
+            section (int) : Number of the section
+            keyword (str) : Keyword to search for
+            limit (int) : Maximum number of results
+
+        Returns
+            List of album numbers in titleSort order
+        """
+        needle = fold(keyword).encode('utf-8')
+        _, _, first, count, keys_offset, keys_len = self.section_record(section)
+        if not needle or not count:
+            return []
+
+        start = self.strings_offset + keys_offset
+        end = start + keys_len
+        lo = first
+        results = []
+        while len(results) < limit and lo < first + count:
+            position = self.buf.find(needle, start, end)
+            if position < 0:
+                break
+            number = self.locate(lo, first + count, position - self.strings_offset)
+
+            # Matches past the key of the last album are not in the section
+            offset, length = self.album_record(number)[2:4]
+            if position + len(needle) > self.strings_offset + offset + length:
+                break
+            results.append(number)
+
+            # Next album, keys being newline separated
+            start = self.strings_offset + offset + length + 1
+            lo = number + 1
+        return results
+
+    def find(self, section, keyword):
+        """Finds the album of a section whose title is a keyword, or else the first one containing it
+
+        Parameters
+            section (int) : Number of the section
+            keyword (str) : Title of the album
+
+        Returns
+            Number of the album if found else None
+        """
+        needle = fold(keyword).encode('utf-8')
+        _, _, first, count = self.section_record(section)[:4]
+
+        # Bisection of the key index of the section
+        lo, hi = first, first + count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.key(INDEX.unpack_from(self.buf, self.index_offset + INDEX.size * mid)[0]) < needle:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < first + count:
+            number = INDEX.unpack_from(self.buf, self.index_offset + INDEX.size * lo)[0]
+            if self.key(number) == needle:
+                return number
+
+        results = self.search(section, keyword, 1)
+        return results[0] if results else None
+
+class Catalog:
+    """Reads the catalog snapshot shared by the bot processes.
+    The file is mapped read-only, so that its pages are shared between the processes through the page cache,
+    and the version named by the pointer file is mapped again once the refresher swapped it. Lookups the snapshot can not serve
+    (missing, too old, section or album not found) return None, so that the caller queries Plex instead
+
+    Attributes
+        path (str) : Path to the pointer of the snapshot
+        max_age (float) : Age after which the snapshot is ignored (in seconds)
+        current (Snapshot) : Snapshot mapped if any else None
+        hits (int) : Number of lookups served by the snapshot
+        misses (int) : Number of lookups left to Plex
+        remaps (int) : Number of snapshots mapped
+    """
+    def __init__(self, path, max_age=CATALOG_MAX_AGE):
+        """Catalog init"""
+        self.path = path
+        self.max_age = max_age
+        self.current = None
+        self.pointer = None
+        self.hits = 0
+        self.misses = 0
+        self.remaps = 0
+
+    def snapshot(self):
+        """Gets the current snapshot, mapping the version the pointer names once it was swapped
+
+        Returns
+            A Snapshot object if up to date else None
+        """
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            st = None
+
+        # The pointer is read again once swapped (its inode changed)
+        inode = (st.st_dev, st.st_ino) if st is not None else None
+        if inode is not None and inode != self.pointer:
+            self.pointer = inode
+            try:
+                version = read_pointer(self.path)
+                if self.current is None or self.current.path != version:
+                    # The previous version is unmapped once no listing refers to it
+                    self.current = Snapshot(version)
+                    self.remaps += 1
+            except (OSError, ValueError, struct.error) as exc:
+                logging.warning(f"Can not map catalog snapshot: {exc}")
+
+        current = self.current
+        if current is None or time.time() - current.created > self.max_age:
+            return None
+        return current
+
+    def lookup(self, section):
+        """Gets the snapshot and the number of a section
+
+        Parameters
+            section (str) : Title of the section
+
+        Returns
+            A tuple composed of the Snapshot and the section number, or (None, None)
+        """
+        snapshot = self.snapshot()
+        number = snapshot.sections.get(section) if snapshot is not None else None
+        return (snapshot, number) if number is not None else (None, None)
+
+    def listing(self, section):
+        """Gets the album titles of a section
+
+        Parameters
+            section (str) : Title of the section
+
+        Returns
+            A Listing object if served else None
+        """
+        snapshot, number = self.lookup(section)
+        if snapshot is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return snapshot.listing(number)
+
+    def search(self, section, keyword, limit):
+        """Searches album titles containing a keyword
+
+        Parameters
+            section (str) : Title of the section
+            keyword (str) : Keyword to search for
+            limit (int) : Maximum number of results
+
+        Returns
+            List of album titles if any matched else None
+        """
+        snapshot, number = self.lookup(section)
+        results = snapshot.search(number, keyword, limit) if snapshot is not None else None
+        if not results:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return [snapshot.title(album) for album in results]
+
+    def find(self, section, keyword):
+        """Finds an album and its tracks
+
+        Parameters
+            section (str) : Title of the section
+            keyword (str) : Title of the album
+
+        Returns
+            A tuple composed of the CatalogAlbum and its list of CatalogTrack if found else None
+        """
+        snapshot, number = self.lookup(section)
+        album = snapshot.find(number, keyword) if snapshot is not None else None
+        if album is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return snapshot.album(album)
+
+class CatalogRefresher:
+    """Writes the catalog snapshot from Plex, in the one bot process refreshing it for the others.
+    The snapshot is written again once the library changed (the library cache was invalidated)
+    and every CATALOG_REFRESH_INTERVAL
+
+    Attributes
+        bot (commands.Bot) : Bot holding the Plex backends
+        path (str) : Path to the pointer of the snapshot
+        cache (LibraryCache) : Library cache whose invalidations signal library changes
+        sections (tuple) : Titles of the sections in the snapshot
+        refreshes (int) : Number of snapshots written
+        duration (float) : Duration of the last refresh in seconds if any else None
+    """
+    def __init__(self, bot, path, cache, sections):
+        """CatalogRefresher init"""
+        self.bot = bot
+        self.path = path
+        self.cache = cache
+        self.sections = tuple(sections)
+        self.refreshes = 0
+        self.duration = None
+        self.task = None
+
+    def start(self):
+        """Starts refreshing the snapshot in the background"""
+        self.task = self.bot.loop.create_task(self.run())
+
+    def stop(self):
+        """Stops refreshing the snapshot"""
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+
+    async def run(self):
+        """Refreshes the snapshot until stopped"""
+        loop = asyncio.get_running_loop()
+        await self.bot.wait_until_ready()
+
+        generation = None
+        refreshed = 0.0
+        while True:
+            if generation != self.cache.generation or time.monotonic() - refreshed >= CATALOG_REFRESH_INTERVAL:
+                current = self.cache.generation
+                try:
+                    await loop.run_in_executor(None, self.refresh)
+                    generation, refreshed = current, time.monotonic()
+                except Exception as exc:
+                    logging.warning(f"Catalog snapshot refresh failed: {exc}")
+            await asyncio.sleep(CATALOG_CHECK_INTERVAL)
+
+    def refresh(self):
+        """Fetches the catalog from Plex and swaps the snapshot (blocking)"""
+        start = time.perf_counter()
+        sections = self.bot.plex_backends.call(fetch_catalog, self.sections)
+        size = write(self.path, sections)
+        self.duration = time.perf_counter() - start
+        self.refreshes += 1
+        logging.info(f"Catalog snapshot written: {sum(len(albums) for _, albums in sections)} albums, "
+                     f"{size // 1024} KB in {self.duration:.2f}s")
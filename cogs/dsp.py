@@ -0,0 +1,222 @@
+# -*- coding: utf-8 -*-
+"""
+EDI PCM processing (volume ramps, fades and crossfades)
+"""
+#
+# Copyright (c) 2022, Marc GIANNETTI <mgtti.pro@gmail.com>
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+#  - Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+#
+#  - Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+#  - Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON
+# ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import numpy as np
+import discord
+import math
+
+# Duration of a volume change (in 20ms frames)
+RAMP_FRAMES = 10
+
+# Layout of a 20ms PCM frame (signed 16-bit samples, interleaved channels)
+FRAME_SIZE = discord.opus.Encoder.FRAME_SIZE
+SAMPLES_PER_FRAME = discord.opus.Encoder.SAMPLES_PER_FRAME
+CHANNELS = discord.opus.Encoder.CHANNELS
+
+# Position of each sample within a frame, envelopes are interpolated linearly between frame boundaries
+POSITIONS = np.linspace(0, 1, SAMPLES_PER_FRAME, endpoint=False, dtype=np.float32)[:, None]
+
+# Fixed-point scale of constant gains up to 1.0 (applied with integer arithmetic, without clipping)
+UNITY = 1 << 15
+
+def scale(frame, gain):
+    """Applies a constant gain to a frame
+
+    Parameters
+        frame (bytes) : PCM frame
+        gain (float) : Gain
+
+    Returns
+        The scaled PCM frame as bytes
+    """
+    samples = np.frombuffer(frame, dtype=np.int16)
+    if gain <= 1.0:
+        scaled = samples.astype(np.int32)
+        scaled *= int(gain * UNITY)
+        scaled >>= 15
+        return scaled.astype(np.int16).tobytes()
+
+    scaled = samples * np.float32(gain)
+    return np.clip(scaled, -32768, 32767, out=scaled).astype(np.int16).tobytes()
+
+def ramp(frame, start, end):
+    """Applies a gain moving linearly over a frame
+
+    Parameters
+        frame (bytes) : PCM frame
+        start (float) : Gain at the start of the frame
+        end (float) : Gain at the end of the frame
+
+    Returns
+        The PCM frame as bytes
+    """
+    samples = np.frombuffer(frame, dtype=np.int16).reshape(-1, CHANNELS)
+    scaled = samples * (np.float32(start) + np.float32(end - start) * POSITIONS)
+    return np.clip(scaled, -32768, 32767, out=scaled).astype(np.int16).tobytes()
+
+def mix(frame, other):
+    """Mixes two frames
+
+    Parameters
+        frame (bytes) : PCM frame
+        other (bytes) : PCM frame
+
+    Returns
+        The sum of the frames as bytes
+    """
+    mixed = np.frombuffer(frame, dtype=np.int16).astype(np.int32)
+    mixed += np.frombuffer(other, dtype=np.int16)
+    return np.clip(mixed, -32768, 32767, out=mixed).astype(np.int16).tobytes()
+
+class Fade:
+    """Equal-power fade in or out over a number of frames, so that crossfaded tracks keep their loudness
+
+    Attributes
+        frames (int) : Duration of the fade (in frames)
+        out (bool) : True for a fade out
+        position (int) : Number of frames faded
+    """
+    __slots__ = ('frames', 'out', 'position')
+
+    def __init__(self, frames, out):
+        """Fade init"""
+        self.frames = max(1, frames)
+        self.out = out
+        self.position = 0
+
+    def level(self, position):
+        """Gain of the fade at a frame boundary"""
+        angle = min(position, self.frames) / self.frames * math.pi / 2
+        return math.cos(angle) if self.out else math.sin(angle)
+
+    def advance(self):
+        """Moves the fade to the next frame
+
+        Returns
+            A tuple composed of the gains at the start and at the end of the frame
+        """
+        start = self.level(self.position)
+        self.position += 1
+        return (start, self.level(self.position))
+
+    @property
+    def done(self):
+        """True once the fade is over"""
+        return self.position >= self.frames
+
+class Processor:
+    """PCM processing stage of an audio source: volume ramps and fades, applied to whole frames.
+    Frames go through untouched at unity gain, and constant gains use integer arithmetic
+
+    Attributes
+        gain (float) : Current gain
+        target (float) : Gain the volume ramp moves to
+        fade (Fade) : Fade in progress if any else None
+    """
+    __slots__ = ('gain', 'target', 'step', 'fade')
+
+    def __init__(self, gain=1.0):
+        """Processor init"""
+        self.gain = gain
+        self.target = gain
+        self.step = 0.0
+        self.fade = None
+
+    def set_gain(self, target, frames=RAMP_FRAMES):
+        """Moves the gain to a target, linearly over a number of frames
+
+        Parameters
+            target (float) : Gain to reach
+            frames (int) [optional] : Duration of the ramp (in frames)
+        """
+        self.target = target
+        self.step = (target - self.gain) / max(1, frames)
+
+    def fade_in(self, frames):
+        """Fades the source in
+
+        Parameters
+            frames (int) : Duration of the fade (in frames)
+        """
+        self.fade = Fade(frames, False)
+
+    def fade_out(self, frames):
+        """Fades the source out from its current level, it ends once faded
+
+        Parameters
+            frames (int) : Duration of the fade (in frames)
+        """
+        level = self.fade.level(self.fade.position) if self.fade is not None else 1.0
+        fade = Fade(frames, True)
+        fade.position = round(math.acos(min(1.0, level)) * 2 / math.pi * fade.frames)
+        self.fade = fade
+
+    @property
+    def fading_out(self):
+        """True while the source fades out"""
+        return self.fade is not None and self.fade.out
+
+    def process(self, frame, under=None):
+        """Processes a frame
+
+        Parameters
+            frame (bytes) : PCM frame
+            under (bytes) [optional] : Processed PCM frame of a source fading out under this one
+
+        Returns
+            The processed PCM frame as bytes, or b'' once faded out
+        """
+        start = end = self.gain
+        if self.gain != self.target:
+            end = self.gain + self.step
+            if self.step > 0 and end >= self.target or self.step < 0 and end <= self.target:
+                end = self.target
+            self.gain = end
+
+        fade = self.fade
+        if fade is not None:
+            if fade.done:
+                if fade.out:
+                    return b''
+                self.fade = None
+            else:
+                fade_start, fade_end = fade.advance()
+                start, end = start * fade_start, end * fade_end
+
+        if len(frame) != FRAME_SIZE:
+            return frame
+        if start != end:
+            frame = ramp(frame, start, end)
+        elif start != 1.0:
+            frame = scale(frame, start)
+        return mix(frame, under) if under else frame
@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+"""
+EDI rendered embeds cache and Discord embed limits
+"""
+#
+# Copyright (c) 2022, Marc GIANNETTI <mgtti.pro@gmail.com>
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+#  - Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+#
+#  - Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+#  - Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON
+# ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+from collections import OrderedDict
+
+# Discord embed limits (in characters, except for the number of fields)
+EMBED_TOTAL = 6000
+EMBED_TITLE = 256
+EMBED_DESCRIPTION = 4096
+EMBED_FIELDS = 25
+EMBED_FIELD_VALUE = 1024
+
+# Characters kept for the author and footer of the requester, applied on each reply
+EMBED_REQUESTER_RESERVE = 128
+
+# Characters kept for the last field summarizing the lines left out of an embed
+EMBED_SUMMARY_RESERVE = 64
+
+# Limits the number of cached rendered embeds
+EMBED_CACHE_SIZE = 512
+
+def truncate(text, limit):
+    """Truncates a text to a length limit
+
+    Parameters
+        text (str) : Text to truncate
+        limit (int) : Maximum length
+
+    Returns
+        The text, ending with an ellipsis if it was truncated
+    """
+    return text if len(text) <= limit else text[:limit-1] + '…'
+
+def add_line_fields(embed, lines, per_field, noun):
+    """Adds numbered lines to an embed, packed in fields that respect the Discord embed limits.
+    A field holds at most per_field lines and EMBED_FIELD_VALUE characters. Lines that do not fit
+    in the embed (EMBED_FIELDS fields, EMBED_TOTAL characters with the requester reserve) are
+    summarized in a last field
+
+    Parameters
+        embed (discord.Embed) : Embed to add fields to
+        lines (list) : Lines to add (str), numbered from 1
+        per_field (int) : Maximum number of lines per field
+        noun (str) : Plural noun of the lines, for the summary of the lines left out
+    """
+    fields = []
+    start = 0
+    while start < len(lines):
+        value = truncate(lines[start], EMBED_FIELD_VALUE)
+        end = start + 1
+        while end < len(lines) and end - start < per_field and len(value) + 1 + len(lines[end]) <= EMBED_FIELD_VALUE:
+            value += '\n' + lines[end]
+            end += 1
+        fields.append((f'{start+1} - {end}', value, end))
+        start = end
+
+    budget = EMBED_TOTAL - EMBED_REQUESTER_RESERVE - len(embed)
+    shown = 0
+    for count, (name, value, end) in enumerate(fields):
+        # Unless this is the last field, keep room for the summary of the lines left out after it
+        last = count + 1 == len(fields)
+        size = len(name) + len(value)
+        if not last and (count + 1 == EMBED_FIELDS or size + EMBED_SUMMARY_RESERVE > budget) or size > budget:
+            embed.add_field(name='...', value=f'and {len(lines) - shown} more {noun}', inline=False)
+            return
+        embed.add_field(name=name, value=value, inline=False)
+        budget -= size
+        shown = end
+
+class EmbedCache:
+    """Caches rendered embeds without their per-requester author and footer.
+    Keys include the version of what they render (album updatedAt), and an entry can be tied to
+    the object it was rendered from (the cached list of a section) so that it is only served
+    while the library cache still holds the same object
+
+    Attributes
+        size (int) : Maximum number of entries
+        hits (int) : Number of embeds served from cache
+        misses (int) : Number of embeds rendered
+    """
+    def __init__(self, size=EMBED_CACHE_SIZE):
+        """EmbedCache init"""
+        self.size = size
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        """Number of cached embeds"""
+        return len(self.entries)
+
+    def get(self, key, source=None):
+        """Gets a copy of a rendered embed
+
+        Parameters
+            key (tuple) : Key of the embed
+            source (object) [optional] : Object the embed must have been rendered from
+
+        Returns
+            A tuple of (discord.Embed copy, extra data) if cached else None
+        """
+        entry = self.entries.get(key)
+        if entry is None or entry[1] is not source:
+            self.misses += 1
+            return None
+
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return (entry[0].copy(), entry[2])
+
+    def put(self, key, embed, source=None, extra=None):
+        """Caches a rendered embed
+
+        Parameters
+            key (tuple) : Key of the embed
+            embed (discord.Embed) : Embed without author nor footer (a copy is kept)
+            source (object) [optional] : Object the embed was rendered from
+            extra (object) [optional] : Data returned along with the embed
+        """
+        self.entries[key] = (embed.copy(), source, extra)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+
+    def clear(self):
+        """Forgets every embed"""
+        self.entries.clear()
@@ -32,10 +32,10 @@ EDI cog error handler
 # SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
 from .voice import VoiceChannelMissing, VoiceChannelNotFound, VoiceInvalidChannel, VoiceInvalidValue, VoiceConnectionError, VoiceNotConnected, VoiceNotPlaying
-from .plex import PlexInvalidCommand, PlexInvalidPage, PlexInvalidSection, PlexNoMatchingResults, PlexAlbumNotFound
+from .admin import AdminInvalidExtension, AdminReloadFailed
+from .plex import PlexInvalidCommand, PlexInvalidPage, PlexInvalidSection, PlexNoMatchingResults, PlexAlbumNotFound, PlexBusy, PlexUnavailable
 from discord.ext import commands
-import traceback
-import logging
+from . import tracing, logs
 
 class CogErrHandler(commands.Cog, name='Err'):
     """Handle cog errors
@@ -63,17 +63,30 @@ class CogErrHandler(commands.Cog, name='Err'):
             msg = f"I do not know this command {ctx.author.mention}"
         elif isinstance(err, commands.NoPrivateMessage):
             msg = f"This command can not be used in Private Messages {ctx.author.mention}"
-        elif isinstance(err, commands.MissingPermissions):
+        elif isinstance(err, (commands.MissingPermissions, commands.NotOwner)):
             msg = f"You're not allowed to do that {ctx.author.mention}"
         elif isinstance(err, commands.MissingRequiredArgument):
             msg = f"The argument `{err.param.name}` is missing for this command {ctx.author.mention}: "
         elif isinstance(err, (VoiceChannelMissing, VoiceChannelNotFound, VoiceInvalidChannel, VoiceInvalidValue, VoiceConnectionError, VoiceNotConnected, VoiceNotPlaying)):
             msg = err
-        elif isinstance(err, (PlexInvalidCommand, PlexInvalidPage, PlexInvalidSection, PlexNoMatchingResults, PlexAlbumNotFound)):
+        elif isinstance(err, (PlexInvalidCommand, PlexInvalidPage, PlexInvalidSection, PlexNoMatchingResults, PlexAlbumNotFound, PlexBusy, PlexUnavailable)):
+            msg = err
+        elif isinstance(err, (AdminInvalidExtension, AdminReloadFailed)):
             msg = err
         else:
             msg = f"Congratulations, you've raised an exception {ctx.author.mention}"
-            logging.error(f"=> `{ctx.message.content}` from `{ctx.author.display_name}` raised an exception:")
-            logging.error(''.join(traceback.format_exception(type(err), err, err.__traceback__)))
+            # Logged once per kind of exception while it repeats (when Plex is down, every command fails the same way)
+            original = getattr(err, 'original', err)
+            logs.digest.report(original, f"=> `{ctx.message.content}` from `{ctx.author.display_name}` raised an exception",
+                               command=ctx.command.qualified_name if ctx.command else None, guild=getattr(ctx.guild, 'id', None), author=ctx.author.id)
 
+        tracing.finish(getattr(ctx, 'trace_span', None), error=type(err).__name__)
         await ctx.send(msg)
+
+def setup(bot):
+    """Loads the extension
+
+    Parameters
+        bot (commands.Bot) : Bot to add the cog to
+    """
+    bot.add_cog(CogErrHandler(bot))
@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+"""
+EDI frame cache to replay tracks without decoding them again
+"""
+#
+# Copyright (c) 2022, Marc GIANNETTI <mgtti.pro@gmail.com>
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+#  - Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+#
+#  - Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+#  - Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON
+# ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import tempfile
+import discord
+
+# Size of the frames of a track kept in memory before spilling them to a temporary file (in bytes)
+FRAME_CACHE_MEMORY = 16 * 1024 * 1024
+
+# Size of the frames of a track above which they are not kept at all (in bytes)
+FRAME_CACHE_MAX = 256 * 1024 * 1024
+
+# Size of a 20ms PCM frame (in bytes)
+FRAME_SIZE = discord.opus.Encoder.FRAME_SIZE
+
+class FrameCache:
+    """Decoded PCM frames of a track, kept to replay it without running ffmpeg again.
+    Frames are kept in memory up to FRAME_CACHE_MEMORY then in a temporary file,
+    recording stops above FRAME_CACHE_MAX
+
+    Attributes
+        frames (int) : Number of frames recorded
+        complete (bool) : True once the whole track is recorded
+        overflow (bool) : True if the track was too long to be recorded
+    """
+    def __init__(self):
+        """FrameCache init"""
+        self.file = tempfile.SpooledTemporaryFile(max_size=FRAME_CACHE_MEMORY)
+        self.frames = 0
+        self.complete = False
+        self.overflow = False
+
+    def __len__(self):
+        """Size of the recorded frames in bytes"""
+        return self.frames * FRAME_SIZE
+
+    def append(self, frame):
+        """Records a frame
+
+        Parameters
+            frame (bytes) : PCM frame
+        """
+        if self.overflow:
+            return
+        if len(self) + FRAME_SIZE > FRAME_CACHE_MAX:
+            self.overflow = True
+            self.file.close()
+            return
+
+        self.file.write(frame)
+        self.frames += 1
+
+    def replayable(self):
+        """Returns True if the whole track is recorded"""
+        return self.complete and not self.overflow
+
+    def close(self):
+        """Releases the recorded frames"""
+        self.file.close()
+
+class RecordingAudio(discord.AudioSource):
+    """PCM audio source recording the frames it reads into a frame cache
+
+    Attributes
+        original (discord.AudioSource) : Recorded PCM source
+        cache (FrameCache) : Cache to record to
+    """
+    def __init__(self, original, cache):
+        """RecordingAudio init"""
+        self.original = original
+        self.cache = cache
+
+    def read(self):
+        """Reads and records the next frame"""
+        frame = self.original.read()
+        if frame:
+            self.cache.append(frame)
+        else:
+            self.cache.complete = True
+        return frame
+
+    def cleanup(self):
+        """Releases the recorded source"""
+        self.original.cleanup()
+
+class CachedAudio(discord.AudioSource):
+    """PCM audio source replaying the frames of a complete frame cache
+
+    Attributes
+        cache (FrameCache) : Cache to replay
+        done (bool) : True once the cache is read to the end
+    """
+    def __init__(self, cache):
+        """CachedAudio init"""
+        self.cache = cache
+        self.pos = 0
+        self.done = False
+
+    def read(self):
+        """Reads the next frame"""
+        if self.pos >= self.cache.frames:
+            self.done = True
+            return b''
+
+        file = self.cache.file
+        file.seek(self.pos * FRAME_SIZE)
+        self.pos += 1
+        return file.read(FRAME_SIZE)
+
+    def cleanup(self):
+        """The frames belong to the cache"""
@@ -0,0 +1,353 @@
+# -*- coding: utf-8 -*-
+"""
+EDI Plex library cache and change notifications
+"""
+#
+# Copyright (c) 2022, Marc GIANNETTI <mgtti.pro@gmail.com>
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+#  - Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+#
+#  - Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+#  - Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON
+# ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+from collections import OrderedDict
+import importlib.util
+import datetime
+import asyncio
+import logging
+import time
+
+# Limits the number of cached Plex lookups
+CACHE_SIZE = 2048
+
+# Delay between two checks of the notification channel, and two delta polls while it is down (in seconds)
+POLL_INTERVAL = 300
+
+# First delay between two attempts to fetch the library sections while Plex is unreachable, doubled up to POLL_INTERVAL (in seconds)
+RETRY_DELAY = 5
+
+# Margin taken on delta polls for clock skew with the Plex server (in seconds)
+CLOCK_SKEW = 60
+
+# Plex metadata types and timeline states we care about
+TYPE_ALBUM = 9
+TYPE_TRACK = 10
+STATE_CREATED = 0
+STATE_PROCESSED = 5
+STATE_DELETED = 9
+
+class LibraryCache:
+    """Caches results of Plex lookups until the library changes.
+    Keys are the single-flight keys of CogPlexServer: ('list', section), ('search', section, keyword)
+    and ('album', section, keyword). Entries are indexed by section and by album ratingKey so that
+    library events can invalidate exactly what they affect
+
+    Attributes
+        size (int) : Maximum number of entries
+        generation (int) : Incremented on every invalidation
+        hits (int) : Number of lookups served from cache
+        misses (int) : Number of lookups not in cache
+        invalidations (int) : Number of entries invalidated
+    """
+    def __init__(self, size=CACHE_SIZE):
+        """LibraryCache init"""
+        self.size = size
+        self.entries = OrderedDict()
+        self.by_section = {}
+        self.by_album = {}
+        self.tracks = {}
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def __len__(self):
+        """Number of cached entries"""
+        return len(self.entries)
+
+    def get(self, key):
+        """Gets a cached result
+
+        Parameters
+            key (tuple) : Lookup key
+
+        Returns
+            The cached result if any else None
+        """
+        try:
+            value = self.entries[key][0]
+        except KeyError:
+            self.misses += 1
+            return None
+
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key, value, generation):
+        """Caches a result unless the library changed since the lookup started
+
+        Parameters
+            key (tuple) : Lookup key
+            value (object) : Result of the lookup (not cached if None)
+            generation (int) : Cache generation when the lookup started
+        """
+        if value is None or generation != self.generation:
+            return
+
+        album = None
+        if key[0] == 'album':
+            a, tracks = value
+            album = int(a.ratingKey)
+            self.by_album.setdefault(album, set()).add(key)
+            for track in tracks:
+                self.tracks[int(track.ratingKey)] = album
+
+        self.entries[key] = (value, album)
+        self.by_section.setdefault(key[1], set()).add(key)
+        while len(self.entries) > self.size:
+            self.discard(next(iter(self.entries)))
+
+    def discard(self, key):
+        """Removes an entry and its indexes
+
+        Parameters
+            key (tuple) : Lookup key
+        """
+        try:
+            value, album = self.entries.pop(key)
+        except KeyError:
+            return
+
+        self.invalidations += 1
+        self.by_section.get(key[1], set()).discard(key)
+        if album is not None:
+            keys = self.by_album.get(album, set())
+            keys.discard(key)
+            if not keys:
+                self.by_album.pop(album, None)
+                for track in value[1]:
+                    self.tracks.pop(int(track.ratingKey), None)
+
+    def invalidate_item(self, rating_key):
+        """Invalidates lookups of an album, or of the album of a track
+
+        Parameters
+            rating_key (int|str) : ratingKey of the album or track
+
+        Returns
+            True if lookups were invalidated, False if the item is not cached (a new track for instance)
+        """
+        self.generation += 1
+        rating_key = int(rating_key)
+        album = rating_key if rating_key in self.by_album else self.tracks.get(rating_key)
+        keys = list(self.by_album.get(album, ()))
+        for key in keys:
+            self.discard(key)
+        return bool(keys)
+
+    def invalidate_section(self, section):
+        """Invalidates every lookup of a section
+
+        Parameters
+            section (str) : Title of the section
+        """
+        self.generation += 1
+        for key in list(self.by_section.get(section, ())):
+            self.discard(key)
+
+    def clear(self):
+        """Invalidates everything"""
+        self.generation += 1
+        for key in list(self.entries):
+            self.discard(key)
+
+class LibraryWatcher:
+    """Keeps the library cache up to date.
+    Library events are pushed by the Plex notification websocket (needs websocket-client).
+    While the websocket is down, changes are found by cheap delta polls of items updated since the last check
+
+    Attributes
+        bot (commands.Bot) : Bot holding the Plex server
+        cache (LibraryCache) : Cache to invalidate
+        sections (dict) : Section titles by section ID
+        listener (plexapi.alert.AlertListener) : Notification listener if any
+        events (int) : Number of library events received
+        polls (int) : Number of delta polls made
+    """
+    def __init__(self, bot, cache):
+        """LibraryWatcher init"""
+        self.bot = bot
+        self.cache = cache
+        self.sections = {}
+        self.listener = None
+        self.events = 0
+        self.polls = 0
+        self.since = None
+        self.task = None
+        self.loop = None
+
+    def start(self):
+        """Starts watching the library in the background"""
+        self.task = self.bot.loop.create_task(self.run())
+
+    def stop(self):
+        """Stops watching the library"""
+        if self.task is not None:
+            self.task.cancel()
+        if self.listener is not None:
+            self.listener.stop()
+            self.listener = None
+
+    def listening(self):
+        """Returns True if the notification websocket is up"""
+        return self.listener is not None and self.listener.is_alive()
+
+    def listen(self):
+        """Connects to the notification websocket if websocket-client is installed (blocking)"""
+        from plexapi.alert import AlertListener
+
+        if importlib.util.find_spec('websocket') is None:
+            return
+
+        try:
+            self.listener = AlertListener(self.bot.plex, self.on_alert, self.on_error)
+            self.listener.daemon = True
+            self.listener.start()
+        except Exception as exc:
+            self.listener = None
+            logging.warning(f"Can not listen to Plex notifications: {exc}")
+
+    async def run(self):
+        """Watches the library until stopped"""
+        self.loop = asyncio.get_running_loop()
+        await self.bot.wait_until_ready()
+
+        # Plex may be unreachable when the bot starts
+        delay = RETRY_DELAY
+        while True:
+            try:
+                self.sections = await self.loop.run_in_executor(None, self.fetch_sections)
+                break
+            except Exception as exc:
+                logging.warning(f"Can not fetch Plex library sections, retrying in {delay}s: {exc}")
+                await asyncio.sleep(delay)
+                delay = min(2 * delay, POLL_INTERVAL)
+        self.since = time.time()
+        await self.loop.run_in_executor(None, self.listen)
+        if not self.listening():
+            logging.info("Plex notifications unavailable, falling back to delta polling")
+
+        while True:
+            await asyncio.sleep(POLL_INTERVAL)
+
+            if self.listening():
+                self.since = time.time()
+                continue
+
+            # Notifications dropped: catch up on what changed meanwhile then reconnect
+            start = time.time()
+            try:
+                await self.loop.run_in_executor(None, self.poll)
+                self.since = start
+            except Exception as exc:
+                logging.warning(f"Plex delta poll failed: {exc}")
+            await self.loop.run_in_executor(None, self.listen)
+
+    def fetch_sections(self):
+        """Fetches section titles by section ID (blocking)"""
+        return {str(section.key): section.title for section in self.bot.plex.library.sections()}
+
+    def poll(self):
+        """Invalidates albums and tracks updated since the last check (blocking)"""
+        since = datetime.datetime.fromtimestamp(self.since - CLOCK_SKEW)
+        changes = []
+        for section in self.bot.plex.library.sections():
+            if section.title not in self.cache.by_section:
+                continue
+
+            albums = section.search(libtype='album', filters={'updatedAt>>': since})
+            tracks = section.search(libtype='track', filters={'updatedAt>>': since})
+            if albums or tracks:
+                changes.append((section.title, [a.ratingKey for a in albums] + [t.parentRatingKey for t in tracks]))
+
+        self.polls += 1
+        self.loop.call_soon_threadsafe(self.apply_changes, changes)
+
+    def apply_changes(self, changes):
+        """Invalidates polled changes
+
+        Parameters
+            changes (list) : List of (section title, list of album ratingKeys) tuples
+        """
+        for section, albums in changes:
+            self.cache.invalidate_section(section)
+            for album in albums:
+                self.cache.invalidate_item(album)
+
+    def on_alert(self, data):
+        """Called by the listener thread for each notification
+
+        Parameters
+            data (dict) : Notification
+        """
+        if data.get('type') != 'timeline':
+            return
+
+        entries = [entry for entry in data.get('TimelineEntry', [])
+                   if entry.get('identifier') == 'com.plexapp.plugins.library']
+        if entries:
+            self.loop.call_soon_threadsafe(self.apply_events, entries)
+
+    def on_error(self, err):
+        """Called by the listener thread on websocket errors
+
+        Parameters
+            err (Exception) : Error raised
+        """
+        logging.warning(f"Plex notifications error: {err}")
+
+    def apply_events(self, entries):
+        """Invalidates what library timeline events affect
+
+        Parameters
+            entries (list) : Timeline entries
+        """
+        for entry in entries:
+            kind = int(entry.get('type', 0))
+            state = int(entry.get('state', -1))
+            if kind not in (TYPE_ALBUM, TYPE_TRACK) or state not in (STATE_CREATED, STATE_PROCESSED, STATE_DELETED):
+                continue
+
+            self.events += 1
+            invalidated = self.cache.invalidate_item(entry['itemID']) if entry.get('itemID') else False
+
+            # A new, retagged or deleted album changes lists and searches of its section,
+            # and a track that is not cached may be new to a cached album (timeline entries do not name its album)
+            if kind == TYPE_ALBUM or not invalidated:
+                section = self.sections.get(str(entry.get('sectionID')))
+                if section is not None:
+                    self.cache.invalidate_section(section)
+                else:
+                    self.cache.clear()
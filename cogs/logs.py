@@ -0,0 +1,195 @@
+# -*- coding: utf-8 -*-
+"""
+EDI logging pipeline
+"""
+#
+# Copyright (c) 2022, Marc GIANNETTI <mgtti.pro@gmail.com>
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+#  - Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+#
+#  - Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+#  - Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON
+# ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+import datetime
+import logging
+import asyncio
+import queue
+import json
+import os
+
+# File logs are written to as JSON lines, rotated past LOG_FILE_SIZE bytes with LOG_FILE_COUNT backups
+LOG_FILE = os.path.join(os.path.expanduser('~'), '.cache', 'edi', 'edi.log.jsonl')
+LOG_FILE_SIZE = 10 * 1024 * 1024
+LOG_FILE_COUNT = 5
+
+# Format of the console output
+LOG_FORMAT = "[%(asctime)s] (%(levelname)s) %(message)s"
+
+# Delay between two summaries of repeated exceptions (in seconds)
+LOG_SUMMARY_INTERVAL = 60
+
+# Attributes every log record has, the others are structured fields given with extra=
+RECORD_ATTRIBUTES = set(vars(logging.makeLogRecord({}))) | {'message', 'asctime'}
+
+class JsonFormatter(logging.Formatter):
+    """Formats records as JSON lines, with their structured fields"""
+    def format(self, record):
+        """Formats a record
+
+        Parameters
+            record (logging.LogRecord) : Record to format
+
+        Returns
+            The record as a JSON str
+        """
+        entry = {
+            'time': datetime.datetime.fromtimestamp(record.created, datetime.timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        entry.update((key, value) for key, value in vars(record).items() if key not in RECORD_ATTRIBUTES)
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+class DeferredQueueHandler(QueueHandler):
+    """Queues records for the listener thread without formatting them.
+    The message is merged with its arguments on the spot (they may change afterwards)
+    but tracebacks are formatted by the listener, off the event loop"""
+    def prepare(self, record):
+        """Prepares a record for queuing
+
+        Parameters
+            record (logging.LogRecord) : Record to queue
+
+        Returns
+            The record to queue
+        """
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+def configure(path=LOG_FILE, level=logging.INFO):
+    """Routes every log record through a queue to a background thread writing
+    them to the console and, as JSON lines, to a rotating file
+
+    Parameters
+        path (str) [optional] : Path of the log file, None to only log to the console
+        level (int) [optional] : Minimum level logged
+
+    Returns
+        The started logging.handlers.QueueListener, to stop when the bot exits
+    """
+    console = logging.StreamHandler()
+    console.setFormatter(logging.Formatter(LOG_FORMAT))
+    handlers = [console]
+    if path:
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        file = RotatingFileHandler(path, maxBytes=LOG_FILE_SIZE, backupCount=LOG_FILE_COUNT, encoding='utf-8', delay=True)
+        file.setFormatter(JsonFormatter())
+        handlers.append(file)
+
+    records = queue.SimpleQueue()
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.addHandler(DeferredQueueHandler(records))
+    root.setLevel(level)
+
+    listener = QueueListener(records, *handlers, respect_handler_level=True)
+    listener.start()
+    return listener
+
+def signature(err):
+    """Gets the signature of an exception: its type and the place it was raised from
+
+    Parameters
+        err (BaseException) : Exception raised
+
+    Returns
+        The signature as a str
+    """
+    tb = err.__traceback__
+    if tb is None:
+        return type(err).__qualname__
+    while tb.tb_next is not None:
+        tb = tb.tb_next
+    code = tb.tb_frame.f_code
+    return f"{type(err).__qualname__} at {os.path.basename(code.co_filename)}:{tb.tb_lineno} in {code.co_name}"
+
+class ExceptionDigest:
+    """Logs the traceback of an exception once, then only counts it while it repeats.
+    Counts are logged in a summary every LOG_SUMMARY_INTERVAL seconds, and an exception
+    that did not repeat over an interval is logged in full again the next time
+
+    Attributes
+        counts (dict) : Repeats since the last summary by exception signature
+        reported (int) : Number of exceptions reported
+        logged (int) : Number of tracebacks logged
+    """
+    def __init__(self):
+        """ExceptionDigest init"""
+        self.counts = {}
+        self.reported = 0
+        self.logged = 0
+        self.handle = None
+
+    def report(self, err, msg, **fields):
+        """Reports an exception
+
+        Parameters
+            err (BaseException) : Exception raised
+            msg (str) : Message logged with the traceback
+            fields (dict) : Structured fields of the record
+        """
+        self.reported += 1
+        if self.handle is None:
+            self.handle = asyncio.get_event_loop().call_later(LOG_SUMMARY_INTERVAL, self.summarize)
+
+        sig = signature(err)
+        if sig in self.counts:
+            self.counts[sig] += 1
+            return
+
+        self.counts[sig] = 0
+        self.logged += 1
+        logging.error(msg, exc_info=(type(err), err, err.__traceback__), extra=dict(fields, signature=sig))
+
+    def summarize(self):
+        """Logs the exceptions repeated since the last summary"""
+        self.handle = None
+        for sig, count in list(self.counts.items()):
+            if not count:
+                del self.counts[sig]
+                continue
+            logging.warning(f"{sig} repeated {count} times in the last {LOG_SUMMARY_INTERVAL}s", extra={'signature': sig, 'count': count})
+            self.counts[sig] = 0
+
+        if self.counts:
+            self.handle = asyncio.get_event_loop().call_later(LOG_SUMMARY_INTERVAL, self.summarize)
+
+# Exceptions raised by commands (kept here so that counts survive a reload of the error handler)
+digest = ExceptionDigest()
@@ -0,0 +1,217 @@
+# -*- coding: utf-8 -*-
+"""
+EDI loudness normalization of tracks
+"""
+#
+# Copyright (c) 2022, Marc GIANNETTI <mgtti.pro@gmail.com>
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+#  - Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+#
+#  - Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+#  - Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON
+# ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+from concurrent.futures import ProcessPoolExecutor
+import subprocess
+import asyncio
+import logging
+import json
+import os
+import re
+
+# Loudness tracks are normalized to (in LUFS, ReplayGain 2.0 reference level)
+LOUDNESS_TARGET = -18.0
+
+# Limits the gain applied to quiet tracks, to avoid amplifying noise and clipping (in dB)
+LOUDNESS_MAX_GAIN = 9.0
+
+# Highest true peak of normalized tracks, gains are reduced so that they do not clip (in dBTP)
+LOUDNESS_MAX_PEAK = -1.0
+
+# Number of processes analyzing tracks
+LOUDNESS_WORKERS = 2
+
+# File caching the loudness of analyzed tracks
+LOUDNESS_CACHE = os.path.join(os.path.expanduser('~'), '.cache', 'edi', 'loudness.json')
+
+# Integrated loudness in the summary of ffmpeg's ebur128 filter
+INTEGRATED_REGEX = re.compile(r'I:\s+(-?[\d.]+|-inf) LUFS')
+
+# True peak in the summary of ffmpeg's ebur128 filter
+PEAK_REGEX = re.compile(r'Peak:\s+(-?[\d.]+|-inf) dBFS')
+
+def measure_loudness(path):
+    """Measures the integrated loudness and the true peak of a track with ffmpeg (EBU R128, runs in a worker process)
+
+    Parameters
+        path (str) : Path to the track
+
+    Returns
+        A tuple composed of the integrated loudness in LUFS and the true peak in dBTP as floats if measured else None
+    """
+    try:
+        proc = subprocess.run(['ffmpeg', '-hide_banner', '-nostats', '-i', path, '-vn', '-sn', '-dn',
+                               '-af', 'ebur128=framelog=quiet:peak=true', '-f', 'null', '-'],
+                              stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True, errors='replace')
+    except OSError:
+        return None
+
+    # The first match is the threshold of the momentary loudness, the summary comes last
+    matches = INTEGRATED_REGEX.findall(proc.stderr)
+    peaks = PEAK_REGEX.findall(proc.stderr)
+    if proc.returncode != 0 or not matches or matches[-1] == '-inf' or not peaks:
+        return None
+    return (float(matches[-1]), float(peaks[-1]))
+
+class Loudness:
+    """Analyzes the loudness of queued tracks in the background, in a process pool.
+    Results are cached by path and mtime, and gains are applied by ffmpeg when tracks are decoded
+
+    Attributes
+        path (str) : Path to the cache file
+        cache (dict) : (mtime, loudness, peak) tuples by track path
+        analyzed (int) : Number of tracks analyzed
+        hits (int) : Number of tracks found in cache
+        failed (int) : Number of tracks that could not be analyzed
+    """
+    def __init__(self, loop, path=LOUDNESS_CACHE):
+        """Loudness init"""
+        self.loop = loop
+        self.path = path
+        self.cache = None
+        self.pool = None
+        self.tasks = set()
+        self.lock = asyncio.Lock()
+        self.running = 0
+        self.analyzed = 0
+        self.hits = 0
+        self.failed = 0
+
+    @staticmethod
+    def gain(loudness, peak):
+        """Gets the gain normalizing a loudness without clipping
+
+        Parameters
+            loudness (float) : Integrated loudness in LUFS
+            peak (float) : True peak in dBTP
+
+        Returns
+            Gain in dB as a float
+        """
+        return min(LOUDNESS_MAX_GAIN, LOUDNESS_TARGET - loudness, LOUDNESS_MAX_PEAK - peak)
+
+    def analyze(self, tracks):
+        """Sets the gain of tracks in the background, analyzing them if needed
+
+        Parameters
+            tracks (list) : QueuedTrack objects to analyze
+        """
+        task = self.loop.create_task(self.run(tracks))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def run(self, tracks):
+        """Sets the gain of tracks, analyzing them in queue order if needed
+
+        Parameters
+            tracks (list) : QueuedTrack objects to analyze
+        """
+        # Loaded once, concurrent runs would otherwise replace the entries analyzed meanwhile
+        async with self.lock:
+            if self.cache is None:
+                self.cache = await self.loop.run_in_executor(None, self.load)
+
+        misses = []
+        for track in tracks:
+            try:
+                mtime = await self.loop.run_in_executor(None, os.path.getmtime, track.path)
+            except OSError:
+                continue
+
+            # Entries cached before true peaks were measured are analyzed again
+            cached = self.cache.get(track.path)
+            if cached is not None and cached[0] == mtime and len(cached) == 3:
+                self.hits += 1
+                track.gain = self.gain(cached[1], cached[2])
+            else:
+                misses.append((track, mtime))
+
+        if not misses:
+            return
+
+        # Worker processes only live while tracks are analyzed
+        if self.pool is None:
+            self.pool = ProcessPoolExecutor(max_workers=LOUDNESS_WORKERS)
+        self.running += 1
+        try:
+            futures = [asyncio.wrap_future(self.pool.submit(measure_loudness, track.path)) for track, _ in misses]
+            for (track, mtime), future in zip(misses, futures):
+                measure = await future
+                if measure is None:
+                    self.failed += 1
+                    continue
+                self.analyzed += 1
+                self.cache[track.path] = (mtime, *measure)
+                track.gain = self.gain(*measure)
+        finally:
+            self.running -= 1
+            if not self.running and self.pool is not None:
+                self.pool.shutdown(wait=False)
+                self.pool = None
+
+        async with self.lock:
+            await self.loop.run_in_executor(None, self.save, dict(self.cache))
+
+    def load(self):
+        """Loads the cache file (blocking)
+
+        Returns
+            A dict of (mtime, loudness, peak) tuples by track path
+        """
+        try:
+            with open(self.path) as f:
+                return {path: tuple(entry) for path, entry in json.load(f).items()}
+        except (OSError, ValueError):
+            return {}
+
+    def save(self, cache):
+        """Saves the cache file (blocking)
+
+        Parameters
+            cache (dict) : (mtime, loudness, peak) tuples by track path
+        """
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(self.path + '.tmp', 'w') as f:
+                json.dump(cache, f)
+            os.replace(self.path + '.tmp', self.path)
+        except OSError as exc:
+            logging.warning(f"Can not save loudness cache: {exc}")
+
+    def stop(self):
+        """Stops analyzing tracks"""
+        for task in list(self.tasks):
+            task.cancel()
+        if self.pool is not None:
+            self.pool.shutdown(wait=False, cancel_futures=True)
+            self.pool = None
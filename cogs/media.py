@@ -0,0 +1,268 @@
+# -*- coding: utf-8 -*-
+"""
+EDI index of the album directories of the mounted partitions
+"""
+#
+# Copyright (c) 2022, Marc GIANNETTI <mgtti.pro@gmail.com>
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+#  - Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+#
+#  - Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+#  - Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON
+# ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import threading
+import asyncio
+import logging
+import os
+
+try:
+    from watchdog.observers import Observer
+    from watchdog.events import FileSystemEventHandler
+except ImportError:
+    Observer = None
+    FileSystemEventHandler = object
+
+# Delay between two full rescans of the partitions when they can not be watched, and when they are (in seconds)
+# Watched partitions are still rescanned as network shares often do not notify every change
+RESCAN_INTERVAL = 600
+WATCHED_RESCAN_INTERVAL = 6 * 3600
+
+# Extensions of the audio files indexed as tracks
+AUDIO_EXTENSIONS = ('.mp3', '.flac', '.m4a', '.ogg', '.opus', '.wav', '.aac', '.wma', '.alac', '.aiff')
+
+def dir_key(path):
+    """Normalizes a directory path to an index key
+
+    Parameters
+        path (str) : Path to the directory
+
+    Returns
+        Normalized path as a str
+    """
+    return os.path.normcase(os.path.normpath(path))
+
+class AlbumDir:
+    """Indexed album directory
+
+    Attributes
+        cover (str) : Path to the album cover if exists else None
+        tracks (tuple) : Names of the audio files of the album
+    """
+    __slots__ = ('cover', 'tracks')
+
+    def __init__(self, cover, tracks):
+        """AlbumDir init"""
+        self.cover = cover
+        self.tracks = tracks
+
+def scan_dir(path):
+    """Scans an album directory
+
+    Parameters
+        path (str) : Path to the directory
+
+    Returns
+        An AlbumDir object, or None if the directory does not exist or can not be read
+    """
+    cover = None
+    tracks = []
+    try:
+        with os.scandir(path) as it:
+            for entry in it:
+                name = entry.name
+                lower = name.lower()
+                # We search a file named 'cover' in the album directory
+                if cover is None and 'cover' in lower:
+                    cover = path + '/' + name
+                elif lower.endswith(AUDIO_EXTENSIONS):
+                    tracks.append(name)
+    except OSError:
+        # Missing, or unreadable (permissions, share gone): not indexed
+        return None
+
+    return AlbumDir(cover, tuple(sorted(tracks)))
+
+class MediaIndexHandler(FileSystemEventHandler):
+    """Updates the media index from filesystem events (watchdog observer thread)"""
+    def __init__(self, index):
+        """MediaIndexHandler init"""
+        self.index = index
+
+    def on_any_event(self, event):
+        """Rescans the directories affected by an event
+
+        Parameters
+            event (watchdog.events.FileSystemEvent) : Filesystem event
+        """
+        for path in (event.src_path, getattr(event, 'dest_path', None)):
+            if not path:
+                continue
+            if event.is_directory:
+                self.index.rescan(path)
+            self.index.rescan(os.path.dirname(path))
+
+class MediaIndex:
+    """In-memory index of the album directories of the mounted partitions.
+    The index is built once in the background then kept current with filesystem
+    notifications (watchdog: inotify, FSEvents or ReadDirectoryChangesW) when available,
+    and with periodic rescans (network shares often do not notify changes).
+    The index is updated from the watchdog observer thread, executor threads and the event loop, under a lock
+
+    Attributes
+        roots (list) : Root directories of the mounted partitions
+        dirs (dict) : AlbumDir objects by normalized directory path
+        ready (bool) : True once the index is built
+        hits (int) : Number of lookups served by the index
+        misses (int) : Number of lookups that had to scan the directory
+    """
+    def __init__(self, roots):
+        """MediaIndex init"""
+        self.roots = [root.rstrip('/\\') + '/' for root in roots]
+        self.dirs = {}
+        self.ready = False
+        self.hits = 0
+        self.misses = 0
+        self.observer = None
+        self.task = None
+        self.lock = threading.Lock()
+        self.pending = None
+
+    def __len__(self):
+        """Number of indexed directories"""
+        return len(self.dirs)
+
+    def start(self, loop):
+        """Builds the index and watches the partitions in the background
+
+        Parameters
+            loop (asyncio.AbstractEventLoop) : Event loop to run on
+        """
+        self.task = loop.create_task(self.run())
+
+    def stop(self):
+        """Stops watching the partitions"""
+        if self.task is not None:
+            self.task.cancel()
+        if self.observer is not None:
+            self.observer.stop()
+            self.observer = None
+
+    async def run(self):
+        """Builds then maintains the index until stopped"""
+        loop = asyncio.get_running_loop()
+        watched = self.watch()
+        await loop.run_in_executor(None, self.build)
+        self.ready = True
+        logging.info(f"Media index built: {len(self.dirs)} directories ({'watched' if watched else 'rescanned'})")
+
+        while True:
+            await asyncio.sleep(WATCHED_RESCAN_INTERVAL if watched else RESCAN_INTERVAL)
+            await loop.run_in_executor(None, self.build)
+
+    def watch(self):
+        """Watches the partitions for changes
+
+        Returns
+            True if every partition is watched
+        """
+        if Observer is None:
+            logging.warning("watchdog is not installed, the media partitions are rescanned instead of watched")
+            return False
+
+        self.observer = Observer()
+        self.observer.daemon = True
+        handler = MediaIndexHandler(self)
+        try:
+            for root in self.roots:
+                self.observer.schedule(handler, root, recursive=True)
+            self.observer.start()
+        except (OSError, RuntimeError) as exc:
+            logging.warning(f"Can not watch media partitions ({exc}), falling back to rescans")
+            self.observer = None
+            return False
+
+        return True
+
+    def build(self):
+        """Scans every partition (blocking).
+        Directories rescanned meanwhile may have been walked before they changed, they are scanned again once built
+        """
+        with self.lock:
+            self.pending = set()
+
+        dirs = {}
+        for root in self.roots:
+            for path, _, files in os.walk(root):
+                if not files:
+                    continue
+                album = scan_dir(path.replace('\\', '/').rstrip('/'))
+                if album is not None:
+                    dirs[dir_key(path)] = album
+
+        with self.lock:
+            self.dirs = dirs
+            pending, self.pending = self.pending, None
+        for path in pending:
+            self.rescan(path)
+
+    def rescan(self, path):
+        """Rescans one directory (blocking)
+
+        Parameters
+            path (str) : Path to the directory
+        """
+        album = scan_dir(path)
+        key = dir_key(path)
+        with self.lock:
+            if self.pending is not None:
+                self.pending.add(path)
+            if album is None:
+                self.dirs.pop(key, None)
+                prefix = key + os.sep
+                for sub in [k for k in self.dirs if k.startswith(prefix)]:
+                    self.dirs.pop(sub, None)
+            else:
+                self.dirs[key] = album
+
+    async def lookup(self, path):
+        """Gets an album directory, scanning it in an executor if it is not indexed yet
+
+        Parameters
+            path (str) : Path to the album directory
+
+        Returns
+            An AlbumDir object, or None if the directory does not exist
+        """
+        try:
+            album = self.dirs[dir_key(path)]
+            self.hits += 1
+            return album
+        except KeyError:
+            self.misses += 1
+
+        album = await asyncio.get_running_loop().run_in_executor(None, scan_dir, path)
+        if album is not None:
+            with self.lock:
+                self.dirs[dir_key(path)] = album
+        return album
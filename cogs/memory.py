@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+"""
+EDI memory usage of the caches
+"""
+#
+# Copyright (c) 2022, Marc GIANNETTI <mgtti.pro@gmail.com>
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+#  - Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+#
+#  - Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+#  - Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON
+# ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+from collections import deque
+import itertools
+import types
+import sys
+import os
+
+try:
+    import resource
+except ImportError: # Windows
+    resource = None
+
+# Number of entries measured to estimate the memory held by a cache
+SIZE_SAMPLE = 32
+
+# Limits the depth of the references followed when measuring an entry
+SIZE_DEPTH = 6
+
+# Objects never measured as part of an entry (code, and objects shared by the whole process)
+OPAQUE_TYPES = (type, types.ModuleType, types.FunctionType, types.BuiltinFunctionType, types.MethodType, types.CodeType)
+
+def deep_size(obj, seen, depth=SIZE_DEPTH):
+    """Measures an object and the objects it references that were not measured yet
+
+    Parameters
+        obj (object) : Object to measure
+        seen (set) : IDs of the objects already measured or shared, updated
+        depth (int) [optional] : Depth of the references followed
+
+    Returns
+        Size in bytes as an int
+    """
+    if id(obj) in seen or isinstance(obj, OPAQUE_TYPES):
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj, 0)
+    if depth == 0 or isinstance(obj, (str, bytes, int, float)):
+        return size
+
+    depth -= 1
+    if isinstance(obj, dict):
+        size += sum(deep_size(k, seen, depth) + deep_size(v, seen, depth) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset, deque)):
+        size += sum(deep_size(item, seen, depth) for item in obj)
+
+    if hasattr(obj, '__dict__'):
+        size += deep_size(vars(obj), seen, depth)
+    for cls in type(obj).__mro__:
+        for name in getattr(cls, '__slots__', ()):
+            if isinstance(name, str) and name not in ('__dict__', '__weakref__'):
+                size += deep_size(getattr(obj, name, None), seen, depth)
+    return size
+
+def estimate(entries, shared):
+    """Estimates the memory held by the entries of a cache by measuring a sample of them
+
+    Parameters
+        entries (collections.abc.Collection) : Entries of the cache
+        shared (set) : IDs of the objects shared by every entry (bot, connection state, guilds), not counted
+
+    Returns
+        Estimated size in bytes as an int
+    """
+    count = len(entries)
+    if not count:
+        return 0
+
+    step = max(1, count // SIZE_SAMPLE)
+    sample = list(itertools.islice(entries, 0, None, step))[:SIZE_SAMPLE]
+    seen = set(shared)
+    size = sum(deep_size(entry, seen) for entry in sample)
+    return size * count // len(sample)
+
+def current_rss():
+    """Gets the current resident set size of the process
+
+    Returns
+        RSS in bytes as an int if available else None
+    """
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except OSError:
+        pass
+
+    if resource is None:
+        return None
+    # Peak RSS where the current one is not exposed
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == 'darwin' else rss * 1024
+
+def discord_caches(bot):
+    """Gets the caches of the Discord connection
+
+    Parameters
+        bot (commands.Bot) : Bot connected to Discord
+
+    Returns
+        A dict of cache entries by cache name
+    """
+    guilds = bot.guilds
+    return {
+        'channels': [channel for guild in guilds for channel in guild.channels],
+        'members': [member for guild in guilds for member in guild.members],
+        'users': bot.users,
+        'messages': bot.cached_messages,
+        'emojis': bot.emojis,
+    }
+
+def report(bot):
+    """Estimates the memory held by the Discord caches and the caches of the loaded cogs.
+    Cogs expose their caches with a caches() method returning a dict of cache entries by name
+
+    Parameters
+        bot (commands.Bot) : Bot to inspect
+
+    Returns
+        A list of (cache name, number of entries, estimated size in bytes) tuples
+    """
+    shared = {id(bot), id(bot.loop)}
+    shared.update(id(guild) for guild in bot.guilds)
+    shared.update(id(cog) for cog in bot.cogs.values())
+    # The Plex servers are read without connecting them (see EDI.plex)
+    for name in ('_connection', 'plex_backends'):
+        if name in vars(bot):
+            shared.add(id(vars(bot)[name]))
+    backends = getattr(bot, 'plex_backends', None)
+    if backends is not None:
+        shared.update(id(value) for backend in backends.backends for value in vars(backend).values())
+
+    caches = [('discord', discord_caches(bot))]
+    for cog in bot.cogs.values():
+        if hasattr(cog, 'caches'):
+            caches.append((type(cog).__module__.rsplit('.', 1)[-1], cog.caches()))
+
+    return [(f'{owner}.{name}', len(entries), estimate(entries, shared))
+            for owner, named in caches for name, entries in named.items()]
@@ -0,0 +1,285 @@
+# -*- coding: utf-8 -*-
+"""
+EDI outbound message pipeline
+"""
+#
+# Copyright (c) 2022, Marc GIANNETTI <mgtti.pro@gmail.com>
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+#  - Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+#
+#  - Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+#  - Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON
+# ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+from collections import OrderedDict, deque
+import itertools
+from . import tracing
+import datetime
+import asyncio
+import logging
+import time
+
+# Messages a channel accepts in a row, and the window they are refilled in (Discord per-channel bucket, in seconds)
+OUTBOX_BURST = 5
+OUTBOX_WINDOW = 5
+
+# Age past which a status message is sent again rather than edited in place (in seconds)
+OUTBOX_EDIT_WINDOW = 300
+
+# Number of latency samples kept for statistics
+LATENCY_SAMPLES = 1000
+
+def summarize(samples):
+    """Summarizes latency samples
+
+    Parameters
+        samples (collections.deque) : Latencies in seconds
+
+    Returns
+        A tuple of (p50, p95) latencies in ms, or None if there is no sample
+    """
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    return tuple(round(ordered[min(len(ordered) - 1, int(p * len(ordered)))] * 1000) for p in (.5, .95))
+
+class Post:
+    """Message waiting in a channel outbox
+
+    Attributes
+        content (str) : Content of the message
+        embed (discord.Embed) : Embed of the message
+        file (discord.File) : Attachment of the message
+        key (hashable) : Coalescing key, posts with the same key supersede each other
+        edit (bool) : True if the message may be edited in place of the previous one of the same key
+        queued (float) : Time the post was queued at (perf_counter)
+        created (datetime.datetime) : Creation time of the command message answered if any (UTC)
+        span (tracing.Span) : Span of the operation posting the message, held until it is sent
+    """
+    __slots__ = ('content', 'embed', 'file', 'key', 'edit', 'queued', 'created', 'span')
+
+    def __init__(self, content, embed, file, key, edit, created):
+        """Post init"""
+        self.content = content
+        self.embed = embed
+        self.file = file
+        self.key = key
+        self.edit = edit
+        self.queued = time.perf_counter()
+        self.created = created
+        self.span = tracing.hold()
+
+    def discard(self):
+        """Releases the attachment and the trace of a superseded or failed post"""
+        if self.file is not None:
+            self.file.close()
+        tracing.release(self.span)
+
+class Mailbox:
+    """Outbound queue of a channel, paced by a token bucket mirroring the Discord rate limit
+
+    Attributes
+        channel (discord.abc.Messageable) : Channel to send to
+        pending (OrderedDict) : Posts waiting to be sent by coalescing key
+        last (tuple) : (key, discord.Message, sent time) of the last message sent if any
+        task (asyncio.Task) : Worker sending the posts, None when the outbox is empty
+    """
+    def __init__(self, channel):
+        """Mailbox init"""
+        self.channel = channel
+        self.pending = OrderedDict()
+        self.tokens = OUTBOX_BURST
+        self.stamp = time.monotonic()
+        self.last = None
+        self.task = None
+
+    async def acquire(self):
+        """Waits for the channel rate limit to allow one more message"""
+        now = time.monotonic()
+        self.tokens = min(OUTBOX_BURST, self.tokens + (now - self.stamp) * OUTBOX_BURST / OUTBOX_WINDOW)
+        self.stamp = now
+        if self.tokens < 1:
+            await asyncio.sleep((1 - self.tokens) * OUTBOX_WINDOW / OUTBOX_BURST)
+            self.tokens = 1
+            self.stamp = time.monotonic()
+        self.tokens -= 1
+
+    def editable(self, post):
+        """Gets the message a post can be edited in place of
+
+        Parameters
+            post (Post) : Post to send
+
+        Returns
+            A discord.Message if the last message sent has the same key, is recent
+            and is still the last one of the channel, else None
+        """
+        if not post.edit or post.file is not None or self.last is None:
+            return None
+
+        key, message, sent = self.last
+        if key != post.key or time.monotonic() - sent > OUTBOX_EDIT_WINDOW:
+            return None
+        if getattr(self.channel, 'last_message_id', None) != message.id:
+            return None
+        return message
+
+class Outbox:
+    """Per-channel outbound message pipeline.
+    Messages are queued by channel and sent by one worker per channel, paced against the Discord
+    per-channel rate limit so that bursts never wait on 429 retries. While a message waits for
+    its turn, a newer one with the same coalescing key replaces it: only the latest now playing
+    goes out during skip spam. Status messages are edited in place while they are still the
+    last message of the channel
+
+    Attributes
+        loop (asyncio.AbstractEventLoop) : Event loop running the workers
+        mailboxes (dict) : Mailbox objects by channel ID
+        posted (int) : Number of messages queued
+        sent (int) : Number of messages sent
+        edited (int) : Number of messages edited in place
+        coalesced (int) : Number of messages superseded before being sent
+        failed (int) : Number of messages Discord refused
+        latency (collections.deque) : Latencies from command message to reply delivered (in seconds)
+        waits (collections.deque) : Latencies from queued to delivered (in seconds)
+    """
+    def __init__(self, loop):
+        """Outbox init"""
+        self.loop = loop
+        self.mailboxes = {}
+        self.unique = itertools.count()
+        self.posted = 0
+        self.sent = 0
+        self.edited = 0
+        self.coalesced = 0
+        self.failed = 0
+        self.latency = deque(maxlen=LATENCY_SAMPLES)
+        self.waits = deque(maxlen=LATENCY_SAMPLES)
+
+    def __len__(self):
+        """Number of messages waiting to be sent"""
+        return sum(len(mailbox.pending) for mailbox in self.mailboxes.values())
+
+    def post(self, channel, content=None, *, embed=None, file=None, key=None, edit=False, created=None):
+        """Queues a message
+
+        Parameters
+            channel (discord.abc.Messageable) : Channel to send to
+            content (str) [optional] : Content of the message
+            embed (discord.Embed) [optional] : Embed of the message
+            file (discord.File) [optional] : Attachment of the message
+            key (hashable) [optional] : Coalescing key, a pending message with the same key is replaced
+            edit (bool) [optional] : Edits the last message of the same key in place if possible
+            created (datetime.datetime) [optional] : Creation time of the command message answered (UTC)
+        """
+        self.posted += 1
+        if key is None:
+            key = ('unique', next(self.unique))
+        post = Post(content, embed, file, key, edit, created)
+
+        try:
+            mailbox = self.mailboxes[channel.id]
+        except KeyError:
+            mailbox = self.mailboxes[channel.id] = Mailbox(channel)
+
+        # A superseded post keeps its place in the queue with the newest content
+        previous = mailbox.pending.get(key)
+        if previous is not None:
+            previous.discard()
+            self.coalesced += 1
+        mailbox.pending[key] = post
+
+        if mailbox.task is None:
+            mailbox.task = self.loop.create_task(self.run(mailbox))
+
+    def reply(self, ctx, content=None, *, embed=None, file=None, key=None, edit=False):
+        """Queues a reply to a command
+
+        Parameters
+            ctx (commands.Context) : Invocation context
+            See post for the other parameters
+        """
+        self.post(ctx.channel, content, embed=embed, file=file, key=key, edit=edit,
+                  created=getattr(ctx.message, 'created_at', None))
+
+    async def run(self, mailbox):
+        """Sends the posts of a channel until its outbox is empty
+
+        Parameters
+            mailbox (Mailbox) : Outbox of the channel
+        """
+        try:
+            while mailbox.pending:
+                await mailbox.acquire()
+                _, post = mailbox.pending.popitem(last=False)
+                await self.deliver(mailbox, post)
+        finally:
+            mailbox.task = None
+            self.prune()
+
+    async def deliver(self, mailbox, post):
+        """Sends or edits one message
+
+        Parameters
+            mailbox (Mailbox) : Outbox of the channel
+            post (Post) : Message to send
+        """
+        try:
+            with tracing.span('discord.reply', parent=post.span, key=post.key):
+                message = mailbox.editable(post)
+                if message is not None:
+                    await message.edit(content=post.content, embed=post.embed)
+                    self.edited += 1
+                else:
+                    message = await mailbox.channel.send(post.content, embed=post.embed, file=post.file)
+                    self.sent += 1
+        except Exception as exc:
+            post.discard()
+            self.failed += 1
+            logging.warning(f"Can not send message to channel {mailbox.channel.id}: {exc}")
+            return
+
+        tracing.release(post.span)
+        mailbox.last = (post.key, message, time.monotonic()) if message is not None else None
+
+        now = time.perf_counter()
+        self.waits.append(now - post.queued)
+        if post.created is not None:
+            self.latency.append((datetime.datetime.utcnow() - post.created).total_seconds())
+        else:
+            self.latency.append(now - post.queued)
+
+    def prune(self):
+        """Forgets idle channels whose last message can no longer be edited"""
+        now = time.monotonic()
+        for cid, mailbox in list(self.mailboxes.items()):
+            if mailbox.task is None and not mailbox.pending and (mailbox.last is None or now - mailbox.last[2] > OUTBOX_EDIT_WINDOW):
+                del self.mailboxes[cid]
+
+    async def join(self):
+        """Waits for every queued message to be sent"""
+        while True:
+            tasks = [mailbox.task for mailbox in self.mailboxes.values() if mailbox.task is not None]
+            if not tasks:
+                return
+            await asyncio.gather(*tasks, return_exceptions=True)
@@ -31,12 +31,25 @@ EDI Plex Server commands and listeners
 # (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
 # SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
+from collections import Counter, deque
 from datetime import datetime as dt
-from colorthief import ColorThief
 from discord.ext import commands
+from .library import LibraryCache, LibraryWatcher
+from .media import MediaIndex
+from .radio import RadioTicket
+from .staging import Stager
+from .loudness import Loudness
+from .backends import BackendsUnavailable
+from .catalog import Catalog, CatalogRefresher, CatalogTrack, relative_path
+from .embeds import EmbedCache, add_line_fields, truncate, EMBED_TITLE, EMBED_DESCRIPTION
+from . import tracing
+import itertools
+import weakref
 import platform
 import discord
-import plexapi
+import asyncio
+import heapq
+import time
 import os
 
 # Limits the number of results per page
@@ -48,6 +61,23 @@ NB_RESULTS_PER_SEARCH = 20
 # Limits the number of tracks per embed field
 NB_TRACKS_PER_EMBED_FIELD = 20
 
+# Limits the number of concurrent requests to the Plex server
+PLEX_MAX_CONCURRENCY = 4
+
+# Sustained rate (requests per second) and burst of Plex requests per guild
+PLEX_GUILD_RATE = 0.5
+PLEX_GUILD_BURST = 6
+
+# Limits the number of Plex requests waiting per guild
+PLEX_MAX_PENDING = 4
+
+# Share of the Plex server given to each class of requests
+# Interactive requests (search, info, play) go ahead of bulk scans (list)
+PLEX_WEIGHTS = {
+    'interactive' : 4,
+    'bulk'        : 1,
+}
+
 # Possible sections to choose from
 Sections = {
     'animes' : 'Animes Music',
@@ -89,38 +119,406 @@ def format_duration(duration):
     """
     return dt.fromtimestamp(duration/1000.0).strftime('%M:%S')
 
-class PlexSource(discord.PCMVolumeTransformer):
-    """Represents a Plex audio source
+def normalize(keyword):
+    """Normalizes a user keyword so that equivalent searches share the same key
+
+    Parameters
+        keyword (str) : Keyword to normalize
+
+    Returns
+        Normalized keyword as a str
+    """
+    return ' '.join(keyword.replace(',', '').casefold().split())
+
+class SingleFlight:
+    """Coalesces concurrent identical Plex requests.
+    The first request of a key runs the call, and identical requests made
+    while it is in flight await the same result instead of querying Plex again
 
     Attributes
-        source (discord.FFmpegPCMAudio) : Audio source
-        title (str) : Track title
-        album (str) : Album title
-        duration (int) : Audio duration in ms
-        requester (discord.User|discord.Member) : Requester
+        requests (int) : Number of requests made
+        coalesced (int) : Number of requests that joined an in-flight call
+    """
+    def __init__(self):
+        """SingleFlight init"""
+        self.inflight = {}
+        self.requests = 0
+        self.coalesced = 0
+
+    async def do(self, key, coro, *args):
+        """Runs a call once for all concurrent requests of the same key
+
+        Parameters
+            key (tuple) : Key identifying the request
+            coro (coroutine function) : Call to run
+            args (tuple) : Arguments of the call
+
+        Returns
+            The result of the call (shared between coalesced requests)
+        """
+        self.requests += 1
+        try:
+            future = self.inflight[key]
+            self.coalesced += 1
+        except KeyError:
+            future = asyncio.ensure_future(coro(*args))
+            self.inflight[key] = future
+            future.add_done_callback(lambda _: self.inflight.pop(key, None))
+
+        # A cancelled requester must not cancel the call of the others
+        return await asyncio.shield(future)
+
+class PlexScheduler:
+    """Schedules blocking Plex requests fairly between guilds.
+    Each guild has a token bucket limiting its request rate and the number of its pending requests.
+    At most a given number of requests run at once, the others wait in a weighted fair queue where
+    each (guild, class) flow gets a share of the Plex server proportional to the weight of its class
+
+    Attributes
+        concurrency (int) : Maximum number of concurrent requests
+        rate (float) : Sustained requests per second per guild
+        burst (int) : Maximum burst of requests per guild
+        max_pending (int) : Maximum number of waiting requests per guild
+        weights (dict) : Weight of each class of requests
+        rejected (int) : Number of requests rejected
+        waits (dict) : Recent queue-wait latencies by class in seconds
+    """
+    def __init__(self, concurrency=PLEX_MAX_CONCURRENCY, rate=PLEX_GUILD_RATE, burst=PLEX_GUILD_BURST,
+                 max_pending=PLEX_MAX_PENDING, weights=PLEX_WEIGHTS):
+        """PlexScheduler init"""
+        self.concurrency = concurrency
+        self.rate = rate
+        self.burst = burst
+        self.max_pending = max_pending
+        self.weights = weights
+        self.running = 0
+        self.rejected = 0
+        self.waits = {cls: deque(maxlen=256) for cls in weights}
+
+        self.heap = []
+        self.seq = itertools.count()
+        self.vtime = 0.0
+        self.finish = {}
+        self.buckets = {}
+        self.pending = Counter()
+
+    def admit(self, ctx, cls):
+        """Admits a request of a guild, consuming a token of its bucket
+
+        Parameters
+            ctx (commands.Context) : Invocation context
+            cls (str) : Class of the request (see PLEX_WEIGHTS)
+
+        Returns
+            A ticket to run the request with
+
+        Raises
+            PlexBusy if the guild exceeds its limits
+        """
+        guild = ctx.guild.id if ctx.guild is not None else ctx.author.id
+        now = time.monotonic()
+
+        if self.pending[guild] >= self.max_pending:
+            self.rejected += 1
+            raise PlexBusy(f"Too many Plex requests are pending for this server, please wait a moment {ctx.author.mention}")
+
+        tokens, stamp = self.buckets.get(guild, (self.burst, now))
+        tokens = min(self.burst, tokens + (now - stamp) * self.rate)
+        if tokens < 1:
+            self.buckets[guild] = (tokens, now)
+            self.rejected += 1
+            raise PlexBusy(f"Slow down {ctx.author.mention}, the Plex server can take a new request in {(1 - tokens) / self.rate:.0f}s")
+
+        self.buckets[guild] = (tokens - 1, now)
+        if len(self.buckets) > 1024:
+            self.prune(now)
+
+        return (guild, cls)
+
+    def prune(self, now):
+        """Forgets guilds with a full bucket and flows behind the virtual time
+
+        Parameters
+            now (float) : Current monotonic time
+        """
+        self.buckets = {g: (t, s) for g, (t, s) in self.buckets.items() if t + (now - s) * self.rate < self.burst}
+        self.finish = {flow: tag for flow, tag in self.finish.items() if tag > self.vtime}
+
+    async def run(self, ticket, func, *args):
+        """Runs a blocking request in an executor once the scheduler grants it a slot
+
+        Parameters
+            ticket (tuple) : Ticket given by admit
+            func (callable) : Blocking function to call
+            args (tuple) : Arguments of the function
+
+        Returns
+            The result of the call
+        """
+        guild, cls = ticket
+        start = time.monotonic()
+
+        if self.running < self.concurrency and not self.heap:
+            self.running += 1
+        else:
+            # Self-clocked fair queuing: a flow's requests are spaced by the inverse of its weight
+            tag = max(self.vtime, self.finish.get(ticket, 0.0)) + 1 / self.weights[cls]
+            self.finish[ticket] = tag
+            granted = asyncio.get_running_loop().create_future()
+            heapq.heappush(self.heap, (tag, next(self.seq), granted))
+            self.pending[guild] += 1
+            try:
+                await granted
+            except asyncio.CancelledError:
+                # The slot may have been handed over right before cancellation
+                if granted.done() and not granted.cancelled():
+                    self.release()
+                raise
+            finally:
+                self.pending[guild] -= 1
+                if not self.pending[guild]:
+                    del self.pending[guild]
+
+        self.waits[cls].append(time.monotonic() - start)
+        try:
+            return await asyncio.get_running_loop().run_in_executor(None, tracing.bind(func, *args))
+        finally:
+            self.release()
+
+    def release(self):
+        """Hands the slot of a finished request over to the next waiting one"""
+        while self.heap:
+            tag, _, granted = heapq.heappop(self.heap)
+            if not granted.done():
+                self.vtime = tag
+                granted.set_result(None)
+                return
+
+        self.running -= 1
+
+    def wait_stats(self, cls):
+        """Summarizes recent queue-wait latencies of a class
+
+        Parameters
+            cls (str) : Class of requests
+
+        Returns
+            A tuple (median, 95th percentile) in ms
+        """
+        waits = sorted(self.waits[cls])
+        if not waits:
+            return (0.0, 0.0)
+        return (waits[len(waits) // 2] * 1000, waits[min(len(waits) - 1, len(waits) * 95 // 100)] * 1000)
+
+class AlbumRecord:
+    """Album metadata shared by every queued track of an album
+
+    Attributes
+        title (str) : Album title
         thumb (str) : Path to the album thumbnail if exists
+        requester (str) : Display name of the requester
     """
-    def __init__(self, source, *, title, album, duration, requester, thumb=None):
-        """PlexSource init"""
-        super().__init__(source)
+    __slots__ = ('title', 'thumb', 'requester', '__weakref__')
+
+    def __init__(self, title, thumb, requester):
+        """AlbumRecord init"""
         self.title = title
-        self.album = album
-        self.duration = format_duration(duration)
-        self.requester = requester
         self.thumb = thumb
+        self.requester = requester
 
-    @classmethod
-    async def create_source(cls, ctx, section: str, path: str, thumb: str, track):
-        """Creates a Plex audio source
+class QueuedTrack:
+    """Compact record of a queued Plex track.
+    The audio source (and its ffmpeg process) is only created when the track is played
+
+    Attributes
+        title (str) : Track title
+        duration (int) : Audio duration in ms
+        path (str) : Path to the track
+        record (AlbumRecord) : Album of the track
+        stager (Stager) : Stager copying the track ahead of playback if any
+        gain (float) : Loudness normalization gain in dB once analyzed else None
+    """
+    __slots__ = ('title', 'duration', 'path', 'record', 'stager', 'gain')
+
+    # Decoded to PCM, so it can be crossfaded with the track before it
+    crossfades = True
+
+    def __init__(self, title, duration, path, record):
+        """QueuedTrack init"""
+        self.title = title
+        self.duration = duration
+        self.path = path
+        self.record = record
+        self.stager = None
+        self.gain = None
+
+    @property
+    def length(self):
+        """Formatted duration"""
+        return format_duration(self.duration)
+
+    @property
+    def album(self):
+        """Album title"""
+        return self.record.title
+
+    @property
+    def thumb(self):
+        """Path to the album thumbnail if exists"""
+        return self.record.thumb
+
+    @property
+    def requester(self):
+        """Display name of the requester"""
+        return self.record.requester
+
+    def create_source(self, volume=1.0):
+        """Creates the audio source of the track.
+        ffmpeg applies the loudness gain and the volume when decoding
 
         Parameters
-            ctx (commands.Context) : Invocation context
-            section (str) : Section of the album
-            path (str) : Path to the album
-            thumb (str) : Path to the album thumbnail
-            track (plexapi.audio.track) : Audio track
+            volume (float) [optional] : Volume of the player
+
+        Returns
+            A PlexSource object
+        """
+        path = self.stager.local_path(self) if self.stager is not None else None
+        level = volume if volume > 0 else 1.0
+        factor = level * 10 ** ((self.gain or 0.0) / 20)
+        with tracing.span('ffmpeg.spawn', path=path or self.path, staged=path is not None):
+            return PlexSource(discord.FFmpegPCMAudio(path or self.path, options=f'-vn -af volume={factor:.4f}'), self, level)
+
+    def cleanup(self):
+        """Releases the track once played or removed from the queue, evicting its staged copy.
+        Can be called from the audio thread, the copy is then evicted from the event loop
         """
-        return cls(discord.FFmpegPCMAudio(path), title=track.title, album=track.parentTitle, duration=track.duration, requester=ctx.author.display_name, thumb=thumb)
+        stager = self.stager
+        if stager is None:
+            return
+
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            loop = None
+        if loop is stager.loop:
+            stager.release(self)
+        else:
+            stager.loop.call_soon_threadsafe(stager.release, self)
+
+class PlexSource(discord.PCMVolumeTransformer):
+    """Represents a Plex audio source.
+    Frames go through a PCM processing stage (see dsp) for volume ramps, fades and crossfades
+
+    Attributes
+        source (discord.FFmpegPCMAudio) : Audio source
+        track (QueuedTrack) : Track played
+        level (float) : Volume applied by ffmpeg when decoding
+        stage (dsp.Processor) : PCM processing stage, scaling frames only if the volume changed since ffmpeg was started
+        tail (PlexSource) : Source fading out under this one during a crossfade if any else None
+        position (int) : Number of frames read
+    """
+    def __init__(self, source, track, level=1.0):
+        """PlexSource init"""
+        from .dsp import Processor
+        self.track = track
+        self.level = level
+        self.stage = Processor()
+        self.tail = None
+        self.cue = None
+        self.position = 0
+        super().__init__(source, volume=level)
+
+    @property
+    def volume(self):
+        """Volume of the source, as applied by ffmpeg then ramped to on each frame if changed since"""
+        return self.level * self.stage.target
+
+    @volume.setter
+    def volume(self, value):
+        self.stage.set_gain(max(value / self.level, 0.0))
+
+    @property
+    def remaining(self):
+        """Number of frames left to read, from the duration of the track"""
+        return (self.track.duration or 0) // 20 - self.position
+
+    @property
+    def fading_out(self):
+        """True while the source fades out before ending"""
+        return self.stage.fading_out
+
+    def fade_in(self, frames):
+        """Fades the source in
+
+        Parameters
+            frames (int) : Duration of the fade (in 20ms frames)
+        """
+        self.stage.fade_in(frames)
+
+    def fade_out(self, frames):
+        """Fades the source out, along with the source fading out under it, the source ends once faded
+
+        Parameters
+            frames (int) : Duration of the fade (in 20ms frames)
+        """
+        self.stage.fade_out(frames)
+        tail = self.tail
+        if tail is not None:
+            tail.fade_out(min(frames, tail.remaining))
+
+    def crossfade(self, tail, frames):
+        """Starts the source under the end of another one, fading it out while this one fades in
+
+        Parameters
+            tail (PlexSource) : Source ending, owned by this one from now on
+            frames (int) : Duration of the crossfade (in 20ms frames), shortened to the end of the other source
+        """
+        frames = max(1, min(frames, tail.remaining))
+        tail.stage.fade_out(frames)
+        self.stage.fade_in(frames)
+        self.tail = tail
+
+    def notify_end(self, frames, callback):
+        """Calls back once, from the audio thread, when the source gets within a number of frames of its end
+
+        Parameters
+            frames (int) : Number of frames before the end
+            callback (callable) : Function called without arguments
+        """
+        self.cue = (frames, callback)
+
+    def read(self):
+        """Reads the next frame, mixed with the source fading out under it if any"""
+        under = None
+        tail = self.tail
+        if tail is not None:
+            under = tail.read()
+            if not under:
+                self.tail = None
+                tail.cleanup()
+                tail.track.cleanup()
+
+        frame = self.original.read()
+        self.position += 1
+        cue = self.cue
+        if cue is not None and self.remaining <= cue[0]:
+            self.cue = None
+            cue[1]()
+        return self.stage.process(frame, under) if frame else frame
+
+    def cleanup(self):
+        """Releases the source, and the source fading out under it along with its track"""
+        tail, self.tail = self.tail, None
+        if tail is not None:
+            tail.cleanup()
+            tail.track.cleanup()
+        super().cleanup()
+
+    def __getattr__(self, name):
+        """Exposes the track metadata (title, duration, length, album, thumb, requester)"""
+        if name == 'track':
+            raise AttributeError(name)
+        return getattr(self.track, name)
 
 class PlexInvalidCommand(commands.CommandError):
     """Custom Exception class for Plex invalid command"""
@@ -137,24 +535,82 @@ class PlexNoMatchingResults(commands.CommandError):
 class PlexAlbumNotFound(commands.CommandError):
     """Custom Exception class for Plex album not found"""
 
+class PlexBusy(commands.CommandError):
+    """Custom Exception class for Plex requests rejected by the scheduler"""
+
+class PlexUnavailable(commands.CommandError):
+    """Custom Exception class for Plex requests no backend could serve"""
+
 class CogPlexServer(commands.Cog, name='Plex Server'):
     """All Plex Server commands and listeners
 
     Attributes
         See commands.Cog
+        partitions (dict) [optional] : Mounted partitions by section (Default depends on the OS)
+        albums (weakref.WeakValueDictionary) : Album records shared by queued tracks
+        stations (dict) : Radio stations by (section, album ratingKey)
+        stager (Stager) : Copies queued tracks locally ahead of playback
+        loudness (Loudness) : Analyzes the loudness of queued tracks
+        embeds (EmbedCache) : Rendered info and list embeds
+        catalog (Catalog) : Catalog snapshot serving lookups if enabled else None
+        refresher (CatalogRefresher) : Writes the catalog snapshot if this process refreshes it else None
     """
-    def __init__(self, bot):
+    def __init__(self, bot, partitions=None):
         """CogPlexServer init"""
         self.bot = bot
+        self.flights = SingleFlight()
+        self.scheduler = PlexScheduler()
+        self.cache = LibraryCache()
+        self.watcher = LibraryWatcher(bot, self.cache)
 
         os = platform.system()
-        if os == 'Windows':
+        if partitions is not None:
+            self.partitions = partitions
+        elif os == 'Windows':
             self.partitions = Win_Partitions
         elif os == 'Darwin':
             self.partitions = Mac_Partitions
         else:
             raise OSError('Only Windows and Mac OS are handled for Plex services')
 
+        self.index = MediaIndex(self.partitions.values())
+        self.albums = weakref.WeakValueDictionary()
+        self.stations = {}
+        self.stager = Stager(bot.loop)
+        self.loudness = Loudness(bot.loop)
+        self.embeds = EmbedCache()
+        self.catalog = Catalog(bot.catalog_path) if bot.catalog_path else None
+        self.refresher = CatalogRefresher(bot, bot.catalog_path, self.cache, Sections.values()) if self.catalog and bot.catalog_refresh else None
+        self.watcher.start()
+        self.index.start(bot.loop)
+        if self.refresher is not None:
+            self.refresher.start()
+
+    def cog_unload(self):
+        """Stops watching the library and partitions, staging and analyzing tracks, when the cog is removed"""
+        self.watcher.stop()
+        if self.refresher is not None:
+            self.refresher.stop()
+        self.index.stop()
+        self.stager.stop()
+        self.loudness.stop()
+
+    def caches(self):
+        """Gets the caches of the cog, for memory reports
+
+        Returns
+            A dict of cache entries by cache name
+        """
+        return {
+            'lookups': self.cache.entries.values(),
+            'embeds': self.embeds.entries.values(),
+            'index': self.index.dirs.values(),
+            'albums': list(self.albums.values()),
+            'stations': self.stations.values(),
+            'staging': self.stager.files.values(),
+            'loudness': (self.loudness.cache or {}).values(),
+        }
+
     def get_page(self, ctx, page):
         """Gets page number from user input
 
@@ -186,64 +642,168 @@ class CogPlexServer(commands.Cog, name='Plex Server'):
             section (str) : Section to search for
 
         Returns
-            A valid plexapi.library.LibrarySection object
+            Title of the Plex library section as a str
 
         Raises
             PlexInvalidSection if section is not valid
         """
         try:
-            return self.bot.plex.library.section(Sections[section.lower()])
+            return Sections[section.lower()]
         except KeyError:
             raise PlexInvalidSection(f"The section `{section}` is invalid {ctx.author.mention}\n"
                                      f"Please specify one of the following sections: {', '.join(s.title() for s in Sections.keys())}")
 
-    def get_album(self, ctx, section, album):
-        """Gets album from user input
+    async def query(self, ctx, cls, key, func, *args):
+        """Queries Plex through the scheduler, coalescing identical requests.
+        Queries are routed to the fastest available Plex backend, failing over to the others.
+        Results are cached until a library event invalidates them
+
+        Parameters
+            ctx (commands.Context) : Invocation context
+            cls (str) : Class of the request (see PLEX_WEIGHTS)
+            key (tuple) : Key identifying the request
+            func (callable) : Blocking function querying Plex, called with the server routed to and the arguments
+            args (tuple) : Arguments of the function
+
+        Returns
+            The result of the function
+
+        Raises
+            PlexBusy if the guild exceeds its Plex requests limits
+            PlexUnavailable if no Plex backend could serve the request
+        """
+        res = self.cache.get(key)
+        if res is not None:
+            return res
+
+        with tracing.span('plex.query', key=key, cls=cls):
+            ticket = self.scheduler.admit(ctx, cls)
+            generation = self.cache.generation
+            try:
+                res = await self.flights.do(key, self.scheduler.run, ticket, self.bot.plex_backends.call, func, *args)
+            except BackendsUnavailable:
+                raise PlexUnavailable(f"The Plex server is unavailable at the moment, please try again later {ctx.author.mention}")
+        self.cache.put(key, res, generation)
+        return res
+
+    async def get_album(self, ctx, section, album):
+        """Gets album and its tracks from user input, from the catalog snapshot if it holds the album
 
         Parameters
             ctx (commands.Context) : Invocation context
-            section (plexapi.library.LibrarySection) : Section of the album to search from
+            section (str) : Title of the section of the album to search from
             album (str) : Name of the album to search for
 
         Returns
-            A valid plexapi.audio.Album object
+            A tuple composed of:
+            - A valid plexapi.audio.Album (or CatalogAlbum) object
+            - The list of plexapi.audio.Track (or CatalogTrack) of the album
 
         Raises
             PlexAlbumNotFound if album is not found
         """
+        res = self.catalog.find(section, album) if self.catalog is not None else None
+        if res is None:
+            res = await self.query(ctx, 'interactive', ('album', section, normalize(album)), self.fetch_album, section, album)
+        if res is None:
+            raise PlexAlbumNotFound(f"The album `{album}` did not match any results {ctx.author.mention}")
+
+        return res
+
+    def fetch_albums(self, server, section):
+        """Fetches all album titles of a section (blocking)
+
+        Parameters
+            server (plexapi.server.PlexServer) : Plex server routed to
+            section (str) : Title of the section
+
+        Returns
+            List of album titles sorted by title
+        """
+        with tracing.span('plex.section', section=section):
+            s = server.library.section(section)
+        with tracing.span('plex.search', libtype='album'):
+            return [album.title for album in s.search(libtype='album', sort='titleSort')]
+
+    def fetch_search(self, server, section, keyword):
+        """Fetches album titles matching a keyword (blocking)
+
+        Parameters
+            server (plexapi.server.PlexServer) : Plex server routed to
+            section (str) : Title of the section
+            keyword (str) : Keyword to search for
+
+        Returns
+            List of the most relevant album titles
+        """
+        with tracing.span('plex.section', section=section):
+            s = server.library.section(section)
+        with tracing.span('plex.search', libtype='album', title=keyword):
+            return [album.title for album in s.search(title=keyword, libtype='album', limit=NB_RESULTS_PER_SEARCH)]
+
+    def fetch_album(self, server, section, album):
+        """Fetches an album and its tracks (blocking)
+
+        Parameters
+            server (plexapi.server.PlexServer) : Plex server routed to
+            section (str) : Title of the section
+            album (str) : Name of the album to search for
+
+        Returns
+            A tuple composed of the plexapi.audio.Album object and its list of tracks if found else None
+        """
+        from plexapi.exceptions import NotFound
+
+        with tracing.span('plex.section', section=section):
+            s = server.library.section(section)
         try:
             # We remove commas in album title as it provokes search errors...
-            return section.search(title=album.replace(',', ''), libtype='album', limit=1)[0]
-        except (plexapi.exceptions.NotFound, IndexError):
-            raise PlexAlbumNotFound(f"The album `{album}` did not match any results {ctx.author.mention}")
+            with tracing.span('plex.search', libtype='album', title=album):
+                a = s.search(title=album.replace(',', ''), libtype='album', limit=1)[0]
+        except (NotFound, IndexError):
+            return None
+
+        with tracing.span('plex.tracks', album=a.ratingKey):
+            return (a, a.tracks())
+
+    def get_location(self, track):
+        """Gets the path of a track relative to its partition
 
-    def get_album_path(self, section, album):
+        Parameters
+            track (plexapi.audio.Track|CatalogTrack) : Track to search from
+
+        Returns
+            Path relative to the partition as a str
+        """
+        if isinstance(track, CatalogTrack):
+            return track.path
+        return relative_path(track.media[0].parts[0].file)
+
+    def get_album_path(self, section, tracks):
         """Gets album path
 
         Parameters
             section (str) : Section of the album (must be valid)
-            album (plexapi.audio.Album) : Album to search from
+            tracks (list) : Tracks of the album
 
         Returns
             Path to the album as a str
         """
-        location = album.tracks()[0].media[0].parts[0].file
-        return self.partitions[section.lower()] + '/' + os.path.dirname(location.split('/', 3)[3])
+        return self.partitions[section.lower()] + '/' + os.path.dirname(self.get_location(tracks[0]))
 
     def get_track_path(self, section, track):
         """Gets track path
 
         Parameters
             section (str) : Section of the album of the track (must be valid)
-            track (plexapi.audio.track) : Track to search from
+            track (plexapi.audio.Track|CatalogTrack) : Track to search from
 
         Returns
             Path to the track as a str
         """
-        location = track.media[0].parts[0].file
-        return self.partitions[section.lower()] + '/' + location.split('/', 3)[3]
+        return self.partitions[section.lower()] + '/' + self.get_location(track)
 
-    def get_thumbnail(self, path):
+    async def get_thumbnail(self, path):
         """Gets album thumbnail path
 
         Parameters
@@ -252,11 +812,9 @@ class CogPlexServer(commands.Cog, name='Plex Server'):
         Returns
             Path to the album thumbnail as a str if found else None
         """
-        try:
-            # We search a file named 'cover' in the album directory
-            return path + '/' + [name for name in os.listdir(path) if 'cover' in name.lower()][0]
-        except IndexError:
-            return None
+        with tracing.span('fs.lookup', path=path):
+            album = await self.index.lookup(path)
+        return album.cover if album is not None else None
 
     @commands.group(name='plex')
     async def plex(self, ctx):
@@ -278,26 +836,35 @@ class CogPlexServer(commands.Cog, name='Plex Server'):
 
         # Check consistency
         s = self.get_section(ctx, section)
-        s_name = Sections[section.lower()].title()
+        s_name = s.title()
 
         if page is None:
             page = 1
         else:
             page = self.get_page(ctx, page)
 
-        # Query Plex server for all albums in this section
-        results = [album.title for album in s.search(libtype='album', sort='titleSort')]
+        # Read all albums in this section from the catalog snapshot, or else query Plex server
+        results = self.catalog.listing(s) if self.catalog is not None else None
+        if results is None:
+            results = await self.query(ctx, 'bulk', ('list', s), self.fetch_albums, s)
         total = len(results)
         nb_pages = total // NB_RESULTS_PER_PAGE + int(total % NB_RESULTS_PER_PAGE != 0)
 
         if page > nb_pages:
             raise PlexInvalidPage(f"There are a maximum of {nb_pages} pages for the `{s_name}` section {ctx.author.mention}")
 
-        start = NB_RESULTS_PER_PAGE * (page - 1)
-        end = NB_RESULTS_PER_PAGE * page
+        # Render result in a Discord embed, unless this page of this list was already rendered
+        key = ('list', s, page)
+        cached = self.embeds.get(key, source=results)
+        if cached is not None:
+            embed = cached[0]
+        else:
+            start = NB_RESULTS_PER_PAGE * (page - 1)
+            end = NB_RESULTS_PER_PAGE * page
+            embed = discord.Embed(title=f'Page {page} of {nb_pages} in {s_name} section',
+                                  description=truncate('\n'.join(f"- {result}" for result in results[start:end]), EMBED_DESCRIPTION))
+            self.embeds.put(key, embed, source=results)
 
-        # Render result in a Discord embed
-        embed = discord.Embed(title=f'Page {page} of {nb_pages} in {s_name} section', description='\n'.join(f"- {result}" for result in results[start:end]))
         embed.set_author(name=ctx.author.display_name, icon_url=ctx.author.avatar_url)
         embed.set_footer(text=f"Requester: {ctx.author.display_name}")
         await ctx.send(embed=embed)
@@ -316,8 +883,10 @@ class CogPlexServer(commands.Cog, name='Plex Server'):
         # Check consistency
         s = self.get_section(ctx, section)
 
-        # Query Plex server for all albums that match keyword
-        results = [album.title for album in s.search(title=keyword, libtype='album', limit=NB_RESULTS_PER_SEARCH)]
+        # Search the catalog snapshot for albums that match keyword, or else query Plex server
+        results = self.catalog.search(s, keyword, NB_RESULTS_PER_SEARCH) if self.catalog is not None else None
+        if results is None:
+            results = await self.query(ctx, 'interactive', ('search', s, normalize(keyword)), self.fetch_search, s, keyword)
         if not results:
             raise PlexNoMatchingResults(f"Your search did not match any results {ctx.author.mention}")
 
@@ -338,54 +907,85 @@ class CogPlexServer(commands.Cog, name='Plex Server'):
             album (str) : Name of the album
         """
         await ctx.trigger_typing()
-        attachment = None
-        ite = 0
 
         # Check consistency
         s = self.get_section(ctx, section)
-        a = self.get_album(ctx, s, album)
+        a, tracks = await self.get_album(ctx, s, album)
+
+        # Render result in Discord embed, unless this version of the album was already rendered with the same cover
+        path = self.get_album_path(section, tracks)
+        thumb = await self.get_thumbnail(path)
+        key = ('info', s, a.ratingKey, a.updatedAt)
+        cached = self.embeds.get(key)
+        embed = attachment = None
+        if cached is not None and cached[1] == thumb:
+            embed = cached[0]
+            if thumb is not None:
+                try:
+                    attachment = discord.File(thumb)
+                except OSError:
+                    embed = None
+
+        if embed is None:
+            embed, attachment = self.render_info(a, tracks, thumb)
+            self.embeds.put(key, embed, extra=thumb if attachment is not None else None)
 
-        # Get album info
-        tracks = a.tracks()
-        nb_tracks = len(tracks)
-        path = self.get_album_path(section, a)
-        thumb = self.get_thumbnail(path)
-        if thumb is not None and os.path.isfile(thumb):
-            attachment = discord.File(thumb)
-            color = ColorThief(thumb).get_color(quality=7)
+        embed.set_author(name=ctx.author.display_name, icon_url=ctx.author.avatar_url)
+        embed.set_footer(text=f"Requester: {ctx.author.display_name}")
+        await ctx.send(file=attachment, embed=embed)
+
+    def render_info(self, a, tracks, thumb):
+        """Renders the info embed of an album, without requester
+
+        Parameters
+            a (plexapi.audio.Album) : Album to render
+            tracks (list) : Tracks of the album
+            thumb (str) : Path to the album thumbnail if any else None
+
+        Returns
+            A tuple composed of:
+            - A valid discord.Embed object
+            - A discord.File attachment if exists else None
+        """
+        attachment = None
+        if thumb is not None:
+            # Imported on first use as colorthief pulls PIL in
+            from colorthief import ColorThief
+            # The colour is computed first so that no file is left open when the cover can not be read
+            try:
+                with tracing.span('fs.cover', path=thumb):
+                    color = ColorThief(thumb).get_color(quality=7)
+                    attachment = discord.File(thumb)
+            except OSError:
+                attachment = None
 
-        # Render result in Discord embed
         if attachment is not None:
-            embed = discord.Embed(title=a.title, description=a.artist().title, color=discord.Color.from_rgb(*color))
+            embed = discord.Embed(title=truncate(a.title, EMBED_TITLE), description=a.parentTitle, color=discord.Color.from_rgb(*color))
             embed.set_thumbnail(url=f'attachment://{os.path.basename(thumb)}')
         else:
-            embed = discord.Embed(title=a.title, description=a.artist().title)
-        embed.set_author(name=ctx.author.display_name, icon_url=ctx.author.avatar_url)
-        embed.set_footer(text=f"Requester: {ctx.author.display_name}")
+            embed = discord.Embed(title=truncate(a.title, EMBED_TITLE), description=a.parentTitle)
 
-        while (NB_TRACKS_PER_EMBED_FIELD * ite) < nb_tracks:
-            start = NB_TRACKS_PER_EMBED_FIELD * ite
-            end = NB_TRACKS_PER_EMBED_FIELD * (ite + 1)
-            fmt = '\n'.join(f"{start+index+1}. {track.title} [{format_duration(track.duration)}]" for index, track in enumerate(tracks[start:end]))
-            embed.add_field(name=f'{start+1} - {min(nb_tracks, end)}', value=fmt, inline=False)
-            ite += 1
+        lines = [f"{index+1}. {track.title} [{format_duration(track.duration)}]" for index, track in enumerate(tracks)]
+        add_line_fields(embed, lines, NB_TRACKS_PER_EMBED_FIELD, 'tracks')
+        return (embed, attachment)
 
-        await ctx.send(file=attachment, embed=embed)
-
-    @plex.command(name='play')
-    async def play(self, ctx, section: str, album: str):
-        """Add album to the player queue
+    async def prepare_album(self, ctx, section, album):
+        """Joins the voice channel of the user and prepares the tracks of an album to queue
 
         Parameters
             ctx (commands.Context) : Invocation context
-            section (str) : Section of the album (Animes, Audios, Games, Movies, Music or Shows)
+            section (str) : Section of the album
             album (str) : Name of the album
-        """
-        await ctx.trigger_typing()
 
+        Returns
+            A tuple composed of:
+            - A valid plexapi.audio.Album object
+            - The VoicePlayer of the guild
+            - The list of QueuedTrack of the album
+        """
         # Check consistency
         s = self.get_section(ctx, section)
-        a = self.get_album(ctx, s, album)
+        a, tracks = await self.get_album(ctx, s, album)
 
         # Get voice & player
         v = self.bot.get_cog('Voice')
@@ -396,16 +996,118 @@ class CogPlexServer(commands.Cog, name='Plex Server'):
         player = v.get_player(ctx)
 
         # Get album info
-        tracks = a.tracks()
-        nb_tracks = len(tracks)
-        path = self.get_album_path(section, a)
-        thumb = self.get_thumbnail(path)
+        path = self.get_album_path(section, tracks)
+        thumb = await self.get_thumbnail(path)
+
+        # Share the album metadata between its tracks (and between guilds)
+        key = (a.title, thumb, ctx.author.display_name)
+        record = self.albums.get(key)
+        if record is None:
+            record = self.albums[key] = AlbumRecord(*key)
+
+        return (a, player, [QueuedTrack(track.title, track.duration, self.get_track_path(section, track), record) for track in tracks])
+
+    @plex.command(name='play')
+    async def play(self, ctx, section: str, album: str):
+        """Add album to the player queue
+
+        Parameters
+            ctx (commands.Context) : Invocation context
+            section (str) : Section of the album (Animes, Audios, Games, Movies, Music or Shows)
+            album (str) : Name of the album
+        """
+        await ctx.trigger_typing()
+        a, player, tracks = await self.prepare_album(ctx, section, album)
 
-        # Add tracks to music player queue
-        for track in a.tracks():
-            source = await PlexSource.create_source(ctx, section, self.get_track_path(section, track), thumb, track)
-            await player.queue.put(source)
+        # Add tracks to music player queue, copying them locally ahead of playback
+        self.stager.stage(tracks, ctx.guild.id)
+        self.loudness.analyze(tracks)
+        for track in tracks:
+            await player.enqueue(track)
 
-        embed = discord.Embed(title="Player info", description=f"Queued {a.title} ({nb_tracks} tracks)", color=discord.Color.blue())
+        embed = discord.Embed(title="Player info", description=f"Queued {a.title} ({len(tracks)} tracks)", color=discord.Color.blue())
         embed.set_footer(text=f"Requester: {ctx.author.display_name}")
         await ctx.send(embed=embed)
+
+    @plex.command(name='radio')
+    async def radio(self, ctx, section: str, album: str):
+        """Add album radio to the player queue
+        Guilds listening to the same album share a single station and join it live
+
+        Parameters
+            ctx (commands.Context) : Invocation context
+            section (str) : Section of the album (Animes, Audios, Games, Movies, Music or Shows)
+            album (str) : Name of the album
+        """
+        await ctx.trigger_typing()
+        a, player, tracks = await self.prepare_album(ctx, section, album)
+
+        # Add station ticket to music player queue, tuned in when played
+        self.loudness.analyze(tracks)
+        await player.enqueue(RadioTicket((section.lower(), a.ratingKey), tracks, tracks[0].record, self.stations))
+
+        station = self.stations.get((section.lower(), a.ratingKey))
+        live = f", {station.listeners} guilds listening" if station is not None and station.alive else ""
+        embed = discord.Embed(title="Player info", description=f"Queued {a.title} radio ({len(tracks)} tracks{live})", color=discord.Color.blue())
+        embed.set_footer(text=f"Requester: {ctx.author.display_name}")
+        await ctx.send(embed=embed)
+
+    @plex.command(name='stats', hidden=True)
+    @commands.is_owner()
+    async def stats(self, ctx):
+        """Shows Plex requests statistics
+
+        Parameters
+            ctx (commands.Context) : Invocation context
+        """
+        flights = self.flights
+        scheduler = self.scheduler
+        embed = discord.Embed(title="Plex stats", color=discord.Color.blue())
+        embed.add_field(name="Requests", value=f"{flights.requests} requests\n"
+                                               f"{flights.coalesced} coalesced\n"
+                                               f"{len(flights.inflight)} in flight", inline=False)
+        embed.add_field(name="Cache", value=f"{len(self.cache)} entries\n"
+                                            f"{self.cache.hits} hits / {self.cache.misses} misses\n"
+                                            f"{self.cache.invalidations} invalidations\n"
+                                            f"{'notifications' if self.watcher.listening() else 'delta polling'} "
+                                            f"({self.watcher.events} events, {self.watcher.polls} polls)", inline=False)
+        stations = [station for station in self.stations.values() if station.alive]
+        embed.add_field(name="Radio", value=f"{len(stations)} stations\n"
+                                            f"{sum(station.listeners for station in stations)} listeners", inline=False)
+        stager = self.stager
+        embed.add_field(name="Staging", value=f"{len(stager)} tracks, {stager.used // 2**20}/{stager.budget // 2**20} MB\n"
+                                              f"{stager.staged} staged / {stager.evicted} evicted / {stager.skipped} skipped", inline=False)
+        embed.add_field(name="Loudness", value=f"{self.loudness.analyzed} analyzed / {self.loudness.hits} cached / {self.loudness.failed} failed", inline=False)
+        embed.add_field(name="Embeds", value=f"{len(self.embeds)} rendered\n"
+                                             f"{self.embeds.hits} hits / {self.embeds.misses} misses", inline=False)
+        embed.add_field(name="Media index", value=f"{len(self.index)} directories{'' if self.index.ready else ' (building)'}\n"
+                                                  f"{self.index.hits} hits / {self.index.misses} misses", inline=False)
+        catalog = self.catalog
+        if catalog is not None:
+            snapshot = catalog.current
+            refresher = self.refresher
+            embed.add_field(name="Catalog", value=(f"{snapshot.albums} albums / {snapshot.tracks} tracks, {snapshot.size // 1024} KB, "
+                                                   f"{time.time() - snapshot.created:.0f}s old\n" if snapshot is not None else "No snapshot\n")
+                                                + f"{catalog.hits} hits / {catalog.misses} misses / {catalog.remaps} mapped"
+                                                + (f"\n{refresher.refreshes} refreshes" if refresher is not None else ""), inline=False)
+        backends = self.bot.plex_backends
+        embed.add_field(name="Backends", value='\n'.join(f"{'primary' if b.primary else 'replica'} {b.url}: {b.state}, "
+                                                         f"{'-' if b.latency is None else f'{b.latency * 1000:.0f}'} ms "
+                                                         f"({'-' if b.probe is None else f'{b.probe * 1000:.0f}'} ms checks), "
+                                                         f"{b.requests} requests / {b.errors} errors" for b in backends.backends)
+                                                + f"\n{backends.failovers} failovers", inline=False)
+        embed.add_field(name="Scheduler", value=f"{scheduler.running}/{scheduler.concurrency} running\n"
+                                                f"{len(scheduler.heap)} waiting\n"
+                                                f"{scheduler.rejected} rejected", inline=False)
+        embed.add_field(name="Queue wait (p50/p95)", value='\n'.join(f"{cls}: {p50:.0f}/{p95:.0f} ms" for cls, (p50, p95)
+                                                                     in ((cls, scheduler.wait_stats(cls)) for cls in scheduler.weights)), inline=False)
+        embed.set_footer(text=f"Requester: {ctx.author.display_name}")
+        await ctx.send(embed=embed)
+
+def setup(bot):
+    """Loads the extension
+
+    Parameters
+        bot (commands.Bot) : Bot to add the cog to
+    """
+    bot.add_cog(CogPlexServer(bot))
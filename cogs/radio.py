@@ -0,0 +1,266 @@
+# -*- coding: utf-8 -*-
+"""
+EDI radio stations shared between voice clients
+"""
+#
+# Copyright (c) 2022, Marc GIANNETTI <mgtti.pro@gmail.com>
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+#  - Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+#
+#  - Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+#  - Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON
+# ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import threading
+import logging
+import discord
+import time
+
+# Number of Opus frames kept by a station (20ms each)
+RING_SIZE = 250
+
+# Number of frames behind the live position a new listener starts at, to absorb scheduling jitter
+LIVE_MARGIN = 3
+
+# Delay a listener waits for the next frame before sending silence (in seconds)
+FRAME_TIMEOUT = 0.1
+
+# Opus frame of silence
+SILENCE = b'\xf8\xff\xfe'
+
+class Station:
+    """Broadcasts a playlist: tracks are decoded and encoded once, at real-time pace,
+    into a ring of Opus frames read by every listener
+
+    Attributes
+        tracks (list) : QueuedTrack objects broadcast in order
+        current (QueuedTrack) : Track being broadcast
+        head (int) : Sequence number of the next frame
+        listeners (int) : Number of listeners
+        alive (bool) : False once the playlist ended or every listener left
+    """
+    DELAY = discord.opus.Encoder.FRAME_LENGTH / 1000.0
+
+    def __init__(self, tracks):
+        """Station init"""
+        self.tracks = tracks
+        self.current = tracks[0]
+        self.ring = [None] * RING_SIZE
+        self.head = 0
+        self.listeners = 0
+        self.alive = True
+        self.cond = threading.Condition()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def start(self):
+        """Starts broadcasting in a background thread"""
+        self.thread.start()
+
+    def subscribe(self):
+        """Adds a listener
+
+        Returns
+            Sequence number of the first frame of the listener (live position), or None if the station ended
+        """
+        with self.cond:
+            if not self.alive:
+                return None
+            self.listeners += 1
+            return max(0, self.head - LIVE_MARGIN)
+
+    def unsubscribe(self):
+        """Removes a listener, the station stops with its last listener"""
+        with self.cond:
+            self.listeners -= 1
+            if self.listeners <= 0:
+                self.alive = False
+                self.cond.notify_all()
+
+    def run(self):
+        """Broadcasts the playlist until it ends or every listener left"""
+        try:
+            for track in self.tracks:
+                self.current = track
+                gain = f'-af volume={track.gain:.2f}dB' if track.gain else None
+                source = discord.FFmpegOpusAudio(track.path, options=gain)
+                try:
+                    start = time.perf_counter()
+                    loops = 0
+                    while self.alive:
+                        data = source.read()
+                        if not data:
+                            break
+
+                        with self.cond:
+                            self.ring[self.head % RING_SIZE] = data
+                            self.head += 1
+                            self.cond.notify_all()
+
+                        loops += 1
+                        time.sleep(max(0, start + self.DELAY * loops - time.perf_counter()))
+                finally:
+                    source.cleanup()
+
+                if not self.alive:
+                    break
+        except Exception as exc:
+            logging.error(f"Station broadcasting {self.current.album} failed: {exc}")
+        finally:
+            with self.cond:
+                self.alive = False
+                self.cond.notify_all()
+
+class StationListener(discord.AudioSource):
+    """Audio source reading the Opus frames of a station.
+    Frames are shared with the other listeners, so the volume can not be changed
+
+    Attributes
+        station (Station) : Station listened to
+        ticket (RadioTicket) : Queued ticket of the station
+        cursor (int) : Sequence number of the next frame to read
+        volume (float) : Ignored
+    """
+    def __init__(self, station, cursor, ticket):
+        """StationListener init"""
+        self.station = station
+        self.cursor = cursor
+        self.ticket = ticket
+        self.volume = 1.0
+        self.closed = False
+
+    def read(self):
+        """Reads the next frame
+
+        Returns
+            An Opus frame as bytes, silence while the station is late, or b'' once it ended
+        """
+        station = self.station
+        with station.cond:
+            if self.cursor >= station.head and station.alive:
+                station.cond.wait(FRAME_TIMEOUT)
+
+            # Fell behind the ring, catch up with the live position
+            if self.cursor < station.head - RING_SIZE:
+                self.cursor = station.head - LIVE_MARGIN
+
+            if self.cursor >= station.head:
+                return SILENCE if station.alive else b''
+            data = station.ring[self.cursor % RING_SIZE]
+
+        self.cursor += 1
+        return data
+
+    def is_opus(self):
+        """Frames are already Opus encoded"""
+        return True
+
+    def cleanup(self):
+        """Leaves the station"""
+        if not self.closed:
+            self.closed = True
+            self.station.unsubscribe()
+
+    @property
+    def title(self):
+        """Title of the track being broadcast"""
+        return self.station.current.title
+
+    @property
+    def length(self):
+        """Formatted duration of the track being broadcast"""
+        return self.station.current.length
+
+    def __getattr__(self, name):
+        """Exposes the ticket metadata (album, thumb, requester)"""
+        if name == 'ticket':
+            raise AttributeError(name)
+        return getattr(self.ticket, name)
+
+class RadioTicket:
+    """Queued entry tuning in to a station when played.
+    The station of the album is started if no guild listens to it yet, otherwise the guild joins it live
+
+    Attributes
+        key (tuple) : Key of the station
+        tracks (list) : QueuedTrack objects of the album
+        record (AlbumRecord) : Album of the station
+        stations (dict) : Stations by key
+    """
+    __slots__ = ('key', 'tracks', 'record', 'stations')
+
+    def __init__(self, key, tracks, record, stations):
+        """RadioTicket init"""
+        self.key = key
+        self.tracks = tracks
+        self.record = record
+        self.stations = stations
+
+    @property
+    def title(self):
+        """Title of the station"""
+        return f"{self.record.title} (radio)"
+
+    @property
+    def length(self):
+        """Stations are live"""
+        return 'live'
+
+    @property
+    def album(self):
+        """Album title"""
+        return self.record.title
+
+    @property
+    def thumb(self):
+        """Path to the album thumbnail if exists"""
+        return self.record.thumb
+
+    @property
+    def requester(self):
+        """Display name of the requester"""
+        return self.record.requester
+
+    def create_source(self, volume=None):
+        """Tunes in to the station, starting it if needed
+
+        Parameters
+            volume (float) [optional] : Ignored, frames are shared between guilds
+
+        Returns
+            A StationListener object
+        """
+        for key in [key for key, station in self.stations.items() if not station.alive]:
+            del self.stations[key]
+
+        station = self.stations.get(self.key)
+        cursor = station.subscribe() if station is not None else None
+        if cursor is None:
+            station = Station(self.tracks)
+            cursor = station.subscribe()
+            station.start()
+            self.stations[self.key] = station
+
+        return StationListener(station, cursor, self)
+
+    def cleanup(self):
+        """Releases the ticket (nothing is held until it is played)"""
@@ -0,0 +1,250 @@
+# -*- coding: utf-8 -*-
+"""
+EDI read-ahead staging of queued tracks to a local scratch directory
+"""
+#
+# Copyright (c) 2022, Marc GIANNETTI <mgtti.pro@gmail.com>
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+#  - Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+#
+#  - Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+#  - Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON
+# ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+from collections import OrderedDict, deque
+import itertools
+import tempfile
+import asyncio
+import logging
+import shutil
+import os
+
+# Directory where tracks are staged (Default is a temporary directory)
+STAGING_DIR = None
+
+# Disk space used by staged tracks (in bytes)
+STAGING_BUDGET = 2 * 1024 * 1024 * 1024
+
+# Limits the number of tracks copied at once
+STAGING_CONCURRENCY = 2
+
+# Size of the reads made on the partitions (in bytes)
+COPY_CHUNK = 8 * 1024 * 1024
+
+class Stager:
+    """Copies queued tracks from the mounted partitions to a local scratch directory ahead of playback.
+    Tracks are copied with large sequential reads, within a disk budget, and evicted once played or removed from the queue.
+    Each guild has its own queue copied in order, guilds taking turns (round-robin) so that a large album does not delay
+    the others: a track that does not fit the remaining budget yet lets the tracks of other guilds be copied meanwhile
+
+    Attributes
+        root (str) : Scratch directory
+        budget (int) : Disk space usable by staged tracks in bytes
+        used (int) : Disk space used by staged tracks in bytes
+        staged (int) : Number of tracks staged
+        evicted (int) : Number of staged tracks evicted
+        skipped (int) : Number of tracks played before being staged or not staged at all
+    """
+    def __init__(self, loop, root=STAGING_DIR, budget=STAGING_BUDGET, concurrency=STAGING_CONCURRENCY):
+        """Stager init"""
+        self.loop = loop
+        self.root = tempfile.mkdtemp(prefix='edi-staging-', dir=root)
+        self.budget = budget
+        self.used = 0
+        self.pending = OrderedDict()
+        self.sizes = {}
+        self.files = {}
+        self.copying = {}
+        self.wakeup = asyncio.Event()
+        self.staged = 0
+        self.evicted = 0
+        self.skipped = 0
+        self.count = 0
+        self.workers = [loop.create_task(self.worker()) for _ in range(concurrency)]
+
+    def __len__(self):
+        """Number of tracks staged or being staged"""
+        return len(self.files) + len(self.copying)
+
+    def stage(self, tracks, guild):
+        """Stages tracks of a guild in the background, in order
+
+        Parameters
+            tracks (list) : QueuedTrack objects to stage
+            guild (int) : ID of the guild the tracks are queued in
+        """
+        for track in tracks:
+            track.stager = self
+        self.pending.setdefault(guild, deque()).extend(tracks)
+        self.wakeup.set()
+
+    def local_path(self, track):
+        """Gets the staged copy of a track about to be played.
+        A track not staged yet is played from the partition and no longer staged
+
+        Parameters
+            track (QueuedTrack) : Track to play
+
+        Returns
+            Path to the staged copy as a str if any else None
+        """
+        try:
+            return self.files[track][0]
+        except KeyError:
+            self.skipped += 1
+            self.release(track)
+            return None
+
+    def release(self, track):
+        """Evicts the staged copy of a track that was played or removed from the queue
+
+        Parameters
+            track (QueuedTrack) : Track to release
+        """
+        # Not staged yet: workers drop it, or its copy once done
+        track.stager = None
+        try:
+            path, size = self.files.pop(track)
+        except KeyError:
+            self.wakeup.set()
+            return
+
+        self.remove(path, size)
+        self.evicted += 1
+
+    def remove(self, path, size):
+        """Removes a staged file and gives its space back
+
+        Parameters
+            path (str) : Path to the staged file
+            size (int) : Size of the file in bytes
+        """
+        try:
+            os.remove(path)
+        except OSError as exc:
+            logging.warning(f"Can not remove staged track {path}: {exc}")
+
+        self.used -= size
+        self.wakeup.set()
+
+    def next_track(self):
+        """Takes the next track to copy, from the next guild whose next track fits the remaining budget
+
+        Returns
+            A tuple composed of the guild, the track and its size if known else None, or None if no track can be copied
+        """
+        for guild in list(self.pending):
+            queue = self.pending[guild]
+            while queue and queue[0].stager is not self:
+                self.sizes.pop(queue.popleft(), None)
+            if not queue:
+                del self.pending[guild]
+                continue
+
+            size = self.sizes.get(queue[0])
+            if size is not None and self.used + size > self.budget:
+                continue
+
+            track = queue.popleft()
+            self.sizes.pop(track, None)
+            if queue:
+                self.pending.move_to_end(guild)
+            else:
+                del self.pending[guild]
+            return (guild, track, size)
+        return None
+
+    async def worker(self):
+        """Copies pending tracks until stopped"""
+        while True:
+            job = self.next_track()
+            if job is None:
+                # Wait for tracks to be queued, or for played tracks to be evicted
+                self.wakeup.clear()
+                await self.wakeup.wait()
+                continue
+
+            guild, track, size = job
+            if size is None:
+                try:
+                    size = await self.loop.run_in_executor(None, os.path.getsize, track.path)
+                except OSError:
+                    self.skipped += 1
+                    continue
+                if size > self.budget:
+                    self.skipped += 1
+                    continue
+                if track.stager is not self:
+                    continue
+
+            # Read ahead within the disk budget: the track waits at the head of its guild queue for played tracks to be evicted
+            if self.used + size > self.budget:
+                self.sizes[track] = size
+                self.pending.setdefault(guild, deque()).appendleft(track)
+                continue
+            self.used += size
+
+            self.count += 1
+            path = f"{self.root}/{self.count}{os.path.splitext(track.path)[1]}"
+            self.copying[track] = path
+            try:
+                await self.loop.run_in_executor(None, self.copy, track.path, path)
+            except OSError as exc:
+                logging.warning(f"Can not stage track {track.path}: {exc}")
+                self.used -= size
+                self.skipped += 1
+                continue
+            finally:
+                del self.copying[track]
+
+            # Played or removed while being copied
+            if track.stager is not self:
+                self.remove(path, size)
+                continue
+
+            self.files[track] = (path, size)
+            self.staged += 1
+
+    def copy(self, src, dst):
+        """Copies a track with large sequential reads (blocking)
+
+        Parameters
+            src (str) : Path to the track on the partition
+            dst (str) : Path to the staged copy
+        """
+        part = dst + '.part'
+        with open(src, 'rb', buffering=0) as fsrc, open(part, 'wb') as fdst:
+            shutil.copyfileobj(fsrc, fdst, COPY_CHUNK)
+        os.replace(part, dst)
+
+    def stop(self):
+        """Stops staging and removes the staged tracks.
+        Queued tracks are then played from the partitions"""
+        for worker in self.workers:
+            worker.cancel()
+        for track in itertools.chain(*self.pending.values(), self.files, self.copying):
+            track.stager = None
+        self.pending.clear()
+        self.sizes.clear()
+        self.files.clear()
+        shutil.rmtree(self.root, ignore_errors=True)
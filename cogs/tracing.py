@@ -0,0 +1,341 @@
+# -*- coding: utf-8 -*-
+"""
+EDI tracing of command execution
+"""
+#
+# Copyright (c) 2022, Marc GIANNETTI <mgtti.pro@gmail.com>
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+#  - Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+#
+#  - Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+#  - Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON
+# ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+from contextlib import contextmanager
+from contextvars import ContextVar
+from logging.handlers import QueueListener, RotatingFileHandler
+from .logs import DeferredQueueHandler
+import contextvars
+import functools
+import logging
+import random
+import queue
+import json
+import time
+import os
+
+# File traces are written to, rotated past TRACE_FILE_SIZE bytes with TRACE_FILE_COUNT backups
+TRACE_FILE = os.path.join(os.path.expanduser('~'), '.cache', 'edi', 'traces.jsonl')
+TRACE_FILE_SIZE = 10 * 1024 * 1024
+TRACE_FILE_COUNT = 5
+
+# Traces lasting at least this long (in seconds), or failing, are always kept
+TRACE_SLOW = 1.0
+
+# Share of the other traces kept
+TRACE_SAMPLE_RATE = 0.05
+
+# Limits the number of spans recorded per trace
+TRACE_MAX_SPANS = 256
+
+# Name of the service in the written spans
+SERVICE_NAME = 'edi'
+
+# Span of the code being run (per asyncio task, copied to the executor threads running Plex requests)
+current = ContextVar('edi_span', default=None)
+
+# Tracer writing finished traces, tracing is disabled until configured
+tracer = None
+
+class Span:
+    """Timed operation of a trace
+
+    Attributes
+        trace (Trace) : Trace of the span
+        id (str) : Span ID (16 hex digits)
+        parent (str) : Parent span ID if any else None
+        name (str) : Name of the operation
+        tags (dict) : Annotations of the operation
+        timestamp (int) : Start time (in µs since epoch)
+        duration (int) : Duration once finished (in µs) else None
+    """
+    __slots__ = ('trace', 'id', 'parent', 'name', 'tags', 'timestamp', 'start', 'duration')
+
+    def __init__(self, trace, name, parent, tags):
+        """Span init"""
+        self.trace = trace
+        self.id = f'{random.getrandbits(64):016x}'
+        self.parent = parent
+        self.name = name
+        self.tags = tags
+        self.timestamp = time.time_ns() // 1000
+        self.start = time.perf_counter()
+        self.duration = None
+
+    def finish(self):
+        """Ends the span"""
+        self.duration = max(1, int((time.perf_counter() - self.start) * 1e6))
+
+    def to_dict(self):
+        """Converts the span to the Zipkin v2 JSON format
+
+        Returns
+            The span as a dict
+        """
+        span = {
+            'traceId': self.trace.id,
+            'id': self.id,
+            'name': self.name,
+            'timestamp': self.timestamp,
+            'duration': self.duration,
+            'localEndpoint': {'serviceName': SERVICE_NAME},
+            'tags': {key: str(value) for key, value in self.tags.items()},
+        }
+        if self.parent is not None:
+            span['parentId'] = self.parent
+        return span
+
+class Trace:
+    """Spans of one command invocation, kept in memory until the trace is written
+
+    Attributes
+        id (str) : Trace ID (32 hex digits)
+        spans (list) : Spans of the trace, root first
+        done (bool) : True once the root span ended
+        pending (int) : Number of holds on the trace, it is written once they are all released
+        failed (bool) : True if a span of the trace failed
+    """
+    __slots__ = ('id', 'spans', 'done', 'pending', 'failed')
+
+    def __init__(self):
+        """Trace init"""
+        self.id = f'{random.getrandbits(128):032x}'
+        self.spans = []
+        self.done = False
+        self.pending = 0
+        self.failed = False
+
+    def closed(self):
+        """Returns True if the trace ended and nothing holds it, later spans are ignored"""
+        return self.done and not self.pending
+
+class Tracer:
+    """Writes finished traces to a rotating file, one Zipkin v2 JSON array per line.
+    Sampling is tail-based: the decision is taken once a trace ends, so that slow and failed
+    traces are always kept while only a share of the others is
+
+    Attributes
+        path (str) : Path of the trace file
+        sample (float) : Share of the fast and successful traces kept
+        slow (float) : Duration from which a trace is always kept (in seconds)
+        kept (int) : Number of traces written
+        dropped (int) : Number of traces sampled out
+    """
+    def __init__(self, path=TRACE_FILE, sample=TRACE_SAMPLE_RATE, slow=TRACE_SLOW):
+        """Tracer init"""
+        self.path = path
+        self.sample = sample
+        self.slow = slow
+        self.kept = 0
+        self.dropped = 0
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.handler = RotatingFileHandler(path, maxBytes=TRACE_FILE_SIZE, backupCount=TRACE_FILE_COUNT, encoding='utf-8', delay=True)
+        self.handler.setFormatter(logging.Formatter('%(message)s'))
+        # Traces are written by a background thread, like the logs
+        records = queue.SimpleQueue()
+        self.queue_handler = DeferredQueueHandler(records)
+        self.listener = QueueListener(records, self.handler)
+        self.listener.start()
+        self.logger = logging.getLogger('edi.traces')
+        self.logger.propagate = False
+        self.logger.setLevel(logging.INFO)
+        self.logger.addHandler(self.queue_handler)
+
+    def close(self):
+        """Closes the trace file, once the queued traces are written"""
+        self.logger.removeHandler(self.queue_handler)
+        self.listener.stop()
+        self.handler.close()
+
+    def finish(self, root):
+        """Samples a finished trace and writes it if kept
+
+        Parameters
+            root (Span) : Root span of the trace
+        """
+        # Replies sent after the command returned count in its duration
+        trace = root.trace
+        elapsed = time.perf_counter() - root.start
+        if elapsed < self.slow and not trace.failed and random.random() >= self.sample:
+            self.dropped += 1
+            return
+
+        self.kept += 1
+        self.logger.info(json.dumps([span.to_dict() for span in trace.spans if span.duration is not None], separators=(',', ':')))
+
+def configure(path=TRACE_FILE, sample=TRACE_SAMPLE_RATE, slow=TRACE_SLOW):
+    """Enables tracing
+
+    Parameters
+        path (str) [optional] : Path of the trace file
+        sample (float) [optional] : Share of the fast and successful traces kept
+        slow (float) [optional] : Duration from which a trace is always kept (in seconds)
+
+    Returns
+        The Tracer object
+    """
+    global tracer
+    if tracer is not None:
+        tracer.close()
+    tracer = Tracer(path, sample, slow)
+    return tracer
+
+def start(name, **tags):
+    """Starts a trace in the current context
+
+    Parameters
+        name (str) : Name of the root span
+        tags (dict) : Annotations of the root span
+
+    Returns
+        The root Span, or None if tracing is disabled
+    """
+    if tracer is None:
+        return None
+
+    root = Span(Trace(), name, None, tags)
+    root.trace.spans.append(root)
+    current.set(root)
+    return root
+
+def finish(root, error=None):
+    """Ends a trace
+
+    Parameters
+        root (Span) : Root span returned by start (ignored if None or already ended)
+        error (str) [optional] : Name of the error the traced operation ended with
+    """
+    if root is None or root.trace.done:
+        return
+
+    if error is not None:
+        root.tags['error'] = error
+        root.trace.failed = True
+    root.finish()
+    root.trace.done = True
+    if not root.trace.pending and tracer is not None:
+        tracer.finish(root)
+
+def hold():
+    """Keeps the current trace open for work completing after the traced operation (replies sent later)
+
+    Returns
+        The current Span to pass to release, or None if there is no trace to hold
+    """
+    parent = current.get()
+    if parent is None or parent.trace.closed():
+        return None
+    parent.trace.pending += 1
+    return parent
+
+def release(parent):
+    """Releases a hold on a trace, writing it if it ended meanwhile
+
+    Parameters
+        parent (Span) : Span returned by hold (ignored if None)
+    """
+    if parent is None:
+        return
+    trace = parent.trace
+    trace.pending -= 1
+    if trace.closed() and tracer is not None:
+        tracer.finish(trace.spans[0])
+
+@contextmanager
+def span(name, parent=None, **tags):
+    """Records a child span of the current span around a block
+
+    Parameters
+        name (str) : Name of the operation
+        parent (Span) [optional] : Parent span (Default is the current span)
+        tags (dict) : Annotations of the operation
+
+    Yields
+        The Span, or None if there is no trace to record it in
+    """
+    parent = parent or current.get()
+    trace = parent.trace if parent is not None else None
+    if trace is None or trace.closed() or len(trace.spans) >= TRACE_MAX_SPANS:
+        yield None
+        return
+
+    child = Span(trace, name, parent.id, tags)
+    trace.spans.append(child)
+    token = current.set(child)
+    try:
+        yield child
+    except BaseException as exc:
+        child.tags['error'] = type(exc).__name__
+        trace.failed = True
+        raise
+    finally:
+        child.finish()
+        current.reset(token)
+
+def bind(func, *args):
+    """Binds a blocking call to the current context, to trace it in an executor thread
+
+    Parameters
+        func (callable) : Blocking function
+        args (tuple) : Arguments of the function
+
+    Returns
+        A callable running the function in a copy of the current context
+    """
+    return functools.partial(contextvars.copy_context().run, func, *args)
+
+async def before_command(ctx):
+    """Starts the trace of a command (bot before_invoke hook)
+
+    Parameters
+        ctx (commands.Context) : Invocation context
+    """
+    root = getattr(ctx, 'trace_span', None)
+    if root is None:
+        ctx.trace_span = start(f'!{ctx.command.qualified_name}', guild=getattr(ctx.guild, 'id', None), author=ctx.author.id)
+    else:
+        # Subcommands of groups are prepared after their group
+        root.name = f'!{ctx.command.qualified_name}'
+
+async def after_command(ctx):
+    """Ends the trace of a successful command (bot after_invoke hook).
+    Failed commands are ended by the error handler, with their error
+
+    Parameters
+        ctx (commands.Context) : Invocation context
+    """
+    # Groups are done before their subcommand runs
+    if ctx.command_failed or ctx.invoked_subcommand not in (None, ctx.command):
+        return
+    finish(getattr(ctx, 'trace_span', None))
@@ -31,14 +31,37 @@ EDI voice commands and listeners
 # (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
 # SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
-from async_timeout import timeout
 from discord.ext import commands
-from .plex import PlexSource
+from .frames import FrameCache, RecordingAudio, CachedAudio
+from .buffer import BufferedAudio, JitterStats
+from .outbox import Outbox, summarize
+from . import tracing
 import itertools
 import discord
 import asyncio
+import logging
+import heapq
 import os
 
+# Gateway intents needed by the cog (voice channel of the users)
+INTENTS = ('voice_states',)
+
+# Delay of inactivity before leaving a voice channel (in seconds)
+IDLE_TIMEOUT = 60
+
+# Limits the number of pending replays of a track
+MAX_REPLAYS = 10
+
+# Duration of the fade out of a skipped or stopped track, and of the fade in of the track played after it (in 20ms frames)
+FADE_OUT_FRAMES = 25
+FADE_IN_FRAMES = 10
+
+# Limits the duration of the crossfade between tracks (in seconds)
+CROSSFADE_MAX = 12
+
+# The next track is started this many frames before crossfading, for its jitter buffer to fill up
+CROSSFADE_LEAD = 50
+
 def get_np_embed(source):
     """Gets now playing embed
 
@@ -51,16 +74,103 @@ def get_np_embed(source):
         - A discord.File attachment if exists else None
     """
     attachment = None
-    fmt = f"{source.title} [{source.duration}]\n*{source.album}*"
+    fmt = f"{source.title} [{source.length}]\n*{source.album}*"
     embed = discord.Embed(title="Now playing", description=fmt, color=discord.Color.blue())
     embed.set_footer(text=f"Track requested by: {source.requester}")
-    if source.thumb is not None and os.path.isfile(source.thumb):
-        attachment = discord.File(source.thumb)
-        embed.set_thumbnail(url=f'attachment://{os.path.basename(source.thumb)}')
+    if source.thumb is not None:
+        try:
+            attachment = discord.File(source.thumb)
+            embed.set_thumbnail(url=f'attachment://{os.path.basename(source.thumb)}')
+        except OSError:
+            pass
     return (embed, attachment)
 
+class IdleTimers:
+    """Expires idle players of every guild with a single timer.
+    Deadlines are kept in a heap and only the earliest one is armed on the event loop.
+    Cancelled deadlines are lazily discarded when they reach the top of the heap
+
+    Attributes
+        loop (asyncio.AbstractEventLoop) : Event loop to arm the timer on
+        callback (callable) : Function called with the key of each expired deadline
+    """
+    def __init__(self, loop, callback):
+        """IdleTimers init"""
+        self.loop = loop
+        self.callback = callback
+        self.deadlines = {}
+        self.heap = []
+        self.handle = None
+
+    def __len__(self):
+        """Number of pending deadlines"""
+        return len(self.deadlines)
+
+    def schedule(self, key, delay):
+        """Schedules (or reschedules) a deadline
+
+        Parameters
+            key (hashable) : Key of the deadline
+            delay (float) : Delay before expiry in seconds
+        """
+        deadline = self.loop.time() + delay
+        self.deadlines[key] = deadline
+        heapq.heappush(self.heap, (deadline, key))
+
+        # Rebuild the heap when cancelled deadlines pile up
+        if len(self.heap) > 2 * len(self.deadlines) + 64:
+            self.heap = [(d, k) for k, d in self.deadlines.items()]
+            heapq.heapify(self.heap)
+
+        if self.handle is None or deadline < self.handle.when():
+            self.arm(deadline)
+
+    def cancel(self, key):
+        """Cancels a deadline if any
+
+        Parameters
+            key (hashable) : Key of the deadline
+        """
+        self.deadlines.pop(key, None)
+
+    def arm(self, deadline):
+        """Arms the timer on the event loop
+
+        Parameters
+            deadline (float) : Event loop time to wake up at
+        """
+        if self.handle is not None:
+            self.handle.cancel()
+        self.handle = self.loop.call_at(deadline, self.expire)
+
+    def expire(self):
+        """Fires expired deadlines and arms the timer for the next one"""
+        self.handle = None
+        now = self.loop.time()
+
+        while self.heap:
+            deadline, key = self.heap[0]
+            if self.deadlines.get(key) != deadline:
+                heapq.heappop(self.heap) # Cancelled or rescheduled
+            elif deadline <= now:
+                heapq.heappop(self.heap)
+                del self.deadlines[key]
+                self.callback(key)
+            else:
+                return self.arm(deadline)
+
+    def stop(self):
+        """Cancels every deadline"""
+        if self.handle is not None:
+            self.handle.cancel()
+        self.handle = None
+        self.deadlines.clear()
+        self.heap.clear()
+
 class VoicePlayer:
     """A voice player which implements a queue and a loop for each guild.
+    When the queue is empty, the loop ends and the player hibernates until a track is enqueued.
+    A player hibernating for too long is destroyed by the cog idle timers.
     When the bot is disconnected from voice channel, the player is destroyed
 
     Attributes
@@ -77,10 +187,36 @@ class VoicePlayer:
         self.next = asyncio.Event()
 
         self.loop = False
+        self.replays = 0
+        self.jitter = JitterStats()
         self.volume = .5
         self.current = None
+        self.crossfade = 0
+        self.incoming = None
+        self.fade = False
 
-        ctx.bot.loop.create_task(self.player_loop())
+        self.task = None
+        self.hibernate()
+
+    async def enqueue(self, track):
+        """Adds a track to the queue, waking up the player if needed
+
+        Parameters
+            track (QueuedTrack) : Track to add
+        """
+        await self.queue.put(track)
+        self.wake()
+
+    def wake(self):
+        """Starts the player loop if the player hibernates"""
+        if self.task is None or self.task.done():
+            self.cog.idle.cancel(self.guild.id)
+            self.task = self.bot.loop.create_task(self.player_loop())
+
+    def hibernate(self):
+        """Ends the player loop and arms the idle timer"""
+        self.task = None
+        self.cog.idle.schedule(self.guild.id, IDLE_TIMEOUT)
 
     async def player_loop(self):
         """Main player loop"""
@@ -89,32 +225,221 @@ class VoicePlayer:
         while not self.bot.is_closed():
             self.next.clear()
 
-            # Wait for the next track
-            # If we timeout, cancel the player and disconnect...
+            # Track started under the end of the previous one
+            if self.incoming is not None:
+                track, source, cache = self.incoming
+                self.incoming = None
+                handed = True
+            else:
+                # Nothing left to play, hibernate until the next track
+                if self.queue.empty():
+                    return self.hibernate()
+
+                track = self.queue.get_nowait()
+                handed = False
+
+                # Check consistency (not against QueuedTrack, which changes when the Plex cog is reloaded)
+                if not hasattr(track, 'create_source'):
+                    self.cog.outbox.post(self.channel, "Unmanaged track detected. Skipping...")
+                    continue
+
+            # Each track start is traced from its source to its now playing message
+            root = tracing.start('player.track', guild=self.guild.id, crossfade=handed)
+
+            # Queued tracks only open their audio source when played
+            if not handed:
+                try:
+                    source, cache = self.prepare(track.create_source(self.volume))
+                except (discord.ClientException, OSError) as exc:
+                    logging.error(f"Can not open track {track.title}: {exc}", extra={'guild': self.guild.id})
+                    tracing.finish(root, error=type(exc).__name__)
+                    track.cleanup()
+                    self.cog.outbox.post(self.channel, f"Can not play `{track.title}`. Skipping...")
+                    continue
+
+            # Play track
             try:
-                async with timeout(60): # 1 min...
-                    source = await self.queue.get()
-            except asyncio.TimeoutError:
-                return self.destroy(self.guild)
+                self.current = source
+                if not handed:
+                    source.volume = self.volume
+                    # Tracks played after a skip fade in
+                    if self.fade and hasattr(source, 'fade_in'):
+                        source.fade_in(FADE_IN_FRAMES)
+                    if not self.play(source):
+                        tracing.finish(root, error='PlayFailed')
+                        # Left the voice channel meanwhile: keep the queue until the player is woken up or expires
+                        if self.guild.voice_client is None:
+                            return self.hibernate()
+                        continue
+                self.cue(source)
+
+                # Send now playing embed, superseding the one of a track skipped before it went out
+                embed, attachment = get_np_embed(source)
+                self.cog.outbox.post(self.channel, embed=embed, file=attachment, key='np')
+                tracing.finish(root)
+                await self.next.wait()
+
+                # Play track again while looping, from the frame cache if it was recorded
+                while self.repeat(source):
+                    if cache is not None and cache.replayable():
+                        # The recorded source is released before being replaced, its frames stay in the cache
+                        source.original.cleanup()
+                        source.original = CachedAudio(cache)
+                    else:
+                        source.cleanup()
+                        if cache is not None:
+                            cache.close()
+                        try:
+                            source, cache = self.prepare(track.create_source(self.volume))
+                        except (discord.ClientException, OSError) as exc:
+                            # Nothing left to release but the track (source cleanups are idempotent)
+                            logging.error(f"Can not open track {track.title} again: {exc}", extra={'guild': self.guild.id})
+                            cache = None
+                            break
+                        source.volume = self.volume
+                        self.current = source
+
+                    self.next.clear()
+                    if not self.play(source):
+                        break
+                    await self.next.wait()
+            finally:
+                # Prepare for next track, releasing the frame cache and the track
+                # (a source crossfaded into the next track is released by it, along with its track, once faded out)
+                if self.incoming is None:
+                    source.cleanup()
+                    track.cleanup()
+                if cache is not None:
+                    cache.close()
+                self.fade = getattr(source, 'fading_out', False)
+                self.current = None
+                self.replays = 0
+
+    def play(self, source):
+        """Plays a source on the voice client, the player loop is notified when it ends
 
-            # Check consistency
-            if not isinstance(source, PlexSource):
-                await self.channel.send("Unmanaged track detected. Skipping...")
-                continue
+        Parameters
+            source (discord.AudioSource) : Audio source to play
 
-            # Play track
-            source.volume = self.volume
-            self.current = source
-            self.guild.voice_client.play(source, after=lambda _: self.bot.loop.call_soon_threadsafe(self.next.set))
+        Returns
+            True if the source is playing, False if the bot left the voice channel or can not play it
+        """
+        vc = self.guild.voice_client
+        if vc is None:
+            return False
+
+        try:
+            vc.play(source, after=lambda _: self.bot.loop.call_soon_threadsafe(self.next.set))
+        except discord.ClientException as exc:
+            logging.error(f"Can not play {getattr(source, 'title', 'source')}: {exc}", extra={'guild': self.guild.id})
+            return False
+        return True
+
+    def cue(self, source):
+        """Starts the next track under the end of the current one when crossfading
+
+        Parameters
+            source (discord.AudioSource) : Audio source of the current track
+        """
+        if not self.crossfade or not hasattr(source, 'notify_end'):
+            return
 
-            # Send now playing embed
-            embed, attachment = get_np_embed(source)
-            await self.channel.send(file=attachment, embed=embed)
-            await self.next.wait()
+        frames = int(self.crossfade * 50)
+        source.notify_end(frames + CROSSFADE_LEAD, lambda: asyncio.run_coroutine_threadsafe(self.crossfade_next(source, frames), self.bot.loop))
 
-            # Prepare for next track
-            source.cleanup()
-            self.current = None
+    def can_crossfade(self, source):
+        """Checks if the next track can be started under the current one
+
+        Parameters
+            source (discord.AudioSource) : Audio source of the current track
+
+        Returns
+            True if the current track is playing to its end and the next one is decoded to PCM
+        """
+        vc = self.guild.voice_client
+        return (source is self.current and not self.loop and not self.replays and not source.fading_out
+                and not self.queue.empty() and getattr(self.queue._queue[0], 'crossfades', False)
+                and vc is not None and vc.is_playing())
+
+    async def crossfade_next(self, source, frames):
+        """Starts the next track under the end of the current one, once its jitter buffer is filled
+
+        Parameters
+            source (PlexSource) : Audio source of the current track
+            frames (int) : Duration of the crossfade (in 20ms frames)
+        """
+        if not self.can_crossfade(source):
+            return
+
+        # Nothing awaits this coroutine (started from the audio thread): errors are logged here,
+        # and the track is left in the queue to be played once the current one ended
+        track = self.queue._queue[0]
+        incoming = cache = None
+        try:
+            incoming, cache = self.prepare(track.create_source(self.volume))
+            incoming.volume = self.volume
+            ready = await self.bot.loop.run_in_executor(None, incoming.original.wait_ready)
+        except Exception as exc:
+            logging.error(f"Can not crossfade into {track.title}: {exc}", extra={'guild': self.guild.id})
+            ready = False
+
+        # The track may have failed or been skipped, or the queue changed meanwhile
+        if not ready or not self.can_crossfade(source) or self.queue._queue[0] is not track:
+            if incoming is not None:
+                incoming.cleanup()
+            if cache is not None:
+                cache.close()
+            return
+
+        self.queue.get_nowait()
+        incoming.crossfade(source, frames)
+        self.incoming = (track, incoming, cache)
+        self.guild.voice_client.source = incoming
+        self.next.set()
+
+    def prepare(self, source):
+        """Wraps the PCM source of a track in a jitter buffer, recording its frames if the player loops
+
+        Parameters
+            source (discord.AudioSource) : Audio source of the track
+
+        Returns
+            A tuple composed of:
+            - The audio source to play
+            - The FrameCache recording the track if any else None
+        """
+        # Already encoded sources (radio stations) are live and can not be replayed
+        if not isinstance(source, discord.PCMVolumeTransformer):
+            return (source, None)
+
+        # Frames are recorded as decoded, before the silence of underruns
+        cache = FrameCache() if self.loop or self.replays else None
+        original = RecordingAudio(source.original, cache) if cache is not None else source.original
+        source.original = BufferedAudio(original, self.jitter)
+        return (source, cache)
+
+    def repeat(self, source):
+        """Checks if the track that just ended must be played again
+
+        Parameters
+            source (discord.AudioSource) : Audio source of the track
+
+        Returns
+            True if the player loops or has replays left and the track was neither skipped nor truncated
+        """
+        if not getattr(source, 'original', None) or not getattr(source.original, 'done', False):
+            return False
+
+        if self.replays:
+            self.replays -= 1
+            return True
+        return self.loop
+
+    def clear(self):
+        """Clears the queue and releases the queued tracks"""
+        for _ in range(self.queue.qsize()):
+            self.queue.get_nowait().cleanup()
+            self.queue.task_done()
 
     def destroy(self, guild):
         """Disconnects and cleanup the player
@@ -154,7 +479,55 @@ class CogVoice(commands.Cog, name='Voice'):
     def __init__(self, bot):
         """CogVoice init"""
         self.bot = bot
-        self.players = {}
+        self.idle = IdleTimers(bot.loop, self.expire)
+
+        # Players and pending messages are kept by the bot so that they survive a reload of the cog
+        if not hasattr(bot, 'voice_players'):
+            bot.voice_players = {}
+        if not hasattr(bot, 'outbox'):
+            bot.outbox = Outbox(bot.loop)
+        self.players = bot.voice_players
+        self.outbox = bot.outbox
+        for player in self.players.values():
+            self.adopt(player)
+
+    def cog_unload(self):
+        """Cancels the idle timers when the cog is removed.
+        Players are left running, they are adopted by the cog when it is loaded again"""
+        self.idle.stop()
+
+    def caches(self):
+        """Gets the caches of the cog, for memory reports
+
+        Returns
+            A dict of cache entries by cache name
+        """
+        return {
+            'players': self.players.values(),
+            'outbox': self.outbox.mailboxes.values(),
+        }
+
+    def adopt(self, player):
+        """Takes over a player of a previous instance of the cog
+
+        Parameters
+            player (VoicePlayer) : Player to adopt
+        """
+        # Running player loops keep their code until they hibernate, later calls use the reloaded one
+        player.__class__ = VoicePlayer
+        player.cog = self
+        if player.task is None or player.task.done():
+            self.idle.schedule(player.guild.id, IDLE_TIMEOUT)
+
+    def expire(self, guild_id):
+        """Destroys a player that hibernated for too long
+
+        Parameters
+            guild_id (int) : ID of the guild of the player
+        """
+        player = self.players.get(guild_id)
+        if player is not None and (player.task is None or player.task.done()):
+            player.destroy(player.guild)
 
     def get_player(self, ctx):
         """Retrieves the guild player, or create one
@@ -185,6 +558,18 @@ class CogVoice(commands.Cog, name='Voice'):
         del player.queue._queue[pos-1]
         return track
 
+    def fade_stop(self, vc):
+        """Stops the current track, fading it out if it is playing (a second stop during the fade is immediate)
+
+        Parameters
+            vc (discord.VoiceClient) : Voice client of the guild
+        """
+        source = vc.source
+        if vc.is_playing() and hasattr(source, 'fade_out') and not source.fading_out:
+            source.fade_out(FADE_OUT_FRAMES)
+        else:
+            vc.stop()
+
     async def cleanup(self, guild):
         """Disconnects and cleanup the player of a guild
 
@@ -196,10 +581,12 @@ class CogVoice(commands.Cog, name='Voice'):
         except AttributeError:
             pass
 
-        try:
-            del self.players[guild.id]
-        except KeyError:
-            pass
+        self.idle.cancel(guild.id)
+        player = self.players.pop(guild.id, None)
+        if player is not None:
+            if player.task is not None:
+                player.task.cancel()
+            player.clear()
 
     @commands.command(name='join')
     async def join(self, ctx, *channel):
@@ -233,13 +620,15 @@ class CogVoice(commands.Cog, name='Voice'):
         if ctx.voice_client is not None:
             # Move bot if already in a voice channel
             try:
-                await ctx.voice_client.move_to(ch)
+                with tracing.span('discord.voice_move', channel=ch.id):
+                    await ctx.voice_client.move_to(ch)
             except asyncio.TimeoutError:
                 raise VoiceConnectionError(f"Moving to channel {ch} timed out...")
         else:
             # Connect bot to a voice channel
             try:
-                await ch.connect()
+                with tracing.span('discord.voice_connect', channel=ch.id):
+                    await ch.connect()
             except asyncio.TimeoutError:
                 raise VoiceConnectionError(f"Connecting to channel {ch} timed out...")
 
@@ -252,7 +641,7 @@ class CogVoice(commands.Cog, name='Voice'):
         """
         player = self.get_player(ctx)
         embed, attachment = get_np_embed(player.current)
-        await ctx.send(file=attachment, embed=embed)
+        self.outbox.reply(ctx, embed=embed, file=attachment)
 
     @commands.command(name='queue')
     async def queue_info(self, ctx):
@@ -268,12 +657,12 @@ class CogVoice(commands.Cog, name='Voice'):
         else:
             nb_tracks = player.queue.qsize()
             tracks = list(itertools.islice(player.queue._queue, 0, nb_tracks))
-            fmt = f"__Now playing__:\n**{player.current.title}** [{player.current.duration}] *{player.current.album}*\n__Up next__:\n"
-            fmt = fmt + '\n'.join(f"{index + 1}. {track.title} [{track.duration}] *{track.album}*" for index, track in enumerate(tracks))
+            fmt = f"__Now playing__:\n**{player.current.title}** [{player.current.length}] *{player.current.album}*\n__Up next__:\n"
+            fmt = fmt + '\n'.join(f"{index + 1}. {track.title} [{track.length}] *{track.album}*" for index, track in enumerate(tracks))
 
         embed = discord.Embed(title="Player queue", description=fmt, color=discord.Color.blue())
         embed.set_footer(text=f"Requester: {ctx.author.display_name}")
-        await ctx.send(embed=embed)
+        self.outbox.reply(ctx, embed=embed)
 
     @commands.command(name='volume')
     async def change_volume(self, ctx, vol: float=None):
@@ -288,12 +677,16 @@ class CogVoice(commands.Cog, name='Voice'):
         # Get volume
         if vol is None:
             embed = discord.Embed(title="Player info", description=f"Volume is set to **{vc.source.volume*100}%**", color=discord.Color.blue())
-            return await ctx.send(embed=embed)
+            return self.outbox.reply(ctx, embed=embed, key='volume', edit=True)
 
         # Check consistency
         if not 0 <= vol <= 100:
             raise VoiceInvalidValue(f"Please enter a value between `1` and `100` {ctx.author.mention}")
 
+        # Already encoded sources (radio stations) share their frames between guilds
+        if not isinstance(vc.source, discord.PCMVolumeTransformer):
+            raise VoiceInvalidValue(f"The volume of a radio station can not be changed {ctx.author.mention}")
+
         # Change volume
         player = self.get_player(ctx)
         vc.source.volume = vol / 100
@@ -301,7 +694,7 @@ class CogVoice(commands.Cog, name='Voice'):
 
         embed = discord.Embed(title="Player info", description=f"Volume has been set to **{vol}%**", color=discord.Color.blue())
         embed.set_footer(text=f"Requester: {ctx.author.display_name}")
-        await ctx.send(embed=embed)
+        self.outbox.reply(ctx, embed=embed, key='volume', edit=True)
 
     @commands.command(name='pause')
     async def pause(self, ctx):
@@ -316,7 +709,7 @@ class CogVoice(commands.Cog, name='Voice'):
         ctx.voice_client.pause()
         embed = discord.Embed(title="Player info", description="Player has been paused", color=discord.Color.blue())
         embed.set_footer(text=f"Requester: {ctx.author.display_name}")
-        await ctx.send(embed=embed)
+        self.outbox.reply(ctx, embed=embed, key='playback', edit=True)
 
     @commands.command(name='resume')
     async def resume(self, ctx):
@@ -331,7 +724,7 @@ class CogVoice(commands.Cog, name='Voice'):
         ctx.voice_client.resume()
         embed = discord.Embed(title="Player info", description="Player has been resumed", color=discord.Color.blue())
         embed.set_footer(text=f"Requester: {ctx.author.display_name}")
-        await ctx.send(embed=embed)
+        self.outbox.reply(ctx, embed=embed, key='playback', edit=True)
 
     @commands.command(name='skip')
     async def skip(self, ctx, step: int=None):
@@ -345,15 +738,107 @@ class CogVoice(commands.Cog, name='Voice'):
 
         # Check consistency
         if step is None or step == 1:
-            return ctx.voice_client.stop()
+            return self.fade_stop(ctx.voice_client)
 
         if player.queue.empty() or not 0 < step < player.queue.qsize()+1:
             raise VoiceInvalidValue(f"Invalid skip step {ctx.author.mention}")
 
         for _ in range(step):
-            self.remove_from_queue(ctx, player, 1)
+            self.remove_from_queue(ctx, player, 1).cleanup()
+
+        self.fade_stop(ctx.voice_client)
+
+    @commands.command(name='loop')
+    async def loop(self, ctx):
+        """Loops on the current track, or stops looping
+
+        Parameters
+            ctx (commands.Context) : Invocation context
+        """
+        player = self.get_player(ctx)
+        player.loop = not player.loop
+
+        embed = discord.Embed(title="Player info", description=f"Loop is **{'on' if player.loop else 'off'}**", color=discord.Color.blue())
+        embed.set_footer(text=f"Requester: {ctx.author.display_name}")
+        self.outbox.reply(ctx, embed=embed, key='loop', edit=True)
+
+    @commands.command(name='replay')
+    async def replay(self, ctx, times: int=None):
+        """Replays the current track once it ends
+
+        Parameters
+            ctx (commands.Context) : Invocation context
+            times (int) [optional] : Number of replays (default is 1)
+        """
+        player = self.get_player(ctx)
+
+        # Check consistency
+        times = 1 if times is None else times
+        if not 0 < times <= MAX_REPLAYS:
+            raise VoiceInvalidValue(f"Please enter a number of replays between `1` and `{MAX_REPLAYS}` {ctx.author.mention}")
+
+        player.replays = min(MAX_REPLAYS, player.replays + times)
+        embed = discord.Embed(title="Player info", description=f"Current track will be replayed **{player.replays}** times", color=discord.Color.blue())
+        embed.set_footer(text=f"Requester: {ctx.author.display_name}")
+        self.outbox.reply(ctx, embed=embed, key='replay', edit=True)
 
-        ctx.voice_client.stop()
+    @commands.command(name='crossfade')
+    async def crossfade(self, ctx, seconds: float=None):
+        """Gets or changes the crossfade between tracks
+
+        Parameters
+            ctx (commands.Context) : Invocation context
+            seconds (int or float) [optional] : Duration of the crossfade (0 disables it)
+        """
+        player = self.get_player(ctx)
+
+        # Change crossfade
+        if seconds is not None:
+            if not 0 <= seconds <= CROSSFADE_MAX:
+                raise VoiceInvalidValue(f"Please enter a duration between `0` and `{CROSSFADE_MAX}` seconds {ctx.author.mention}")
+            player.crossfade = seconds
+
+        state = f"{player.crossfade:g}s" if player.crossfade else "off"
+        embed = discord.Embed(title="Player info", description=f"Crossfade is **{state}**", color=discord.Color.blue())
+        embed.set_footer(text=f"Requester: {ctx.author.display_name}")
+        self.outbox.reply(ctx, embed=embed, key='crossfade', edit=True)
+
+    @commands.command(name='jitter', hidden=True)
+    @commands.is_owner()
+    async def jitter(self, ctx):
+        """Shows the jitter buffer statistics of the guild players (most underruns first)
+
+        Parameters
+            ctx (commands.Context) : Invocation context
+        """
+        players = sorted(self.players.values(), key=lambda player: player.jitter.underruns, reverse=True)
+        embed = discord.Embed(title="Jitter buffers", description=None if players else "No player", color=discord.Color.blue())
+        for player in players[:25]:
+            stats = player.jitter
+            embed.add_field(name=player.guild.name, value=f"{stats.frames} frames\n"
+                                                          f"{stats.late} late / {stats.underruns} underruns\n"
+                                                          f"Depth: {stats.depth * 20} ms")
+        embed.set_footer(text=f"Requester: {ctx.author.display_name}")
+        await ctx.send(embed=embed)
+
+    @commands.command(name='outbox', hidden=True)
+    @commands.is_owner()
+    async def outbox_stats(self, ctx):
+        """Shows the outbound message pipeline statistics
+
+        Parameters
+            ctx (commands.Context) : Invocation context
+        """
+        outbox = self.outbox
+        embed = discord.Embed(title="Outbox", color=discord.Color.blue())
+        embed.add_field(name="Messages", value=f"{outbox.posted} queued / {len(outbox)} pending\n"
+                                               f"{outbox.sent} sent / {outbox.edited} edited\n"
+                                               f"{outbox.coalesced} coalesced / {outbox.failed} failed")
+        for name, samples in (("Reply latency", outbox.latency), ("Queue wait", outbox.waits)):
+            stats = summarize(samples)
+            embed.add_field(name=name, value=f"p50 {stats[0]} ms\np95 {stats[1]} ms" if stats else "No sample")
+        embed.set_footer(text=f"Requester: {ctx.author.display_name}")
+        await ctx.send(embed=embed)
 
     @commands.command(name='remove')
     async def remove_track(self, ctx, pos: int=None):
@@ -368,16 +853,18 @@ class CogVoice(commands.Cog, name='Voice'):
         # Check consistency
         if pos is None:
             track = self.remove_from_queue(ctx, player, 1)
-            embed = discord.Embed(title="Player info", description=f"Removed {track.title} [{track.duration}] *{track.album}*", color=discord.Color.blue())
-            return await ctx.send(embed=embed)
+            track.cleanup()
+            embed = discord.Embed(title="Player info", description=f"Removed {track.title} [{track.length}] *{track.album}*", color=discord.Color.blue())
+            return self.outbox.reply(ctx, embed=embed)
 
         if player.queue.empty() or not 0 < pos < player.queue.qsize()+1:
             raise VoiceInvalidValue(f"Invalid position in the queue {ctx.author.mention}")
 
         # Remove specified track
         track = self.remove_from_queue(ctx, player, pos)
-        embed = discord.Embed(title="Player info", description=f"Removed {track.title} [{track.duration}] *{track.album}*", color=discord.Color.blue())
-        await ctx.send(embed=embed)
+        track.cleanup()
+        embed = discord.Embed(title="Player info", description=f"Removed {track.title} [{track.length}] *{track.album}*", color=discord.Color.blue())
+        self.outbox.reply(ctx, embed=embed)
 
     @commands.command(name='clear')
     async def clear(self, ctx):
@@ -389,13 +876,11 @@ class CogVoice(commands.Cog, name='Voice'):
         player = self.get_player(ctx)
 
         # Clear the queue
-        for _ in range(player.queue.qsize()):
-            player.queue.get_nowait()
-            player.queue.task_done()
+        player.clear()
 
         embed = discord.Embed(title="Player info", description="Player queue cleared", color=discord.Color.blue())
         embed.set_footer(text=f"Requester: {ctx.author.display_name}")
-        await ctx.send(embed=embed)
+        self.outbox.reply(ctx, embed=embed, key='queue', edit=True)
 
     @commands.command(name='stop')
     async def stop(self, ctx):
@@ -407,15 +892,13 @@ class CogVoice(commands.Cog, name='Voice'):
         player = self.get_player(ctx)
 
         # Clear the queue
-        for _ in range(player.queue.qsize()):
-            player.queue.get_nowait()
-            player.queue.task_done()
+        player.clear()
 
         # Stop current track
-        ctx.voice_client.stop()
+        self.fade_stop(ctx.voice_client)
         embed = discord.Embed(title="Player info", description="Player cleared and stopped", color=discord.Color.blue())
         embed.set_footer(text=f"Requester: {ctx.author.display_name}")
-        await ctx.send(embed=embed)
+        self.outbox.reply(ctx, embed=embed, key='playback', edit=True)
 
     @commands.command(name='leave')
     async def leave(self, ctx):
@@ -428,6 +911,7 @@ class CogVoice(commands.Cog, name='Voice'):
 
     @queue_info.before_invoke
     @change_volume.before_invoke
+    @crossfade.before_invoke
     @remove_track.before_invoke
     @clear.before_invoke
     @leave.before_invoke
@@ -444,6 +928,8 @@ class CogVoice(commands.Cog, name='Voice'):
     @pause.before_invoke
     @resume.before_invoke
     @skip.before_invoke
+    @loop.before_invoke
+    @replay.before_invoke
     @stop.before_invoke
     async def ensure_play(self, ctx):
         """Ensures that EDI is in a voice channel and player is active
@@ -456,3 +942,11 @@ class CogVoice(commands.Cog, name='Voice'):
             raise VoiceNotConnected(f"I'm not currently in a voice channel {ctx.author.mention}")
         elif not vc.is_playing() and not vc.is_paused():
             raise VoiceNotPlaying(f"I'm not currently playing anything {ctx.author.mention}")
+
+def setup(bot):
+    """Loads the extension
+
+    Parameters
+        bot (commands.Bot) : Bot to add the cog to
+    """
+    bot.add_cog(CogVoice(bot))
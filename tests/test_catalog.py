@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+"""
+EDI catalog snapshot tests
+"""
+#
+# Copyright (c) 2022, Marc GIANNETTI <mgtti.pro@gmail.com>
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+#  - Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+#
+#  - Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+#  - Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON
+# ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+from cogs.catalog import Catalog, CatalogAlbum, CatalogTrack, write
+import tempfile
+import unittest
+import os
+
+def album(title, key):
+    """Builds an album of a snapshot"""
+    return CatalogAlbum(title, f'Artist {title}', key, 1600000000 + key)
+
+def track(title, key):
+    """Builds a track of a snapshot"""
+    return CatalogTrack(title, 1000 * key, key, f'dir/{title}.flac')
+
+class TestCatalogSearch(unittest.TestCase):
+    """Searches of a snapshot stay within the keys of the section"""
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        path = os.path.join(self.dir.name, 'catalog.bin')
+        write(path, [('Games Music', [(album('Abzû', 1), [track('a', 11)]), (album('Zelda', 2), [track('b', 21)])]),
+                     ('Music', [(album('Ärger', 3), [track('x', 31)]), (album('Tetris', 4), [track('t', 41)])])])
+        self.catalog = Catalog(path)
+
+    def tearDown(self):
+        self.catalog.current = None
+        self.dir.cleanup()
+
+    def test_section_title(self):
+        """A substring of the section title matches no album"""
+        self.assertIsNone(self.catalog.search('Games Music', 'ames', 20))
+        self.assertIsNone(self.catalog.search('Music', 'usic', 20))
+
+    def test_last_album(self):
+        """The last album of the last section is found"""
+        self.assertEqual(self.catalog.search('Music', 'tetris', 20), ['Tetris'])
+        self.assertEqual(self.catalog.find('Music', 'tetris')[0].title, 'Tetris')
+        self.assertEqual(self.catalog.search('Music', 'r', 20), ['Ärger', 'Tetris'])
+
+if __name__ == '__main__':
+    unittest.main()